@@ -1,11 +1,27 @@
 #!/usr/bin/env python3
 import argparse
+import fnmatch
+import gzip
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from bids_index import BIDSIndex
 
-def check_required_files(folder):
+# 이 값 이하의 b-value는 b0로 봅니다
+B0_THRESHOLD = 50
+# b-value를 이 단위로 반올림해 shell을 구분합니다
+SHELL_ROUNDING = 100
+# non-b0 gradient vector의 norm이 1에서 이만큼 이상 벗어나면 오류
+NORM_TOLERANCE = 0.01
+# NIfTI-1 header 크기 (NIfTI-2는 540)
+NIFTI1_HEADER, NIFTI2_HEADER = 348, 540
+
+
+def check_required_files(index, subject, session, modality):
     """
-    지정한 폴더 내에 .bvec, .bval, .nii.gz 파일이 각각 하나라도 있는지 확인합니다.
+    index의 subject/session/modality 폴더 내에 .bvec, .bval, .nii.gz 파일이 각각 하나라도 있는지 확인합니다.
     누락된 파일 유형을 리스트로 반환합니다.
     """
     missing = []
@@ -15,68 +31,261 @@ def check_required_files(folder):
         "bval": "*.bval",
         "nii.gz": "*.nii.gz"
     }
+    # 폴더 listing은 한 번만 가져와 세 pattern에 사용
+    names = index.entries(subject, session, modality)
     for file_type, pattern in file_patterns.items():
-        if not list(folder.glob(pattern)):
+        if not fnmatch.filter(names, pattern):
             missing.append(file_type)
     return missing
 
 
-def process_folder(subject_label, session_label, base_folder):
+def process_folder(index, subject_label, session_label):
     """
-    base_folder(세션 폴더 또는 subject 폴더 내)의 dwi 및 BACKUP-dwi 폴더를 확인하여
+    세션 폴더 (session_label이 "N/A"이면 subject 폴더) 내의 dwi 및 BACKUP-dwi 폴더를 확인하여
     누락된 항목(폴더 없음 또는 파일 누락)이 있으면 error 메시지를 리스트로 반환합니다.
     """
     errors = []
+    session = None if session_label == "N/A" else session_label
 
     # dwi 폴더 확인
-    dwi_folder = base_folder / "dwi"
-    if not dwi_folder.exists():
+    if not index.has_dir(subject_label, session, "dwi"):
         errors.append(f"{subject_label} - {session_label}: dwi 폴더가 존재하지 않습니다.")
     else:
-        missing = check_required_files(dwi_folder)
+        missing = check_required_files(index, subject_label, session, "dwi")
         if missing:
             errors.append(f"{subject_label} - {session_label} dwi 폴더에서 누락된 파일: {', '.join(missing)}")
 
     # BACKUP-dwi 폴더 확인
-    # backup_folder = base_folder / "BACKUP-dwi"
-    # if not backup_folder.exists():
+    # if not index.has_dir(subject_label, session, "BACKUP-dwi"):
     #     errors.append(f"{subject_label} - {session_label}: BACKUP-dwi 폴더가 존재하지 않습니다.")
     # else:
-    #     missing = check_required_files(backup_folder)
+    #     missing = check_required_files(index, subject_label, session, "BACKUP-dwi")
     #     if missing:
     #         errors.append(f"{subject_label} - {session_label} BACKUP-dwi 폴더에서 누락된 파일: {', '.join(missing)}")
 
     return errors
 
 
-def main(bids_dir):
+def check_subject(index, subject_label):
+    """
+    subject의 각 세션에 대해 process_folder를 실행하고 (session, error 메시지 목록) 목록을 반환합니다.
+    """
+    # session 폴더가 있으면 각 session 폴더 내의 dwi 및 BACKUP-dwi 폴더를 확인
+    # session 폴더가 없는 경우, subject 폴더 자체 내에서 dwi 및 BACKUP-dwi 폴더 확인
+    session_dirs = index.sessions(subject_label) or ["N/A"]
+    return [(session_label, process_folder(index, subject_label, session_label)) for session_label in session_dirs]
+
+
+def dwi_runs(index, modality="dwi"):
+    """
+    index의 모든 DWI run을 (subject, session, 확장자 없는 경로) 목록으로 반환합니다 (session이 없으면 "N/A").
+    """
+    runs = []
+    for subject_label in index.subjects():
+        for session_label in index.sessions(subject_label) or ["N/A"]:
+            session = None if session_label == "N/A" else session_label
+            folder = index.path(subject_label, session, modality)
+            for name in index.files(subject_label, session, modality, "*_dwi.nii*"):
+                stem = name[:-len(".nii.gz")] if name.endswith(".gz") else name[:-len(".nii")]
+                runs.append((subject_label, session_label, str(folder / stem)))
+    return runs
+
+
+def read_run(stem):
+    """
+    run 하나의 NIfTI header (처음 540 bytes, voxel data는 읽지 않음), bval, bvec 내용을 읽습니다.
+    parse는 check_gradients에서 dataset 전체에 대해 한 번에 합니다.
+
+    Returns:
+        tuple: (header bytes, bval 문자열, bvec 문자열, 오류 메시지 목록)
+    """
+    errors = []
+    header = bval = bvec = None
+    for extension, opener in ((".nii.gz", gzip.open), (".nii", open)):
+        try:
+            with opener(stem + extension, "rb") as f:
+                header = f.read(NIFTI2_HEADER)
+            break
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            errors.append(f"NIfTI header를 읽을 수 없습니다: {e}")
+            break
+    for extension in ("bval", "bvec"):
+        try:
+            with open(stem + "." + extension, "r") as f:
+                text = f.read()
+        except OSError:
+            errors.append(f".{extension} 파일이 없습니다.")
+            text = None
+        if extension == "bval":
+            bval = text
+        else:
+            bvec = text
+    return header, bval, bvec, errors
+
+
+def header_volumes(headers):
+    """
+    NIfTI header bytes 목록에서 4번째 dimension (volume 수)을 NumPy로 한 번에 읽습니다.
+    sizeof_hdr로 NIfTI-1/NIfTI-2와 byte order를 구분하며, 읽을 수 없는 header는 -1입니다.
+    """
+    import numpy as np
+
+    raw = np.zeros((len(headers), NIFTI2_HEADER), dtype=np.uint8)
+    for i, header in enumerate(headers):
+        if header:
+            raw[i, :len(header)] = np.frombuffer(header, dtype=np.uint8)
+    volumes = np.full(len(headers), -1, dtype=np.int64)
+    for order in ("<", ">"):
+        size = raw[:, :4].copy().view(order + "i4")[:, 0]
+        # NIfTI-1: dim (int16 × 8)는 offset 40, NIfTI-2: dim (int64 × 8)는 offset 16
+        for header_size, offset, dtype in ((NIFTI1_HEADER, 40, "i2"), (NIFTI2_HEADER, 16, "i8")):
+            rows = size == header_size
+            if rows.any():
+                width = np.dtype(dtype).itemsize
+                dims = raw[rows, offset:offset + 8 * width].copy().view(order + dtype)
+                volumes[rows] = np.where(dims[:, 0] >= 4, dims[:, 4], 1)
+    return volumes
+
+
+def check_gradients(index, workers=8):
+    """
+    dataset의 모든 DWI run의 gradient table을 확인합니다. 파일은 thread pool로 읽고,
+    검사는 모든 run을 (run 수 × 최대 volume 수) 배열로 모아 NumPy로 한 번에 합니다.
+
+      - bval, bvec 항목 수와 NIfTI의 4번째 dimension이 같은지
+      - bvec이 3행이고, b0가 아닌 volume의 vector norm이 1인지 (b0는 0 또는 1)
+      - b0 volume이 있는지
+      - shell 구성 (b-value를 SHELL_ROUNDING 단위로 반올림한 집합)이 dataset에서 가장 많은 구성과 같은지
+
+    Returns:
+        list: (subject, session, run 이름, error 메시지 목록) 목록 (문제가 없는 run은 빈 목록)
+    """
+    import numpy as np
+
+    runs = dwi_runs(index)
+    if not runs:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        contents = list(executor.map(lambda run: read_run(run[2]), runs))
+
+    errors = [list(content[3]) for content in contents]
+    volumes = header_volumes([content[0] for content in contents])
+    bvals, bvecs = [], []
+    for i, (header, bval, bvec, _) in enumerate(contents):
+        try:
+            values = np.array(bval.split(), dtype=float) if bval is not None else np.zeros(0)
+        except ValueError:
+            errors[i].append(".bval 파일을 읽을 수 없습니다.")
+            values = np.zeros(0)
+        try:
+            rows = [line.split() for line in bvec.splitlines() if line.strip()] if bvec is not None else []
+            vectors = np.array(rows, dtype=float) if rows else np.zeros((3, 0))
+        except ValueError:
+            errors[i].append(".bvec 파일을 읽을 수 없습니다 (행마다 항목 수가 다름).")
+            vectors = np.zeros((3, 0))
+        if vectors.ndim != 2 or vectors.shape[0] != 3:
+            if bvec is not None and vectors.size:
+                errors[i].append(f".bvec 파일이 3행이 아닙니다 ({vectors.shape[0]}행).")
+            vectors = np.zeros((3, 0))
+        bvals.append(values)
+        bvecs.append(vectors)
+
+    # (run, volume) 배열로 모음 (run마다 volume 수가 다르므로 NaN으로 채움)
+    counts_bval = np.array([len(values) for values in bvals])
+    counts_bvec = np.array([vectors.shape[1] for vectors in bvecs])
+    width = max(1, int(max(counts_bval.max(), counts_bvec.max())))
+    b = np.full((len(runs), width), np.nan)
+    g = np.full((len(runs), 3, width), np.nan)
+    for i, (values, vectors) in enumerate(zip(bvals, bvecs)):
+        b[i, :len(values)] = values
+        g[i, :, :vectors.shape[1]] = vectors
+
+    has_tables = (counts_bval > 0) & (counts_bvec > 0)
+    count_mismatch = has_tables & ((counts_bval != counts_bvec) | ((volumes >= 0) & (counts_bval != volumes)))
+    is_b0 = b <= B0_THRESHOLD
+    norms = np.sqrt(np.sum(g ** 2, axis=1))
+    # b0 volume은 0 vector 또는 unit vector, 그 외는 unit vector여야 함 (비교할 수 있는 volume만)
+    comparable = ~np.isnan(b) & ~np.isnan(norms)
+    off_unit = np.abs(norms - 1) > NORM_TOLERANCE
+    bad_norm = comparable & off_unit & ~(is_b0 & (norms < NORM_TOLERANCE))
+    bad_norm_count = bad_norm.sum(axis=1)
+    no_b0 = has_tables & ~is_b0.any(axis=1)
+
+    # shell 구성: (run × dataset의 모든 shell) boolean 행렬의 행이 가장 많은 행과 같은지
+    shells = np.where(is_b0 | np.isnan(b), np.nan, np.round(b / SHELL_ROUNDING) * SHELL_ROUNDING)
+    all_shells = np.unique(shells[~np.isnan(shells)])
+    membership = (shells[:, :, None] == all_shells[None, None, :]).any(axis=1)
+    valid = has_tables & ~count_mismatch
+    shell_mismatch = np.zeros(len(runs), dtype=bool)
+    if valid.any() and all_shells.size:
+        patterns, pattern_counts = np.unique(membership[valid], axis=0, return_counts=True)
+        reference = patterns[np.argmax(pattern_counts)]
+        shell_mismatch = valid & (membership != reference).any(axis=1)
+        reference_shells = ', '.join(str(int(shell)) for shell in all_shells[reference]) or '없음'
+
+    results = []
+    for i, (subject_label, session_label, stem) in enumerate(runs):
+        if volumes[i] < 0 and contents[i][0] is not None:
+            errors[i].append("NIfTI header를 해석할 수 없습니다.")
+        if count_mismatch[i]:
+            errors[i].append(f"gradient 수가 맞지 않습니다: bval {counts_bval[i]}개, bvec {counts_bvec[i]}개, "
+                             f"NIfTI volume {volumes[i]}개")
+        if bad_norm_count[i]:
+            errors[i].append(f"norm이 1이 아닌 gradient vector {bad_norm_count[i]}개")
+        if no_b0[i]:
+            errors[i].append(f"b0 volume (b ≤ {B0_THRESHOLD})이 없습니다.")
+        if shell_mismatch[i]:
+            found = ', '.join(str(int(shell)) for shell in all_shells[membership[i]]) or '없음'
+            errors[i].append(f"shell ({found})이 dataset의 다른 run들 ({reference_shells})과 다릅니다.")
+        results.append((subject_label, session_label, Path(stem).name, errors[i]))
+    return results
+
+
+# validate.py의 rule들이 subject마다 호출하므로 dataset 전체의 결과를 index마다 한 번만 계산.
+# index 객체가 key인 weak dict이므로 index가 사라지면 결과도 함께 사라짐 (id 재사용으로 다른 index의 결과를 돌려주지 않음)
+GRADIENTS = weakref.WeakKeyDictionary()
+GRADIENTS_LOCK = threading.Lock()
+
+
+def dataset_gradients(index, workers=8):
+    """
+    check_gradients(index)의 결과를 subject별로 묶은 dict: subject → (session, run 이름, error 목록) 목록.
+    같은 index에 대해서는 한 번만 계산합니다.
+    """
+    with GRADIENTS_LOCK:
+        if index not in GRADIENTS:
+            by_subject = {}
+            for subject_label, session_label, name, errors in check_gradients(index, workers):
+                by_subject.setdefault(subject_label, []).append((session_label, name, errors))
+            GRADIENTS[index] = by_subject
+        return GRADIENTS[index]
+
+
+def main(bids_dir, index=None):
     bids_dir = Path(bids_dir)
     if not bids_dir.exists():
         print(f"지정한 BIDS 디렉토리 {bids_dir}가 존재하지 않습니다.")
         return
+    if index is None:
+        index = BIDSIndex(bids_dir)
 
     errors_total = []
 
     # subject 폴더는 "sub-*" 패턴
-    subject_dirs = sorted([d for d in bids_dir.glob("sub-*") if d.is_dir()])
+    subject_dirs = index.subjects()
     if not subject_dirs:
         print("subject 폴더(sub-*)를 찾을 수 없습니다.")
         return
 
-    for sub in subject_dirs:
-        subject_label = sub.name
-        # session 폴더가 있으면 각 session 폴더 내의 dwi 및 BACKUP-dwi 폴더를 확인
-        session_dirs = sorted([d for d in sub.glob("ses-*") if d.is_dir()])
-        if session_dirs:
-            for ses in session_dirs:
-                session_label = ses.name
-                errors = process_folder(subject_label, session_label, ses)
-                errors_total.extend(errors)
-        else:
-            # session 폴더가 없는 경우, subject 폴더 자체 내에서 dwi 및 BACKUP-dwi 폴더 확인
-            errors = process_folder(subject_label, "N/A", sub)
+    for subject_label in subject_dirs:
+        for session_label, errors in check_subject(index, subject_label):
             errors_total.extend(errors)
 
+    for subject_label, session_label, name, errors in check_gradients(index):
+        errors_total.extend(f"{subject_label} - {session_label} {name}: {error}" for error in errors)
+
     # 통과되지 않은 항목들만 출력
     print("==== 통과되지 않은 (실패한) 항목들 ====")
     if errors_total:
@@ -92,9 +301,7 @@ if __name__ == '__main__':
                     "문제가 있는 항목(실패한 항목)만 출력합니다."
     )
     parser.add_argument("bids_dir", help="BIDS 데이터셋 최상위 디렉토리 경로")
-    import yaml
+    from settings import output_path
 
-    with open("config.yaml", 'r') as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
-    bids_path = config["data"]["output_path"]
+    bids_path = output_path()
     main(bids_path)
@@ -3,12 +3,40 @@ import argparse
 from pathlib import Path
 import json
 
+from bids_index import BIDSIndex
 
-def main(bids_dir):
+
+def check_subject(index, sub):
+    """
+    subject sub의 각 세션 (세션 폴더가 없으면 "N/A")에 대해 anat 폴더의 T1w와 T2w 존재 여부를 확인합니다.
+
+    Returns:
+        list: (session, missing) 목록. missing은 누락된 시퀀스 목록 ([]이면 모두 존재,
+              ["T1w", "T2w"]이면 anat 폴더가 없거나 T1w/T2w 파일이 하나도 없음)
+    """
+    results = []
+    # 세션 폴더가 있는지 확인 (BIDS에서는 optional)
+    # 세션 폴더가 없는 경우 → anat 폴더는 subject 폴더 하위에 존재
+    for ses in index.sessions(sub) or [None]:
+        if index.has_dir(sub, ses, "anat"):
+            # anat 폴더 내의 T1w, T2w 파일 검색 (파일명이 T1w 혹은 T2w를 포함)
+            t1_files = index.entries(sub, ses, "anat", "*T1w*")
+            t2_files = index.entries(sub, ses, "anat", "*T2w*")
+            missing = [name for name, files in (("T1w", t1_files), ("T2w", t2_files)) if not files]
+        else:
+            missing = ["T1w", "T2w"]
+        results.append((ses or "N/A", missing))
+    return results
+
+
+def main(bids_dir, index=None):
     bids_dir = Path(bids_dir)
     if not bids_dir.exists():
         print(f"지정한 경로({bids_dir})가 존재하지 않습니다.")
         return
+    # 여러 검사가 같은 index를 공유할 수 있도록 index를 받을 수 있습니다
+    if index is None:
+        index = BIDSIndex(bids_dir)
 
     # 결과를 저장할 리스트들
     complete = []  # T1w와 T2w 모두 존재하는 경우
@@ -16,42 +44,14 @@ def main(bids_dir):
     missing_anat = []  # anat 폴더 자체가 없거나 T1w/T2w 파일이 하나도 없는 경우
 
     # subjects: "sub-*" 패턴의 폴더를 찾습니다.
-    subject_dirs = sorted([d for d in bids_dir.glob("sub-*") if d.is_dir()])
-
-    for sub in subject_dirs:
-        # 세션 폴더가 있는지 확인 (BIDS에서는 optional)
-        session_dirs = sorted([d for d in sub.glob("ses-*") if d.is_dir()])
-        if session_dirs:  # 세션 폴더가 있는 경우
-            for ses in session_dirs:
-                anat_dir = ses / "anat"
-                if anat_dir.exists() and anat_dir.is_dir():
-                    # anat 폴더 내의 T1w, T2w 파일 검색 (파일명이 T1w 혹은 T2w를 포함)
-                    t1_files = list(anat_dir.glob("*T1w*"))
-                    t2_files = list(anat_dir.glob("*T2w*"))
-                    if t1_files and t2_files:
-                        complete.append((sub.name, ses.name))
-                    elif t1_files or t2_files:
-                        # 어느 것이 누락되었는지 판별
-                        missing = "T2w" if t1_files and not t2_files else "T1w"
-                        incomplete.append((sub.name, ses.name, missing))
-                    else:
-                        missing_anat.append((sub.name, ses.name))
-                else:
-                    missing_anat.append((sub.name, ses.name))
-        else:  # 세션 폴더가 없는 경우 → anat 폴더는 subject 폴더 하위에 존재
-            anat_dir = sub / "anat"
-            if anat_dir.exists() and anat_dir.is_dir():
-                t1_files = list(anat_dir.glob("*T1w*"))
-                t2_files = list(anat_dir.glob("*T2w*"))
-                if t1_files and t2_files:
-                    complete.append((sub.name, "N/A"))
-                elif t1_files or t2_files:
-                    missing = "T2w" if t1_files and not t2_files else "T1w"
-                    incomplete.append((sub.name, "N/A", missing))
-                else:
-                    missing_anat.append((sub.name, "N/A"))
+    for sub in index.subjects():
+        for ses, missing in check_subject(index, sub):
+            if not missing:
+                complete.append((sub, ses))
+            elif len(missing) == 1:
+                incomplete.append((sub, ses, missing[0]))
             else:
-                missing_anat.append((sub.name, "N/A"))
+                missing_anat.append((sub, ses))
 
     # 결과 report 출력
     print("=== T1w와 T2w가 모두 존재하는 피험자/세션 ===")
@@ -75,10 +75,8 @@ if __name__ == '__main__':
     # args = parser.parse_args()
     # main(args.bids_dir)
     # read from config.yaml file
-    import yaml
+    from settings import output_path
 
-    with open("config.yaml", 'r') as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
-    bids_path = config["data"]["output_path"]
+    bids_path = output_path()
 
     main(bids_path)
@@ -2,37 +2,50 @@
 import argparse
 from pathlib import Path
 
+from bids_index import BIDSIndex
 
-def main(bids_dir):
+
+def check_subject(index, sub):
+    """
+    subject sub의 세션 순서를 확인하고, 발견된 문제 목록을 반환합니다.
+        - "followup2_without_followup1": ses-followup2는 있는데 ses-followup1이 없는 경우
+        - "followups_without_acute": ses-followup1이나 ses-followup2는 있는데 ses-acute이 없는 경우
+    """
+    problems = []
+    # 각 피험자 폴더 내에 바로 세션 폴더가 존재한다고 가정
+    has_acute = index.has_dir(sub, "ses-acute")
+    has_followup1 = index.has_dir(sub, "ses-followup1")
+    has_followup2 = index.has_dir(sub, "ses-followup2")
+
+    # 1. ses-followup2가 존재하는데 ses-followup1은 없는 경우
+    if has_followup2 and not has_followup1:
+        problems.append("followup2_without_followup1")
+
+    # 2. ses-followup1이나 ses-followup2가 존재하는데 ses-acute이 없는 경우
+    if (has_followup1 or has_followup2) and not has_acute:
+        problems.append("followups_without_acute")
+    return problems
+
+
+def main(bids_dir, index=None):
     bids_dir = Path(bids_dir)
     if not bids_dir.exists():
         print(f"지정한 경로 {bids_dir}가 존재하지 않습니다.")
         return
+    if index is None:
+        index = BIDSIndex(bids_dir)
 
     # 문제 상황을 저장할 리스트들
     followup2_without_followup1 = []  # ses-followup2는 있는데 ses-followup1이 없는 경우
     followups_without_acute = []  # ses-followup1이나 ses-followup2는 있는데 ses-acute이 없는 경우
 
     # BIDS에서는 피험자 디렉토리가 "sub-*" 형태로 구성됩니다.
-    subject_dirs = sorted([d for d in bids_dir.glob("sub-*") if d.is_dir()])
-
-    for sub in subject_dirs:
-        # 각 피험자 폴더 내에 바로 세션 폴더가 존재한다고 가정
-        acute_path = sub / "ses-acute"
-        followup1_path = sub / "ses-followup1"
-        followup2_path = sub / "ses-followup2"
-
-        has_acute = acute_path.exists() and acute_path.is_dir()
-        has_followup1 = followup1_path.exists() and followup1_path.is_dir()
-        has_followup2 = followup2_path.exists() and followup2_path.is_dir()
-
-        # 1. ses-followup2가 존재하는데 ses-followup1은 없는 경우
-        if has_followup2 and not has_followup1:
-            followup2_without_followup1.append(sub.name)
-
-        # 2. ses-followup1이나 ses-followup2가 존재하는데 ses-acute이 없는 경우
-        if (has_followup1 or has_followup2) and not has_acute:
-            followups_without_acute.append(sub.name)
+    for sub in index.subjects():
+        problems = check_subject(index, sub)
+        if "followup2_without_followup1" in problems:
+            followup2_without_followup1.append(sub)
+        if "followups_without_acute" in problems:
+            followups_without_acute.append(sub)
 
     # 결과 출력
     print("=== ses-followup2는 있으나 ses-followup1이 없는 피험자들 ===")
@@ -51,9 +64,7 @@ def main(bids_dir):
 
 
 if __name__ == '__main__':
-    import yaml
+    from settings import output_path
 
-    with open("config.yaml", 'r') as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
-    bids_path = config["data"]["output_path"]
+    bids_path = output_path()
     main(bids_path)
@@ -5,6 +5,8 @@ import re
 import ntpath
 from pathlib import Path
 
+from bids_index import BIDSIndex
+
 
 def check_folder_name(subject_number, expected_code, folder_name):
     """
@@ -22,87 +24,106 @@ def check_folder_name(subject_number, expected_code, folder_name):
     return bool(pattern.search(folder_name))
 
 
-def main(bids_dir):
+# session_id와 기대하는 폴더 내 session label의 대응 관계
+SESSION_CODE_MAP = {
+    "ses-acute": "A",
+    "ses-followup1": "C",
+    "ses-followup2": "C2"
+}
+
+
+def check_subject(index, sub):
+    """
+    subject 폴더 sub의 sessions.tsv를 읽어 각 세션 폴더의 존재 여부와 FOLDER 컬럼을 검증합니다.
+
+    Returns:
+        tuple: (성공 메시지 목록, 오류 메시지 목록)
+    """
+    success_msgs = []
+    error_msgs = []
+    sub_dir = index.path(sub)
+
+    # subject 폴더 이름 예: sub-PAT24 → label: "PAT24"
+    subject_label = sub_dir.name[len("sub-"):]
+    # 정규표현식으로 "PAT" 뒤에 오는 숫자만 추출 (대소문자 무관)
+    m = re.search(r'PAT(\d+)', subject_label, re.IGNORECASE)
+    if not m:
+        error_msgs.append(f"{sub_dir.name}: 폴더 이름이 'PAT<number>' 패턴에 맞지 않습니다.")
+        return success_msgs, error_msgs
+    subject_number = m.group(1)
+
+    # subject 폴더 내에 *sessions.tsv 파일을 찾습니다.
+    tsv_files = [sub_dir / name for name in index.subject_files(sub_dir.name, "*sessions.tsv")]
+    if not tsv_files:
+        error_msgs.append(f"{sub_dir.name}: sessions.tsv 파일을 찾을 수 없습니다.")
+        return success_msgs, error_msgs
+    # 만약 여러 개라면 첫 번째 파일을 사용 (필요에 따라 수정)
+    tsv_file = tsv_files[0]
+
+    try:
+        with tsv_file.open(newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f, delimiter='\t')
+            for row in reader:
+                session_id = row.get("session_id", "").strip()
+                folder_path = row.get("FOLDER", "").strip()
+
+                # 우리가 체크할 세션만 처리 (나머지는 건너뛰기)
+                if session_id not in SESSION_CODE_MAP:
+                    continue
+
+                # (a) tsv에 기록된 session이 실제 subject 폴더 내에 존재하는지 확인
+                session_folder = sub_dir / session_id
+                if not index.has_dir(sub_dir.name, session_id):
+                    error_msgs.append(
+                        f"{sub_dir.name} - {session_id}: 해당 session 폴더 ({session_folder})가 존재하지 않습니다."
+                    )
+                else:
+                    success_msgs.append(
+                        f"{sub_dir.name} - {session_id}: session 폴더 존재 확인."
+                    )
+
+                # (b) FOLDER 컬럼이 비어있는지 확인
+                if not folder_path:
+                    error_msgs.append(f"{sub_dir.name} - {session_id}: FOLDER 컬럼이 비어 있습니다.")
+                    continue
+
+                # FOLDER 컬럼은 원본 경로 (예: "E:\CNDA_Stroke_raw_data\FCS81C")
+                # ntpath.basename을 사용하면 Windows 스타일 경로에서도 마지막 폴더명을 추출할 수 있음
+                folder_basename = ntpath.basename(folder_path)
+
+                expected_code = SESSION_CODE_MAP[session_id]
+                if check_folder_name(subject_number, expected_code, folder_basename):
+                    success_msgs.append(
+                        f"{sub_dir.name} - {session_id}: '{folder_basename}' → OK"
+                    )
+                else:
+                    error_msgs.append(
+                        f"{sub_dir.name} - {session_id}: '{folder_basename}' 에서 subject number '{subject_number}'와 "
+                        f"기대하는 session label '{expected_code}'가 올바르게 포함되어 있지 않습니다."
+                    )
+    except Exception as e:
+        error_msgs.append(f"{sub_dir.name}: {tsv_file.name} 파일 처리 중 오류 발생 → {e}")
+
+    return success_msgs, error_msgs
+
+
+def main(bids_dir, index=None):
     bids_dir = Path(bids_dir)
     if not bids_dir.exists():
         print(f"지정한 BIDS 디렉토리 {bids_dir}가 존재하지 않습니다.")
         return
-
-    # session_id와 기대하는 폴더 내 session label의 대응 관계
-    session_code_map = {
-        "ses-acute": "A",
-        "ses-followup1": "C",
-        "ses-followup2": "C2"
-    }
+    if index is None:
+        index = BIDSIndex(bids_dir)
 
     # 결과를 저장할 리스트들
     success_msgs = []
     error_msgs = []
 
     # 각 subject 폴더는 "sub-PAT*" 형태라고 가정합니다.
-    subject_dirs = sorted([d for d in bids_dir.glob("sub-PAT*") if d.is_dir()])
-
-    for sub_dir in subject_dirs:
-        # subject 폴더 이름 예: sub-PAT24 → label: "PAT24"
-        subject_label = sub_dir.name[len("sub-"):]
-        # 정규표현식으로 "PAT" 뒤에 오는 숫자만 추출 (대소문자 무관)
-        m = re.search(r'PAT(\d+)', subject_label, re.IGNORECASE)
-        if not m:
-            error_msgs.append(f"{sub_dir.name}: 폴더 이름이 'PAT<number>' 패턴에 맞지 않습니다.")
-            continue
-        subject_number = m.group(1)
-
-        # subject 폴더 내에 *sessions.tsv 파일을 찾습니다.
-        tsv_files = list(sub_dir.glob("*sessions.tsv"))
-        if not tsv_files:
-            error_msgs.append(f"{sub_dir.name}: sessions.tsv 파일을 찾을 수 없습니다.")
-            continue
-        # 만약 여러 개라면 첫 번째 파일을 사용 (필요에 따라 수정)
-        tsv_file = tsv_files[0]
-
-        try:
-            with tsv_file.open(newline='', encoding='utf-8') as f:
-                reader = csv.DictReader(f, delimiter='\t')
-                for row in reader:
-                    session_id = row.get("session_id", "").strip()
-                    folder_path = row.get("FOLDER", "").strip()
-
-                    # 우리가 체크할 세션만 처리 (나머지는 건너뛰기)
-                    if session_id not in session_code_map:
-                        continue
-
-                    # (a) tsv에 기록된 session이 실제 subject 폴더 내에 존재하는지 확인
-                    session_folder = sub_dir / session_id
-                    if not (session_folder.exists() and session_folder.is_dir()):
-                        error_msgs.append(
-                            f"{sub_dir.name} - {session_id}: 해당 session 폴더 ({session_folder})가 존재하지 않습니다."
-                        )
-                    else:
-                        success_msgs.append(
-                            f"{sub_dir.name} - {session_id}: session 폴더 존재 확인."
-                        )
-
-                    # (b) FOLDER 컬럼이 비어있는지 확인
-                    if not folder_path:
-                        error_msgs.append(f"{sub_dir.name} - {session_id}: FOLDER 컬럼이 비어 있습니다.")
-                        continue
-
-                    # FOLDER 컬럼은 원본 경로 (예: "E:\CNDA_Stroke_raw_data\FCS81C")
-                    # ntpath.basename을 사용하면 Windows 스타일 경로에서도 마지막 폴더명을 추출할 수 있음
-                    folder_basename = ntpath.basename(folder_path)
-
-                    expected_code = session_code_map[session_id]
-                    if check_folder_name(subject_number, expected_code, folder_basename):
-                        success_msgs.append(
-                            f"{sub_dir.name} - {session_id}: '{folder_basename}' → OK"
-                        )
-                    else:
-                        error_msgs.append(
-                            f"{sub_dir.name} - {session_id}: '{folder_basename}' 에서 subject number '{subject_number}'와 "
-                            f"기대하는 session label '{expected_code}'가 올바르게 포함되어 있지 않습니다."
-                        )
-        except Exception as e:
-            error_msgs.append(f"{sub_dir.name}: {tsv_file.name} 파일 처리 중 오류 발생 → {e}")
+    for sub in index.subjects("sub-PAT*"):
+        success, errors = check_subject(index, sub)
+        success_msgs.extend(success)
+        error_msgs.extend(errors)
 
     # 결과 출력
     print("==== 검증 결과 (성공한 항목) ====")
@@ -128,9 +149,7 @@ if __name__ == '__main__':
                     "또 폴더 이름 뒤에 촬영 날짜 등이 붙을 수 있으며 대소문자 구분 없이 체크합니다."
     )
     parser.add_argument("bids_dir", help="BIDS 데이터셋 최상위 디렉토리 경로")
-    import yaml
+    from settings import output_path
 
-    with open("config.yaml", 'r') as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
-    bids_path = config["data"]["output_path"]
+    bids_path = output_path()
     main(bids_path)
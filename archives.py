@@ -0,0 +1,217 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+
+# input_path에서 세션으로 받는 archive (.zip, .tar, 압축된 .tar)
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+# archive 안의 시리즈 경로: <archive 경로>::<archive 안의 시리즈 폴더>
+SEPARATOR = '::'
+# triage에 읽는 첫 번째 DICOM 파일의 앞부분 (pixel data 전의 header는 보통 수십 KB, 잘린 header는 변환 후에 판단)
+HEADER_BYTES = 1 << 20
+
+
+def is_archive(path):
+    """
+    path가 세션 archive 이름 (ARCHIVE_EXTENSIONS)이면 True.
+    """
+    return os.path.basename(path.rstrip('/')).lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def is_archive_series(df):
+    return SEPARATOR in df
+
+
+def split_series(df):
+    """
+    archive 시리즈 경로 df를 (archive 경로, archive 안의 시리즈 폴더)로 나눕니다.
+    """
+    path, _, inner = df.partition(SEPARATOR)
+    return path, inner
+
+
+def session_name(f):
+    """
+    세션 폴더 또는 세션 archive f의 이름 (archive 확장자 제외). sessions.tsv의 FOLDER에 기록됩니다.
+    """
+    name = os.path.basename(f.rstrip('/'))
+    for extension in ARCHIVE_EXTENSIONS:
+        if name.lower().endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def hidden(name):
+    """
+    숨김 항목 ('.'로 시작하거나 __MACOSX인 경로 요소가 있는 이름)이면 True. 세션 폴더와 archive의 시리즈 목록에 공통으로 사용합니다.
+    """
+    return any(part.startswith('.') or part == '__MACOSX' for part in name.split('/'))
+
+
+class Archive:
+    """
+    세션 archive 하나의 목록: archive 안의 시리즈 폴더 (파일이 있는 폴더)별 member (ZipInfo 또는 TarInfo).
+
+    zip은 central directory만 읽고 member는 필요할 때 하나씩 풉니다. tar는 member header를 처음부터 한 번 stream하며,
+    압축된 tar는 임의 위치를 읽을 수 없으므로 이 때 시리즈마다 (이름 순) 첫 번째 파일의 앞부분 (HEADER_BYTES)도 읽어 두어
+    triage에 다시 압축을 풀지 않습니다. 시리즈는 archive 순서대로 풀리므로 (extract) 압축된 tar도 대부분 앞으로만 읽습니다.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        st = os.stat(path)
+        self.stamp = (st.st_size, st.st_mtime_ns)
+        self.zip = zipfile.is_zipfile(path)
+        self.members = {}
+        self.headers = {}
+        self.handle = None
+        self.lock = threading.Lock()
+        if self.zip:
+            with zipfile.ZipFile(path) as zf:
+                for member in zf.infolist():
+                    self.add(member.filename, member)
+        else:
+            first = {}
+            with tarfile.open(path, 'r:*') as tar:
+                for member in tar:
+                    if not member.isfile() or not self.add(member.name, member):
+                        continue
+                    # 폴더의 시리즈와 같이 이름 순으로 첫 번째 파일의 header (archive 순서는 이름 순이 아닐 수 있음)
+                    inner = os.path.dirname(member.name)
+                    if inner not in first or member.name < first[inner]:
+                        first[inner] = member.name
+                        self.headers[inner] = tar.extractfile(member).read(HEADER_BYTES)
+        for members in self.members.values():
+            members.sort(key=lambda m: m.filename if self.zip else m.name)
+
+    def add(self, name, member):
+        """
+        시리즈 폴더 안의 파일 member를 목록에 추가하고 추가했으면 True를 반환합니다.
+        archive의 맨 위에 있는 파일은 세션 폴더의 파일처럼 무시합니다.
+        """
+        inner = os.path.dirname(name)
+        if name.endswith('/') or not inner or hidden(name):
+            return False
+        self.members.setdefault(inner, []).append(member)
+        return True
+
+    def names(self, inner):
+        return [m.filename if self.zip else m.name for m in self.members[inner]]
+
+    def header(self, inner):
+        """
+        시리즈 inner의 첫 번째 파일 앞부분 (pydicom.dcmread에 넘길 file object).
+        """
+        if inner not in self.headers:
+            with zipfile.ZipFile(self.path) as zf, zf.open(self.members[inner][0]) as f:
+                self.headers[inner] = f.read(HEADER_BYTES)
+        return io.BytesIO(self.headers[inner])
+
+    def fingerprint(self, inner):
+        """
+        manifest.series_fingerprint와 같은 [파일 수, 전체 크기 (bytes), 가장 최근 mtime (ns)] (archive에 기록된 값).
+        """
+        members = self.members[inner]
+        if self.zip:
+            mtime = max(time.mktime(m.date_time + (0, 0, -1)) for m in members)
+            return [len(members), sum(m.file_size for m in members), int(mtime) * 10 ** 9]
+        return [len(members), sum(m.size for m in members), int(max(m.mtime for m in members)) * 10 ** 9]
+
+    def extract(self, inner, folder):
+        """
+        시리즈 inner의 파일들을 folder에 풉니다 (파일 이름만 사용하므로 archive의 경로가 folder 밖을 가리킬 수 없음).
+        """
+        with self.lock:
+            if self.zip:
+                with zipfile.ZipFile(self.path) as zf:
+                    for member in self.members[inner]:
+                        with zf.open(member) as src, open(os.path.join(folder, os.path.basename(member.filename)), 'wb') as dst:
+                            shutil.copyfileobj(src, dst, 1 << 20)
+                return
+            if self.handle is None:
+                self.handle = tarfile.open(self.path, 'r:*')
+            # 압축된 tar는 뒤로 돌아가면 처음부터 다시 풀어야 하므로 archive 순서대로 읽음
+            for member in sorted(self.members[inner], key=lambda m: m.offset_data):
+                with self.handle.extractfile(member) as src, open(os.path.join(folder, os.path.basename(member.name)), 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+
+    def close(self):
+        with self.lock:
+            if self.handle is not None:
+                self.handle.close()
+                self.handle = None
+
+
+ARCHIVES = {}
+ARCHIVES_LOCK = threading.Lock()
+
+
+def open_archive(path):
+    """
+    archive path의 목록 (Archive)을 반환합니다. 세션이 끝날 때 (release) 까지 process 안에서 재사용되며,
+    archive가 바뀌면 (크기, mtime) 다시 읽습니다.
+    """
+    with ARCHIVES_LOCK:
+        archive = ARCHIVES.get(path)
+        st = os.stat(path)
+        if archive is None or archive.stamp != (st.st_size, st.st_mtime_ns):
+            if archive is not None:
+                archive.close()
+            archive = ARCHIVES[path] = Archive(path)
+        return archive
+
+
+def release(path):
+    """
+    세션 archive path의 목록과 열려 있는 tar를 해제합니다. archive가 아니거나 열리지 않았으면 아무것도 하지 않습니다.
+    """
+    with ARCHIVES_LOCK:
+        archive = ARCHIVES.pop(path, None)
+    if archive is not None:
+        archive.close()
+
+
+def archive_series(path):
+    """
+    세션 archive path 안의 시리즈 경로 목록 (archive 순서).
+    """
+    return [path + SEPARATOR + inner for inner in open_archive(path).members]
+
+
+def archive_members(df):
+    """
+    archive 시리즈 df의 파일 이름 목록 (archive 안의 경로, 정렬됨).
+    """
+    path, inner = split_series(df)
+    return open_archive(path).names(inner)
+
+
+def archive_header(df):
+    path, inner = split_series(df)
+    return open_archive(path).header(inner)
+
+
+def archive_fingerprint(df):
+    path, inner = split_series(df)
+    return open_archive(path).fingerprint(inner)
+
+
+@contextmanager
+def extracted(df, scratch):
+    """
+    archive 시리즈 df를 scratch 아래의 시리즈 전용 임시 폴더에 풀어 그 경로를 넘기고, with 블록이 끝나면 바로 삭제합니다.
+    따라서 scratch에 필요한 공간은 가장 큰 시리즈 하나 (동시에 변환하는 수만큼)입니다.
+    """
+    path, inner = split_series(df)
+    os.makedirs(scratch, exist_ok=True)
+    folder = tempfile.mkdtemp(prefix=os.path.basename(inner) + '-', dir=scratch)
+    try:
+        open_archive(path).extract(inner, folder)
+        yield folder
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
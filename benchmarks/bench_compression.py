@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Compares the NIfTI compression paths on a synthetic BOLD run: a single-threaded gzip (what
+dcm2niix -z y does when pigz is not installed), the parallel gzip of compression.py and pigz when it is installed.
+
+    python benchmarks/bench_compression.py --shape 96 96 60 300 --threads 8 --levels 1 6
+"""
+import argparse
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from compression import compress_threads, gzip_file
+
+
+def synthetic_run(path, shape):
+    """
+    Writes an int16 run (smooth signal + noise, like an EPI) to path, one volume at a time.
+    """
+    rng = np.random.default_rng(0)
+    x, y, z = np.meshgrid(*[np.linspace(-1, 1, n) for n in shape[:3]], indexing='ij')
+    brain = (1000 * np.exp(-(x ** 2 + y ** 2 + z ** 2) * 2)).astype(np.float32)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 352)
+        for _ in range(shape[3]):
+            volume = brain + rng.normal(0, 20, shape[:3]).astype(np.float32)
+            f.write(volume.astype(np.int16).tobytes(order='F'))
+
+
+def single_thread(src, level):
+    with open(src, 'rb') as fsrc, gzip.open(src + '.gz', 'wb', compresslevel=level) as fdst:
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+    os.remove(src)
+
+
+def measure(label, function, raw, size):
+    work = raw + '.work.nii'
+    shutil.copyfile(raw, work)
+    start = time.perf_counter()
+    function(work)
+    wall = time.perf_counter() - start
+    compressed = os.path.getsize(work + '.gz')
+    os.remove(work + '.gz')
+    print(f"{label:<28}{wall:>10.2f}{size / 1024 ** 2 / wall:>12.1f}{size / compressed:>10.2f}")
+
+
+def main(shape, threads, levels):
+    threads = compress_threads(threads)
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = os.path.join(tmp, 'bold.nii')
+        synthetic_run(raw, shape)
+        size = os.path.getsize(raw)
+        print(f"Synthetic BOLD {tuple(shape)}: {size / 1024 ** 2:.0f} MB, {threads} thread(s)")
+        print(f"{'method':<28}{'wall (s)':>10}{'MB/s':>12}{'ratio':>10}")
+        for level in levels:
+            measure(f"gzip -{level} (1 thread)", lambda p: single_thread(p, level), raw, size)
+            measure(f"parallel -{level} ({threads} threads)",
+                    lambda p: gzip_file(p, level=level, threads=threads, pigz=False), raw, size)
+            if shutil.which('pigz'):
+                measure(f"pigz -{level} ({threads} threads)",
+                        lambda p: gzip_file(p, level=level, threads=threads), raw, size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark of the NIfTI compression paths")
+    parser.add_argument("--shape", type=int, nargs=4, default=[96, 96, 60, 300], help="4D shape of the synthetic run")
+    parser.add_argument("--threads", type=int, default=0, help="Compression threads (0 = number of CPUs)")
+    parser.add_argument("--levels", type=int, nargs='+', default=[1, 6], help="gzip levels to compare")
+    args = parser.parse_args()
+    main(args.shape, args.threads, args.levels)
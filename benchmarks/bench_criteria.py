@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Compares the BOLD volume check of criteria.py when reading the voxel data (get_fdata)
+and when reading the NIfTI header only, on synthetic 4D files.
+
+    python benchmarks/bench_criteria.py --shape 64 64 36 200 --runs 3
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import nibabel as nib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from criteria import get_image_info
+
+
+def volumes_from_data(files):
+    return nib.load([f for f in files if '.nii' in f][0]).get_fdata().shape[-1]
+
+
+def volumes_from_header(files):
+    return get_image_info(files)['shape'][-1]
+
+
+def measure(function, files, runs):
+    """
+    Returns the best wall time (s) and the peak traced memory (MB) of function(files).
+    """
+    best, peak = float('inf'), 0
+    for _ in range(runs):
+        tracemalloc.start()
+        start = time.perf_counter()
+        function(files)
+        best = min(best, time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return best, peak / 1024 ** 2
+
+
+def main(shape, runs):
+    with tempfile.TemporaryDirectory() as tmp:
+        nifti = os.path.join(tmp, 'bold.nii.gz')
+        data = np.random.default_rng(0).integers(0, 4096, size=shape, dtype=np.int16)
+        nib.save(nib.Nifti1Image(data, np.eye(4)), nifti)
+        del data
+        files = [nifti]
+
+        print(f"Synthetic BOLD {tuple(shape)}, {os.path.getsize(nifti) / 1024 ** 2:.1f} MB on disk")
+        print(f"{'method':<10}{'wall (s)':>12}{'peak (MB)':>12}")
+        for label, function in [('get_fdata', volumes_from_data), ('header', volumes_from_header)]:
+            wall, peak = measure(function, files, runs)
+            print(f"{label:<10}{wall:>12.4f}{peak:>12.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark of the BOLD volume count in criteria.py")
+    parser.add_argument("--shape", type=int, nargs=4, default=[64, 64, 36, 200], help="4D shape of the synthetic run")
+    parser.add_argument("--runs", type=int, default=3, help="Repetitions per method (best time is reported)")
+    args = parser.parse_args()
+    main(args.shape, args.runs)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Compares the previous per-call regex parsing of dcm2niix file names (and PROTOCOLS matching)
+with the compiled rules of naming.py, on synthetic names.
+
+    python benchmarks/bench_naming.py --names 100000 --runs 3
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from naming import compile_rules
+
+PROTOCOLS = ['MPRAGE', 't2_spc_1mm_p2', 'dti_64dir', 'BOLD_rest', 'localizer', 'AAHead_Scout']
+
+
+def previous_parse(nifti_file, json_data):
+    """
+    get_nifti_info before naming.py (regexes compiled on each call, ad-hoc info object).
+    """
+    path = nifti_file.removesuffix(nifti_file.split('/')[-1])
+    name = re.split(r"[.][a-zA-Z]", nifti_file.split('/')[-1])[0]
+    i, p, t = name.split('--')
+    t = t[:4] + '-' + t[4:6]
+    info_nifti = type('', (), {})()
+    raw_ID = re.split(r"^0+", re.search(r"\d+", i).group())[-1]
+    wrong_names = json_data["WrongNaming"]
+    info_nifti.num_id = wrong_names[raw_ID] if raw_ID in wrong_names else raw_ID
+    info_nifti.session = re.findall(r"[A-Z0-9]+", re.split(r"\d{2,}", i)[-1].upper())[0]
+    info_nifti.protocol, info_nifti.time = p, t
+    if len(info_nifti.num_id) == 1:
+        info_nifti.num_id = '0' + info_nifti.num_id
+    info_nifti.mri = re.match(f'({json_data["PROTOCOLS"]})', p)
+    return path, name, info_nifti
+
+
+def compiled_parse(nifti_file, json_data):
+    rules = compile_rules(json_data)
+    path, name, info = rules.parse(nifti_file)
+    rules.match_protocol(info.protocol)
+    return path, name, info
+
+
+def synthetic_names(count, seed=0):
+    rng = random.Random(seed)
+    sessions = ['A', 'C', 'C2', 'AMC', 'AMC2']
+    return [f"/staging/FCS{rng.randint(1, 599):03d}{rng.choice(sessions)}-x/"
+            f"FCS{rng.randint(1, 599):03d}{rng.choice(sessions)}--{rng.choice(PROTOCOLS)}--"
+            f"20{rng.randint(10, 24)}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}.nii.gz"
+            for _ in range(count)]
+
+
+def measure(function, names, json_data, runs):
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        for name in names:
+            function(name, json_data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(count, runs):
+    with open(os.path.join(ROOT, 'bids_code.json'), 'r') as f:
+        bids_code = json.load(f)
+    names = synthetic_names(count)
+
+    # Both implementations must agree before timing them
+    for name in names[:1000]:
+        _, old_name, old = previous_parse(name, bids_code)
+        _, new_name, new = compiled_parse(name, bids_code)
+        assert (old_name, old.num_id, old.session, old.protocol, old.time) == \
+            (new_name, new.num_id, new.session, new.protocol, new.time), name
+
+    print(f"{count} synthetic names, best of {runs}")
+    print(f"{'method':<10}{'wall (s)':>12}{'names/s':>14}")
+    for label, function in [('previous', previous_parse), ('compiled', compiled_parse)]:
+        wall = measure(function, names, bids_code, runs)
+        print(f"{label:<10}{wall:>12.3f}{count / wall:>14.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark of dcm2niix file name parsing")
+    parser.add_argument("--names", type=int, default=100000, help="Number of synthetic file names")
+    parser.add_argument("--runs", type=int, default=3, help="Repetitions per method (best time is reported)")
+    args = parser.parse_args()
+    main(args.names, args.runs)
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark: generates synthetic DICOM sessions, converts them with the full pipeline (cli.py convert),
+then runs each validator on the BIDS output. Reports throughput (series/min, MB/s of DICOM input), peak memory and
+the time of every stage traced by profiling.py, and writes the results to a JSON file. --compare reads the JSON of
+an earlier run (e.g. of the previous commit), prints the changes and exits with 1 if a time or memory figure got
+worse by more than --tolerance.
+
+It runs offline: when dcm2niix is not installed (or with --stub), benchmarks/stub_dcm2niix.py is put first in PATH.
+
+    python benchmarks/bench_pipeline.py --subjects 4 --sessions 2 --output bench.json
+    python benchmarks/bench_pipeline.py --output bench-new.json --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from settings import BIDS_CODE_PATH, CONFIG_PATH, load_bids_code, load_config
+
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_dcm2niix.py')
+
+# Series of a synthetic session, in acquisition order: (folder suffix, ProtocolName, SeriesDescription, kind).
+# Besides the runs that end up in BIDS, the sessions contain what the converter has to skip: a localizer,
+# a derived FA map and a BOLD run that is too short. A second MPRAGE is added to every other session (backup).
+SERIES = [
+    ('localizer', 'localizer', 'localizer', 'localizer'),
+    ('MPRAGE', 'MPRAGE', 't1_mprage_sag', 'anat'),
+    ('t2_spc', 'Hi-res T2_spc_1mm_p2', 'Hi-res T2_spc_1mm_p2', 'anat'),
+    ('dti', 'dti', 'dti_30dir', 'dwi'),
+    ('dti_FA', 'dti', 'dti_30dir_FA', 'derived'),
+    ('BOLD', 'BOLD', 'bold resting', 'bold'),
+    ('BOLD_short', 'BOLD', 'bold test', 'short'),
+]
+REPEATED = ('MPRAGE_repeat', 'MPRAGE', 't1_mprage_sag', 'anat')
+# Volumes of the BOLD run that the criteria exclude (MIN_BOLD_VOLUMES is 100)
+SHORT_BOLD = 20
+# Validators run on the BIDS output, each in its own interpreter (for its peak memory)
+VALIDATORS = {
+    'Check_anat': "import Check_anat; Check_anat.main({bids!r})",
+    'Check_DWI': "import Check_DWI; Check_DWI.main({bids!r})",
+    'Check_session': "import Check_session; Check_session.main({bids!r})",
+    'Check_subjects': "import Check_subjects; Check_subjects.main({bids!r})",
+    'validate': "import validate; validate.validate({bids!r})",
+}
+PROBE = """
+import contextlib, io, json, resource, time
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    {call}
+print(json.dumps({{'seconds': time.perf_counter() - start,
+                  'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+# Figures compared by --compare: higher is better for throughput, lower for everything else
+HIGHER_IS_BETTER = ('series_per_min', 'mb_per_s')
+# Changes smaller than this (seconds or MB) are timer noise, never regressions
+NOISE = 0.1
+
+
+def subject_ids(bids_code, subjects):
+    """
+    Subject numbers of the synthetic dataset: the misnamed IDs of WrongNaming first (their sessions are merged
+    into the corrected subject), then numbers that collide with neither the wrong nor the corrected IDs.
+    """
+    wrong = bids_code.get('WrongNaming', {})
+    taken = {int(n) for pair in wrong.items() for n in pair}
+    ids = [int(n) for n in wrong][:subjects // 2]
+    number = 1
+    while len(ids) < subjects:
+        if number not in taken:
+            ids.append(number)
+        number += 1
+    return ids
+
+
+def session_codes(bids_code):
+    """
+    Session codes of bids_code.json per group (controls, patients), e.g. [['AMC', 'AMC2'], ['A', 'C', 'C2']].
+    """
+    groups = {}
+    for code, value in bids_code.items():
+        if isinstance(value, dict) and 'ID' in value:
+            # one code per BIDS session (AMC and ACM are both ses-control1)
+            groups.setdefault(value['ID'], {}).setdefault(value['session'], code)
+    return [list(sessions.values()) for _, sessions in sorted(groups.items())]
+
+
+def write_dicom(path, header, pixels):
+    """
+    Writes one MR image file: pixels is (rows, columns) or (frames, rows, columns) int16.
+    """
+    meta = FileMetaDataset()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    meta.MediaStorageSOPClassUID = MRImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID, ds.SOPInstanceUID, ds.Modality = MRImageStorage, meta.MediaStorageSOPInstanceUID, 'MR'
+    for keyword, value in header.items():
+        setattr(ds, keyword, value)
+    if pixels.ndim == 3:
+        ds.NumberOfFrames = pixels.shape[0]
+    ds.Rows, ds.Columns = pixels.shape[-2:]
+    ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, 'MONOCHROME2'
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 16, 15, 1
+    ds.PixelData = pixels.astype(np.int16).tobytes()
+    ds.save_as(path, enforce_file_format=True)
+
+
+def phantom(rng, matrix, slices):
+    """
+    Smooth head-like volume (slices, rows, columns) with Gaussian noise, as written by the scanner.
+    """
+    z, y, x = np.meshgrid(*[np.linspace(-1, 1, n) for n in (slices, matrix, matrix)], indexing='ij')
+    signal = 1000 * np.exp(-(x ** 2 + y ** 2 + z ** 2) * 2)
+    return (signal + rng.normal(0, 20, signal.shape)).astype(np.int16)
+
+
+def gradient_directions(count):
+    """
+    count unit vectors spread over the sphere (Fibonacci lattice).
+    """
+    k = np.arange(count) + 0.5
+    polar, azimuth = np.arccos(1 - 2 * k / count), np.pi * (1 + 5 ** 0.5) * k
+    return np.stack([np.cos(azimuth) * np.sin(polar), np.sin(azimuth) * np.sin(polar), np.cos(polar)], axis=1)
+
+
+def write_series(folder, number, series, patient, date, sizes, rng):
+    """
+    Writes one series folder and returns (files, bytes).
+    """
+    suffix, protocol, description, kind = series
+    os.makedirs(folder)
+    header = dict(PatientName=patient, PatientID=patient, StudyDate=date, StudyTime='093000',
+                  SeriesNumber=number, ProtocolName=protocol, SeriesDescription=description,
+                  ImageType=['ORIGINAL', 'PRIMARY', 'M', 'ND'], InstitutionName='Synthetic Hospital')
+    files = []
+    if kind in ('localizer', 'anat'):
+        slices = 3 if kind == 'localizer' else sizes['anat_slices']
+        header.update(PixelSpacing=[1.0, 1.0], SliceThickness=1.0, RepetitionTime=2300.0)
+        volume = phantom(rng, sizes['anat_matrix'], slices)
+        for i in range(slices):
+            files.append((dict(header, InstanceNumber=i + 1), volume[i]))
+    elif kind in ('dwi', 'derived'):
+        header.update(PixelSpacing=[2.0, 2.0], SliceThickness=2.0, RepetitionTime=8000.0,
+                      InPlanePhaseEncodingDirection='COL')
+        if kind == 'derived':
+            header['ImageType'] = ['DERIVED', 'PRIMARY', 'DIFFUSION', 'FA', 'ND']
+            files.append((dict(header, InstanceNumber=1), phantom(rng, sizes['matrix'], sizes['slices'])))
+        else:
+            directions = gradient_directions(sizes['directions'])
+            base = phantom(rng, sizes['matrix'], sizes['slices'])
+            for i, (bvalue, vector) in enumerate([(0, (0.0, 0.0, 0.0))] + [(1000, tuple(v)) for v in directions]):
+                files.append((dict(header, InstanceNumber=i + 1, DiffusionBValue=float(bvalue),
+                                   DiffusionGradientOrientation=[float(v) for v in vector]),
+                              base // (1 if bvalue == 0 else 3)))
+    else:
+        volumes = SHORT_BOLD if kind == 'short' else sizes['volumes']
+        header.update(PixelSpacing=[3.0, 3.0], SliceThickness=3.0, RepetitionTime=2000.0,
+                      InPlanePhaseEncodingDirection='COL', NumberOfTemporalPositions=volumes,
+                      ImageType=['ORIGINAL', 'PRIMARY', 'M', 'MOSAIC'])
+        base = phantom(rng, sizes['matrix'], sizes['slices'])
+        for i in range(volumes):
+            noise = rng.normal(0, 10, base.shape).astype(np.int16)
+            files.append((dict(header, InstanceNumber=i + 1), base + noise))
+    size = 0
+    for i, (file_header, pixels) in enumerate(files):
+        path = os.path.join(folder, f"IM{i + 1:04d}.dcm")
+        write_dicom(path, file_header, pixels)
+        size += os.path.getsize(path)
+    return len(files), size
+
+
+def generate_dataset(root, bids_code, subjects, sessions, sizes, seed=0):
+    """
+    Writes the synthetic input folders into root (one folder per session, named like the scanner exports:
+    FCS<number><session code>, with a three-digit number in PatientName) and returns their statistics.
+    The sessions of the WrongNaming subjects keep the wrong number in their folder, as in the real exports.
+    """
+    rng = np.random.default_rng(seed)
+    groups = session_codes(bids_code)
+    dataset = {'sessions': 0, 'series': 0, 'files': 0, 'bytes': 0}
+    for s, number in enumerate(subject_ids(bids_code, subjects)):
+        codes = groups[s % len(groups)]
+        for k, code in enumerate(codes[:sessions]):
+            folder = os.path.join(root, f"FCS{number:02d}{code}")
+            patient = f"FCS{number:03d}{code}"
+            date = f"{2020 + k}{(s % 12) + 1:02d}15"
+            series = SERIES + ([REPEATED] if (s + k) % 2 else [])
+            for n, item in enumerate(series):
+                files, size = write_series(os.path.join(folder, f"{n + 1:02d}_{item[0]}"), n + 1, item, patient,
+                                           date, sizes, rng)
+                dataset['series'] += 1
+                dataset['files'] += files
+                dataset['bytes'] += size
+            dataset['sessions'] += 1
+    return dataset
+
+
+def dcm2niix_path(workdir, stub):
+    """
+    Folder to put first in PATH so that the converter runs the stub, or None to use the installed dcm2niix.
+    """
+    if not stub and shutil.which('dcm2niix'):
+        return None
+    folder = os.path.join(workdir, 'bin')
+    os.makedirs(folder, exist_ok=True)
+    wrapper = os.path.join(folder, 'dcm2niix')
+    with open(wrapper, 'w') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{STUB}" "$@"\n')
+    os.chmod(wrapper, os.stat(wrapper).st_mode | stat.S_IEXEC)
+    return folder
+
+
+def stage_totals(trace):
+    """
+    Sums the events of a profiling.py trace per stage.
+    """
+    stages = {}
+    with open(trace, 'r', encoding='utf-8') as f:
+        for line in f:
+            event = json.loads(line)
+            total = stages.setdefault(event['stage'], {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'child_cpu': 0.0,
+                                                       'read_mb': 0.0, 'write_mb': 0.0,
+                                                       'peak_rss_mb': 0.0, 'child_peak_rss_mb': 0.0})
+            total['count'] += 1
+            for key in ('wall', 'cpu', 'child_cpu'):
+                total[key] += event[key]
+            total['read_mb'] += event['read_bytes'] / 1024 ** 2
+            total['write_mb'] += event['write_bytes'] / 1024 ** 2
+            total['peak_rss_mb'] = max(total['peak_rss_mb'], event['peak_rss_mb'])
+            total['child_peak_rss_mb'] = max(total['child_peak_rss_mb'], event['child_peak_rss_mb'])
+    return stages
+
+
+def convert(workdir, input_path, config, bids_code_path, bin_path, workers):
+    """
+    Converts input_path into a new BIDS folder with cli.py convert and returns (wall time, output folder, stages).
+    """
+    output_path = os.path.join(workdir, 'bids') + '/'
+    shutil.rmtree(output_path, ignore_errors=True)
+    os.makedirs(output_path)
+    trace = os.path.join(workdir, 'trace.jsonl')
+    if os.path.exists(trace):
+        os.remove(trace)
+    config = json.loads(json.dumps(config))
+    config['data'].update(input_path=input_path.rstrip('/') + '/', output_path=output_path, staging_path=None,
+                          plan='', resume=False, log=True)
+    if workers:
+        config['data']['workers'] = workers
+    config['subjects']['folders'] = '*'
+    config.setdefault('inventory', {})['use'] = False
+    config['profile'] = {'trace': trace}
+    config_path = os.path.join(workdir, 'config.json')
+    with open(config_path, 'w') as f:
+        # JSON is valid YAML, so settings.load_config reads it
+        json.dump(config, f, indent=2)
+    env = dict(os.environ)
+    if bin_path:
+        env['PATH'] = bin_path + os.pathsep + env.get('PATH', '')
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, 'cli.py', 'convert', '--config', config_path, '--bids-code',
+                             bids_code_path], cwd=ROOT, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        sys.exit(f"Conversion failed:\n{result.stderr[-2000:]}")
+    return wall, output_path, stage_totals(trace)
+
+
+def run_validator(name, bids_dir):
+    code = PROBE.format(call=VALIDATORS[name].format(bids=bids_dir))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        return {'error': result.stderr.strip().splitlines()[-1], 'wall': wall}
+    return dict(json.loads(result.stdout.strip().splitlines()[-1]), wall=wall)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def organized_runs(bids_dir):
+    return sum(1 for _, _, files in os.walk(bids_dir) for name in files
+               if name.startswith('sub-') and ('.nii' in name))
+
+
+def benchmark(args):
+    config = load_config(args.config)
+    bids_code = load_bids_code(args.bids_code)
+    sizes = {'matrix': args.matrix, 'slices': args.slices, 'anat_matrix': args.anat_matrix,
+             'anat_slices': args.anat_slices, 'volumes': args.volumes, 'directions': args.directions}
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bids-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        input_path = os.path.join(workdir, 'dicom')
+        shutil.rmtree(input_path, ignore_errors=True)
+        start = time.perf_counter()
+        dataset = generate_dataset(input_path, bids_code, args.subjects, args.sessions, sizes, seed=args.seed)
+        dataset['generate_seconds'] = time.perf_counter() - start
+        print(f"Generated {dataset['sessions']} session(s), {dataset['series']} series, {dataset['files']} files, "
+              f"{dataset['bytes'] / 1024 ** 2:.0f} MB in {dataset['generate_seconds']:.1f} s")
+
+        bin_path = dcm2niix_path(workdir, args.stub)
+        runs = []
+        for _ in range(args.repeat):
+            runs.append(convert(workdir, input_path, config, os.path.abspath(args.bids_code), bin_path,
+                                args.workers))
+        wall, bids_dir, stages = min(runs, key=lambda run: run[0])
+        converted = stages.get('convert', {}).get('count', 0)
+        conversion = {
+            'wall': wall, 'series': dataset['series'], 'converted': converted, 'runs': organized_runs(bids_dir),
+            'series_per_min': dataset['series'] / wall * 60, 'mb_per_s': dataset['bytes'] / 1024 ** 2 / wall,
+            'peak_rss_mb': max((s['peak_rss_mb'] for s in stages.values()), default=0.0),
+            'dcm2niix_peak_rss_mb': max((s['child_peak_rss_mb'] for s in stages.values()), default=0.0),
+            'stages': stages,
+        }
+        validators = {name: run_validator(name, bids_dir) for name in VALIDATORS}
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(), 'python': platform.python_version(),
+        'platform': platform.platform(), 'cpus': os.cpu_count(), 'dcm2niix': 'stub' if bin_path else 'dcm2niix',
+        'parameters': dict(subjects=args.subjects, sessions=args.sessions, seed=args.seed, repeat=args.repeat,
+                           workers=args.workers or config['data'].get('workers', 1), **sizes),
+        'dataset': dataset, 'convert': conversion, 'validators': validators,
+    }
+
+
+def print_results(results):
+    c = results['convert']
+    print(f"Conversion ({results['dcm2niix']}): {c['wall']:.1f} s, {c['series_per_min']:.0f} series/min, "
+          f"{c['mb_per_s']:.1f} MB/s, {c['converted']} of {c['series']} series converted, {c['runs']} run(s) organized")
+    print(f"Peak RSS: converter {c['peak_rss_mb']:.0f} MB, dcm2niix {c['dcm2niix_peak_rss_mb']:.0f} MB")
+    print(f"{'stage':<12}{'count':>8}{'wall (s)':>12}{'cpu (s)':>10}{'child cpu':>11}{'read MB':>10}{'write MB':>10}")
+    for name, s in c['stages'].items():
+        print(f"{name:<12}{s['count']:>8}{s['wall']:>12.2f}{s['cpu']:>10.2f}{s['child_cpu']:>11.2f}"
+              f"{s['read_mb']:>10.1f}{s['write_mb']:>10.1f}")
+    print(f"{'validator':<16}{'seconds':>10}{'wall (s)':>10}{'peak MB':>10}")
+    for name, v in results['validators'].items():
+        if 'error' in v:
+            print(f"{name:<16}  failed: {v['error']}")
+        else:
+            print(f"{name:<16}{v['seconds']:>10.2f}{v['wall']:>10.2f}{v['peak_rss_mb']:>10.0f}")
+
+
+def figures(results):
+    """
+    Flat {name: value} of the figures compared between two runs.
+    """
+    c = results['convert']
+    values = {f"convert.{key}": c[key] for key in ('wall', 'series_per_min', 'mb_per_s', 'peak_rss_mb',
+                                                   'dcm2niix_peak_rss_mb')}
+    values.update({f"stage.{name}.wall": s['wall'] for name, s in c['stages'].items()})
+    for name, v in results['validators'].items():
+        if 'error' not in v:
+            values[f"validator.{name}.seconds"] = v['seconds']
+            values[f"validator.{name}.peak_rss_mb"] = v['peak_rss_mb']
+    return values
+
+
+def compare(previous, results, tolerance):
+    """
+    Prints the change of every figure since previous and returns 1 if one got worse by more than tolerance.
+    """
+    if previous['parameters'] != results['parameters'] or previous['dcm2niix'] != results['dcm2niix']:
+        print("Warning: the runs used different parameters or dcm2niix, the figures are not comparable")
+    before, after = figures(previous), figures(results)
+    print(f"Compared with {previous.get('commit') or '?'} ({previous['created']})")
+    print(f"{'figure':<36}{'before':>10}{'after':>10}{'change':>9}")
+    regressions = 0
+    for name in sorted(set(before) & set(after)):
+        if not before[name]:
+            continue
+        change = after[name] / before[name] - 1
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        noise = not name.endswith(HIGHER_IS_BETTER) and abs(after[name] - before[name]) < NOISE
+        flag = '  <-- regression' if worse > tolerance and not noise else ''
+        regressions += bool(flag)
+        print(f"{name:<36}{before[name]:>10.2f}{after[name]:>10.2f}{change:>+9.0%}{flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the conversion and the validators")
+    parser.add_argument("--subjects", type=int, default=4, help="Synthetic subjects (half of them from WrongNaming)")
+    parser.add_argument("--sessions", type=int, default=2, help="Sessions per subject")
+    parser.add_argument("--matrix", type=int, default=64, help="In-plane matrix of the DWI and BOLD series")
+    parser.add_argument("--slices", type=int, default=32, help="Slices of the DWI and BOLD series")
+    parser.add_argument("--anat-matrix", type=int, default=128, help="In-plane matrix of the anatomical series")
+    parser.add_argument("--anat-slices", type=int, default=96, help="Slices (files) of the anatomical series")
+    parser.add_argument("--volumes", type=int, default=120, help="Volumes (files) of the BOLD run")
+    parser.add_argument("--directions", type=int, default=30, help="Diffusion directions (plus one b0)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--workers", type=int, default=0, help="data.workers of the conversion (0: from the configuration)")
+    parser.add_argument("--repeat", type=int, default=1, help="Conversions of the same input (the fastest is reported)")
+    parser.add_argument("--stub", action="store_true", help="Use the stub dcm2niix even if dcm2niix is installed")
+    parser.add_argument("--config", default=os.path.join(ROOT, CONFIG_PATH), help="Configuration used as the base")
+    parser.add_argument("--bids-code", default=os.path.join(ROOT, BIDS_CODE_PATH), help="BIDS coding keys")
+    parser.add_argument("--workdir", help="Folder for the synthetic input and the output (kept; default: temporary)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary folder")
+    parser.add_argument("--output", help="JSON file of the results")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative change reported as a regression")
+    args = parser.parse_args()
+
+    results = benchmark(args)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    status = 0
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            status = compare(json.load(f), results, args.tolerance)
+    sys.exit(status)
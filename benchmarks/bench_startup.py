@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Startup time of the CLI entry points: each subcommand module is imported in a fresh interpreter and the
+median wall time is reported together with the heavy libraries it pulled in. A subcommand slower than
+--budget-ms, or one importing a library it should only load lazily, makes the benchmark exit with 1.
+
+    python benchmarks/bench_startup.py --repeat 10 --budget-ms 150
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# subcommand → module imported by cli.py for it
+COMMANDS = {
+    '(entry point)': 'cli',
+    'convert': 'main',
+    'validate': 'validate',
+    'patch-sidecars': 'Add_TaskName',
+    'plan': 'plan',
+    'shard': 'shard',
+    'errors': 'journal',
+    'inventory': 'inventory',
+}
+# Libraries that must not be imported just by starting a subcommand (they are imported where they are used)
+HEAVY = ('nibabel', 'pydicom', 'yaml', 'pandas', 'numpy')
+
+PROBE = "import sys, {module}; print(','.join(m for m in {heavy!r} if m in sys.modules))"
+
+
+def startup(module, repeat):
+    """
+    Returns (median wall time in ms, heavy libraries loaded) of importing module in a new interpreter.
+    """
+    code = PROBE.format(module=module, heavy=HEAVY)
+    times, loaded = [], ''
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+        loaded = result.stdout.strip()
+    return statistics.median(times), loaded
+
+
+def main(repeat, budget):
+    baseline, _ = startup('sys', repeat)
+    print(f"Interpreter alone: {baseline:.0f} ms (median of {repeat})")
+    print(f"{'command':<18}{'module':<14}{'ms':>8}{'+ms':>8}  heavy imports")
+    failed = False
+    for command, module in COMMANDS.items():
+        wall, loaded = startup(module, repeat)
+        over = budget and wall - baseline > budget
+        failed = failed or over or bool(loaded)
+        flag = '  <-- over budget' if over else ''
+        print(f"{command:<18}{module:<14}{wall:>8.0f}{wall - baseline:>8.0f}  {loaded or '-'}{flag}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark of the CLI startup time")
+    parser.add_argument("--repeat", type=int, default=5, help="Interpreter starts per command")
+    parser.add_argument("--budget-ms", type=float, default=0,
+                        help="Maximum import time per command above the bare interpreter (0 = no limit)")
+    args = parser.parse_args()
+    sys.exit(main(args.repeat, args.budget_ms))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Stand-in for dcm2niix used by bench_pipeline.py when the real binary is not installed (or with --stub).
+
+It accepts the arguments built by dcm2niix_runner.dcm2niix_command (-o, -f, -z, -1..-9 and the series folder),
+reads every DICOM file of the folder with its pixel data, and writes what dcm2niix would write for the synthetic
+series of bench_pipeline.py: a NIfTI image (%n--%p--%t name, gzip at the requested level), a JSON sidecar
+(ProtocolName, SeriesDescription, ImageType, RepetitionTime in s, PhaseEncodingDirection) and .bval/.bvec for
+diffusion series. Its stdout uses the "Convert N DICOM as <file> (<dims>)" lines parsed by dcm2niix_runner.
+"""
+import gzip
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import nibabel as nib
+import pydicom
+
+# InPlanePhaseEncodingDirection → PhaseEncodingDirection (the polarity comes from the Siemens CSA header,
+# which the synthetic series do not have: dcm2niix would write j- for their A>P acquisitions)
+PHASE_ENCODING = {'COL': 'j-', 'ROW': 'i-'}
+# exit code of dcm2niix when a folder has no DICOM file
+EXIT_NO_VALID_FILES = 2
+
+
+def parse_arguments(args):
+    options = {'output': '.', 'format': '%n--%p--%t', 'gzip': True, 'level': 6, 'folder': args[-1]}
+    i = 0
+    while i < len(args) - 1:
+        if args[i] == '-o':
+            options['output'], i = args[i + 1], i + 1
+        elif args[i] == '-f':
+            options['format'], i = args[i + 1], i + 1
+        elif args[i] == '-z':
+            options['gzip'], i = args[i + 1] in ('y', 'i'), i + 1
+        elif args[i][1:].isdigit():
+            options['level'] = int(args[i][1:])
+        i += 1
+    return options
+
+
+def read_series(folder):
+    datasets = []
+    for name in sorted(os.listdir(folder)):
+        try:
+            datasets.append(pydicom.dcmread(os.path.join(folder, name)))
+        except Exception:
+            continue
+    return sorted(datasets, key=lambda ds: int(ds.get('InstanceNumber') or 0))
+
+
+def image(datasets):
+    """
+    Voxel array: files with several frames are volumes of a 4D run, single-frame files are the slices of a 3D image.
+    """
+    if int(datasets[0].get('NumberOfFrames') or 1) > 1:
+        volumes = [np.moveaxis(ds.pixel_array, 0, -1) for ds in datasets]
+        return np.stack(volumes, axis=-1) if len(volumes) > 1 else volumes[0]
+    return np.stack([ds.pixel_array for ds in datasets], axis=-1)
+
+
+def write_nifti(path, data, first, gzip_output, level):
+    spacing = [float(v) for v in first.get('PixelSpacing', [1, 1])]
+    thickness = float(first.get('SliceThickness') or 1)
+    tr = float(first.get('RepetitionTime') or 0) / 1000
+    img = nib.Nifti1Image(data.astype(np.int16), np.diag(spacing + [thickness, 1]))
+    img.header.set_zooms(tuple(spacing + [thickness] + ([tr] if data.ndim > 3 else [])))
+    img.header.set_xyzt_units('mm', 'sec')
+    nib.save(img, path + '.nii')
+    if gzip_output:
+        with open(path + '.nii', 'rb') as src, gzip.open(path + '.nii.gz', 'wb', compresslevel=level) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.remove(path + '.nii')
+
+
+def write_sidecars(path, datasets):
+    first = datasets[0]
+    sidecar = {
+        'Modality': 'MR', 'ProtocolName': str(first.get('ProtocolName', '')),
+        'SeriesDescription': str(first.get('SeriesDescription', '')),
+        'ImageType': [str(v) for v in first.get('ImageType', [])],
+        'SeriesNumber': int(first.get('SeriesNumber') or 0),
+        'RepetitionTime': float(first.get('RepetitionTime') or 0) / 1000,
+        'ConversionSoftware': 'dcm2niix (benchmark stub)',
+    }
+    phase = PHASE_ENCODING.get(str(first.get('InPlanePhaseEncodingDirection', '')))
+    if phase:
+        sidecar['PhaseEncodingDirection'] = phase
+    with open(path + '.json', 'w') as f:
+        json.dump(sidecar, f, indent=2)
+    if 'DiffusionBValue' in first:
+        with open(path + '.bval', 'w') as f:
+            f.write(' '.join(f"{float(ds.DiffusionBValue):g}" for ds in datasets) + '\n')
+        vectors = [[float(v) for v in ds.DiffusionGradientOrientation] for ds in datasets]
+        with open(path + '.bvec', 'w') as f:
+            for axis in range(3):
+                f.write(' '.join(f"{vector[axis]:.6f}" for vector in vectors) + '\n')
+
+
+def main(args):
+    options = parse_arguments(args)
+    print("Chris Rorden's dcm2niiX version (benchmark stub)")
+    datasets = read_series(options['folder'])
+    if not datasets:
+        print(f"Error: Unable to find any DICOM images in {options['folder']}")
+        return EXIT_NO_VALID_FILES
+    first = datasets[0]
+    name = options['format'] \
+        .replace('%n', str(first.get('PatientName', '')).replace(' ', '_')) \
+        .replace('%p', str(first.get('ProtocolName', '')).strip().replace(' ', '_')) \
+        .replace('%t', str(first.get('StudyDate', '')) + str(first.get('StudyTime', '')).split('.')[0])
+    path = os.path.join(options['output'], name)
+    data = image(datasets)
+    write_nifti(path, data, first, options['gzip'], options['level'])
+    write_sidecars(path, datasets)
+    print(f"Convert {len(datasets)} DICOM as {path} ({'x'.join(str(n) for n in data.shape)})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,12 +1,25 @@
 import json
-from subprocess import Popen, STDOUT, PIPE
+import logging
 import os
 import re
 from pathlib import Path
-import pandas as pd
+import shutil
+import tempfile
 import fnmatch
+from contextlib import nullcontext
 
+from archives import archive_series, extracted, hidden, is_archive, is_archive_series, release, session_name, SEPARATOR
 from criteria import inclusion_or_exclusion_criteria
+from triage import triage_series
+from sessions import SessionSummary, locked, read_rows
+from sidecars import patch_sidecar, sidecar_updates
+from mover import move_file, next_backup_index
+from profiling import stage
+from dcm2niix_runner import run_dcm2niix
+from compression import compress_niftis
+from naming import compile_rules
+from journal import error_context
+from dedup import MODES as DEDUP_MODES, STATS as DEDUP, duplicate_of, hash_index, identical_file, versions
 
 def check_path(path):
     if not os.path.isdir(path):
@@ -46,6 +59,7 @@ def get_folders(search_type='directory', **kwargs):
         search_type (str): 'directory' 또는 'file' 중 하나.
         **kwargs: 추가 인자.
             - config (dict): 구성 사전. 'data.input_path' 및 'subjects.folders' 키를 포함해야 함.
+              'data.archives'가 켜져 있으면 세션 archive 파일 (archives.py)도 세션 폴더로 반환됨.
             - path (str): 검색할 경로. 'config'가 제공되지 않은 경우 사용됨.
             - exclude (str): 제외할 파일의 확장자.
 
@@ -62,9 +76,11 @@ def get_folders(search_type='directory', **kwargs):
         config = kwargs['config']
         dicom_path = config["data"]["input_path"]
         subjects = f"*{config['subjects']['folders']}*"
+        archives = search_type == 'directory' and config['data'].get('archives', False)
     except KeyError:
         dicom_path = kwargs.get('path', '.')
         subjects = "*"
+        archives = False
 
     exclude = kwargs.get('exclude', "")
 
@@ -73,7 +89,7 @@ def get_folders(search_type='directory', **kwargs):
 
     # 디렉토리 또는 파일 목록 가져오기
     if search_type == 'directory':
-        entries = [e for e in p.iterdir() if e.is_dir()]
+        entries = [e for e in p.iterdir() if e.is_dir() or (archives and is_archive(e.name) and e.is_file())]
     elif search_type == 'file':
         entries = [e for e in p.iterdir() if e.is_file()]
     else:
@@ -96,79 +112,273 @@ def get_folders(search_type='directory', **kwargs):
 
     return folders_sorted, len(folders_sorted)
 
-def check_ID(json_data, ID):
-    wrong_names = json_data["WrongNaming"]
-    if ID in wrong_names:
-        return wrong_names[ID]
-    else:
-        return ID
-    
 def get_nifti_info(nifti_file, json_data):
-    path = nifti_file.removesuffix(nifti_file.split('/')[-1])
-    name = re.split(r"[.][a-zA-Z]", nifti_file.split('/')[-1])[0]
-    i,p,t = name.split('--')
-    t = t[:4]+'-'+t[4:6]
-    info_nifti = type('', (), {})()
-    raw_ID = re.split(r"^0+",re.search(r"\d+", i).group())[-1]
-    info_nifti.num_id = check_ID(json_data, raw_ID)
-    info_nifti.session = re.findall(r"[A-Z0-9]+",re.split(r"\d{2,}", i)[-1].upper())[0]
-    info_nifti.protocol, info_nifti.time = p, t
-    if len(info_nifti.num_id) == 1:
-        info_nifti.num_id = '0'+info_nifti.num_id
-    return path, name, info_nifti
-
-def organize_niftis(niftis, root_subject, root_name, mri):
-    # Moving niftis
+    """
+    dcm2niix 파일 경로를 (폴더 경로, 파일 이름, SeriesInfo)로 해석합니다 (naming.NamingRules.parse 참고).
+    """
+    return compile_rules(json_data).parse(nifti_file)
+
+def organize_niftis(niftis, root_subject, root_name, mri, strategy='auto', verify=True, dedup='off', index=None):
+    """
+    변환된 파일들을 root_subject/mri/ 아래에 root_name으로 옮기고, 같은 이름이 있으면 backup/ 폴더에 _bck-N으로 옮깁니다.
+    dedup (dedup.py)이 'skip'이면 이미 있는 시리즈 (현재 파일 또는 backup)와 모든 파일의 내용이 같은 시리즈는 옮기지 않고
+    삭제하며, 'hardlink'이면 backup을 만들되 내용이 같은 파일은 기존 파일의 hardlink로 만듭니다.
+    index는 기존 파일의 digest를 기록하는 dedup.HashIndex입니다.
+    """
+    if dedup not in DEDUP_MODES:
+        raise ValueError("Invalid dedup. Expected one of: %s" % list(DEDUP_MODES))
+    # Moving niftis (the destination and backup folders are listed once, not probed file by file)
+    target = root_subject + mri + '/'
+    existing = set(os.listdir(target)) if os.path.isdir(target) else set()
+    backup_names = None
+    extensions = {}
     for nifti in niftis:
         if nifti.split('.')[-1] == 'gz':
-            extension = nifti.split('.')[-2] + '.' + nifti.split('.')[-1]
+            extensions[nifti] = nifti.split('.')[-2] + '.' + nifti.split('.')[-1]
         else:
-            extension = nifti.split('.')[-1]
-        full_name = root_subject+mri+'/'+root_name+'.'+extension
+            extensions[nifti] = nifti.split('.')[-1]
+
+    candidates = []
+    if dedup != 'off' and any(root_name+'.'+extension in existing for extension in extensions.values()):
+        backup_names = os.listdir(target+'backup/') if os.path.isdir(target+'backup/') else []
+        candidates = versions(target, root_name, set(extensions.values()), existing, backup_names)
+        if dedup == 'skip' and duplicate_of({ext: nifti for nifti, ext in extensions.items()}, candidates, index):
+            # Same acquisition already organized: nothing is moved and no backup is created
+            saved = sum(os.path.getsize(nifti) for nifti in niftis)
+            for nifti in niftis:
+                os.remove(nifti)
+            DEDUP.add(skipped=1, saved=saved)
+            return 0
+
+    for nifti in niftis:
+        extension = extensions[nifti]
+        full_name = target+root_name+'.'+extension
         backup = 0
-        if os.path.exists(full_name):
-            check_path(root_subject+mri+'/backup/')
-            full_name = root_subject+mri+'/backup/'+root_name+'_bck-'+str(backup)+'.'+extension
-            while os.path.exists(full_name):
-                full_name = root_subject + mri + '/backup/' + root_name + '_bck-' + str(backup) + '.' + extension
-                backup += 1
-        Path(nifti).rename(full_name)
+        if root_name+'.'+extension in existing:
+            check_path(target+'backup/')
+            if backup_names is None:
+                backup_names = os.listdir(target+'backup/')
+            index_bck = next_backup_index(backup_names, root_name, extension)
+            full_name = target+'backup/'+root_name+'_bck-'+str(index_bck)+'.'+extension
+            backup_names.append(os.path.basename(full_name))
+            # Same number as reported by the former os.path.exists probing loop
+            backup = index_bck + 1 if index_bck > 0 else 0
+            if dedup == 'hardlink':
+                same = identical_file(nifti, [v[extension] for v in candidates if extension in v], index)
+                if same is not None:
+                    nbytes = os.path.getsize(nifti)
+                    os.link(same, full_name)
+                    os.remove(nifti)
+                    DEDUP.add(linked=1, saved=nbytes)
+                    continue
+        move_file(nifti, full_name, strategy=strategy, verify=verify)
 
     return backup
 
-def convert_dicom_session(f, config, bids_code):
-    dicom_folders, num_dicoms = get_folders(path=f, search_type='directory')
-    backup_anat, backup_dwi, backup_func = 0, 0, 0
+def staging_root(config):
+    """
+    변환 결과가 임시로 저장되는 staging 폴더를 반환합니다.
+    기본값은 출력 폴더 안이며 (같은 파일 시스템이므로 BIDS 폴더로의 이동은 rename 한 번),
+    config의 'data.staging_path'로 로컬 디스크 등 다른 위치를 지정할 수 있습니다 (이동은 mover.py 참고).
+    """
+    return config['data'].get('staging_path') or config['data']['output_path'] + '.staging/'
+
+def staging_folder(config, f):
+    """
+    세션 폴더 f의 변환 결과가 임시로 저장되는 staging 경로를 반환합니다.
+    """
+    return staging_root(config) + f.rstrip('/').split('/')[-1] + '/'
+
+def scratch_root(config):
+    """
+    세션 archive에서 시리즈를 하나씩 풀어 두는 폴더를 반환합니다 (변환이 끝나면 바로 삭제됨).
+    기본값은 staging 폴더 안이며, config의 'data.scratch_path'로 tmpfs (/dev/shm 등)를 지정할 수 있습니다.
+    """
+    return config['data'].get('scratch_path') or staging_root(config) + '.scratch/'
+
+def list_series(f):
+    """
+    세션 폴더 f의 DICOM 시리즈 폴더 목록을 반환합니다.
+    세션 archive이면 압축을 풀지 않고 archive 안의 시리즈 경로 (archive::시리즈 폴더) 목록을 반환합니다.
+    숨김 폴더 ('.'로 시작, __MACOSX)는 archive 안에서와 같이 (archives.hidden) 포함하지 않습니다.
+    """
+    if is_archive(f) and os.path.isfile(f):
+        return sorted(archive_series(f), key=lambda df: natural_sort_key(df.split(SEPARATOR)[-1]))
+    return [df for df in get_folders(path=f, search_type='directory')[0] if not hidden(os.path.basename(df))]
+
+def convert_series(df, staging, config):
+    """
+    DICOM 시리즈 폴더 하나를 staging 아래의 전용 임시 폴더에 dcm2niix로 변환하고,
+    생성된 파일 목록을 반환합니다. 파일 목록은 dcm2niix의 출력에서 읽으므로 폴더를 다시 검색할 필요가 없습니다.
+    config의 'data.timeout' (초)이 지나면 dcm2niix를 종료하고 'data.retries'번까지 다시 실행합니다.
+    'data.compress'가 'parallel'이면 dcm2niix는 압축하지 않고, 변환된 NIfTI를 여러 thread로 gzip 합니다 (compression.py).
+    archive 시리즈 (archives.py)는 scratch_root 아래에 그 시리즈만 풀어 변환하고 바로 삭제합니다.
+    """
+    check_path(staging)
+    output_dir = tempfile.mkdtemp(prefix=Path(df).name + '-', dir=staging) + '/'
+    parallel = config['data']['gzip'] and config['data'].get('compress', 'dcm2niix') == 'parallel'
+    level = config['data'].get('compress_level')
+    source = extracted(df, scratch_root(config)) if is_archive_series(df) else nullcontext(df)
+    with stage('convert', series=df), error_context('convert', df), source as folder:
+        result = run_dcm2niix(folder, output_dir, gzip=config['data']['gzip'] and not parallel, level=level,
+                              timeout=config['data'].get('timeout'), retries=config['data'].get('retries', 1))
+    for warning in result.warnings:
+        logging.warning(f" {df}: {warning}")
+    niftis = result.files
+    if parallel:
+        with stage('compress', series=df), error_context('compress', df):
+            niftis = compress_niftis(niftis, level=level or 6, threads=config['data'].get('compress_threads'))
+    niftis = sorted(niftis, key=lambda x: natural_sort_key(Path(x).name))
+    if not niftis:
+        os.rmdir(output_dir)
+    return niftis
+
+def remove_niftis(niftis):
+    """
+    변환된 파일들과 그 전용 임시 폴더를 삭제합니다.
+    """
+    for nf in niftis:
+        os.remove(nf)
+    os.rmdir(os.path.dirname(niftis[0]))
+
+def session_series(f, config, bids_code, manifest=None, planned=None):
+    """
+    세션 폴더 f에서 처리할 DICOM 시리즈 폴더 목록을 반환합니다.
+    config의 'data.triage'가 켜져 있으면 DICOM header만 읽어 제외될 시리즈
+    (localizer, scout, FA/ADC 등의 derived map, 짧은 BOLD)는 변환하지 않습니다.
+    planned (plan.load_plan의 결과)가 주어지면 plan에서 변환하기로 한 시리즈만 처리합니다 (triage는 plan에서 이미 적용됨).
+
+    Returns:
+        list: (시리즈 폴더, manifest 기록) 목록. 이전 실행 이후 바뀌지 않은 시리즈는
+              manifest 기록이 있으며 다시 변환하지 않습니다. 그 외에는 None.
+    """
+    if planned is not None:
+        dicom_folders = planned.get(f, [])
+    else:
+        dicom_folders = list_series(f)
+    series = []
+    for df in dicom_folders:
+        record = manifest.check(df) if manifest is not None else None
+        if record is None and planned is None and config['data'].get('triage', False):
+            with stage('triage', series=df), error_context('triage', df):
+                keep, reason = triage_series(df, bids_code)
+            if not keep:
+                if manifest is not None:
+                    manifest.record(df)
+                continue
+        series.append((df, record))
+    return series
+
+def session_unchanged(f, series, config, bids_code):
+    """
+    session_series의 결과에서 모든 시리즈가 이전 실행 그대로이고 세션 f의 row가 sessions.tsv에 있으면 True를 반환합니다.
+    manifest는 시리즈마다 바로 기록되지만 sessions.tsv는 checkpoint마다 기록되므로, 그 사이에 중단된 실행의 세션은
+    manifest에만 남아 있을 수 있습니다. 그런 세션은 다시 처리되며 (변환하지 않고 manifest 기록 사용) row가 추가됩니다.
+    """
+    if not series or not all(isinstance(result, dict) for df, result in series):
+        return False
+    organized = [result['name'] for df, result in series if result['mri'] is not None]
+    if not organized:
+        # 정리된 시리즈가 없는 세션은 row도 없음
+        return True
+    rules = compile_rules(bids_code)
+    subject = rules.subject(rules.parse(organized[-1])[2])
+    tsv_name = config['data']['output_path'] + 'sub-' + subject + '/sub-' + subject + '_sessions.tsv'
+    return any(row['FOLDER'] == session_name(f) for row in read_rows(tsv_name))
+
+def discard_staging(config, f):
+    """
+    세션 폴더 f의 staging 폴더에 남아 있는 파일 목록을 반환하고 staging 폴더를 삭제합니다.
+    세션 archive이면 archive 목록 (archives.release)도 해제합니다.
+    """
+    staging = staging_folder(config, f)
+    leftovers = sorted(str(p) for p in Path(staging).rglob('*') if p.is_file())
+    shutil.rmtree(staging, ignore_errors=True)
+    release(f)
+    return leftovers
+
+def classify_series(df, niftis, bids_code):
+    """
+    변환된 시리즈의 파일 이름을 해석하고 criteria.py의 기준을 적용합니다.
+
+    Returns:
+        tuple: (폴더 경로, 파일 이름, SeriesInfo, 진행 여부, PROTOCOLS 항목).
+               이름을 해석할 수 없는 localizer/scout 시리즈는 None.
+
+    Raises:
+        ValueError: 그 외에 이름을 해석할 수 없는 경우 (세션 폴더 전체가 실패합니다).
+    """
+    try:
+        path, name, info_niftis = get_nifti_info(niftis[0], bids_code)
+    except:
+        # check if nifitis[0] contains 'localizer' or 'scout'
+        if 'localizer' in niftis[0].lower() or 'scout' in niftis[0].lower():
+            return None
+        else:
+            # throw error
+            with error_context('classify', df):
+                raise ValueError(f"Error in converted file {niftis[0]} \n")
+    with stage('criteria', series=df), error_context('criteria', df):
+        proceed, mri = inclusion_or_exclusion_criteria(niftis, info_niftis, bids_code)
+    return path, name, info_niftis, proceed, mri
+
+def convert_dicom_session(f, config, bids_code, converted=None, manifest=None, summary=None, planned=None):
+    """
+    세션 폴더 f를 변환하고 BIDS 구조로 정리합니다.
+
+    converted가 주어지지 않으면 시리즈를 하나씩 순서대로 변환합니다.
+    pipeline.py의 변환 결과를 넘겨주면 (시리즈 순서대로 (시리즈 폴더, 생성된 파일 목록[, classify_series 결과])의 iterable)
+    변환과 분류는 pipeline에서 병렬로 진행되고 정리는 여기에서 시리즈 순서대로 이루어집니다.
+    manifest가 주어지면 바뀌지 않은 시리즈는 변환하지 않고 기록된 결과를 사용하며,
+    모든 시리즈가 그대로인 세션은 건너뜁니다.
+    summary (SessionSummary)가 주어지면 sessions.tsv의 row는 메모리에 모이고 summary.flush()에서 기록됩니다.
+    주어지지 않으면 sessions.tsv를 바로 갱신합니다.
+    planned가 주어지면 plan (plan.py)에서 변환하기로 한 시리즈만 변환합니다.
+    """
+    if converted is None:
+        series = session_series(f, config, bids_code, manifest, planned)
+        if session_unchanged(f, series, config, bids_code):
+            release(f)
+            return
+        staging = staging_folder(config, f)
+        converted = ((df, record if record is not None else convert_series(df, staging, config))
+                     for df, record in series)
+    rules = compile_rules(bids_code)
+    backups = {'anat': 0, 'dwi': 0, 'func': 0}
     
     ##### Convert and process each DICOM session ####
     current_session = {
-        "session_id": '', "acq_time": '',"FOLDER": f.split("/")[-1],
+        "session_id": '', "acq_time": '',"FOLDER": session_name(f),
         "anat": 0, "dwi": 0, "func": 0,
         "BACKUP-anat": 0, "BACKUP-dwi": 0, "BACKUP-func": 0
     }
+    info_niftis = None
+
+    for item in converted:
+        df, niftis = item[0], item[1]
+        if isinstance(niftis, dict):
+            # Unchanged since the previous run: use the outcome recorded in the manifest
+            if niftis['name'] is not None:
+                path, name, info_niftis = get_nifti_info(niftis['name'], bids_code)
+            if niftis['mri'] is not None:
+                backups[niftis['mri']] = niftis['backup']
+                current_session[niftis['mri']] += 1
+            continue
 
-    for df in dicom_folders:
-        output = Popen(
-            f"dcm2niix -o {config['data']['output_path']} -f %n--%p--%t -z {'y' if config['data']['gzip'] else 'n'} {df}", shell=True, stdout=PIPE
-        ).stdout.read()
-        
         ## Get nifti info - Prepare file naming ##
-        niftis, nums = get_folders(path=config['data']['output_path'], search_type='file', exclude='t*')
+        nums = len(niftis)
         if (not niftis == ['']) and (not nums == 0):
-            # Succesful DICOM --> NIFTI conversion
-            try:
-                path, name, info_niftis = get_nifti_info(niftis[0], bids_code)
-            except:
-                # check if nifitis[0] contains 'localizer' or 'scout'
-                if 'localizer' in niftis[0].lower() or 'scout' in niftis[0].lower():
-                    # Remove converted files
-                    for nf in niftis:
-                        os.remove(nf)
-                    continue
-                else:
-                    # throw error
-                    raise ValueError(f"Error in converted file {niftis[0]} \n")
-            proceed, mri = inclusion_or_exclusion_criteria(niftis, info_niftis, bids_code)
+            # Succesful DICOM --> NIFTI conversion (classified already if the pipeline passed a third element)
+            classified = item[2] if len(item) > 2 else classify_series(df, niftis, bids_code)
+            if isinstance(classified, Exception):
+                raise classified
+            if classified is None:
+                # Remove converted files
+                remove_niftis(niftis)
+                if manifest is not None:
+                    manifest.record(df)
+                continue
+            path, name, info_niftis, proceed, mri = classified
             
             if proceed:
                 if bids_code[mri] == 'dwi':
@@ -176,84 +386,106 @@ def convert_dicom_session(f, config, bids_code):
                         acq = json.load(open(path+name+'.json', 'r'))["PhaseEncodingDirection"]
                     except:
                         # if no PhaseEncodingDirection in json file, remove converted files
-                        for nf in niftis:
-                            os.remove(nf)
+                        remove_niftis(niftis)
+                        if manifest is not None:
+                            manifest.record(df, name=name)
                         continue
-                    file_name = 'sub-' + bids_code[info_niftis.session]["ID"] + info_niftis.num_id + '_' + \
-                        bids_code[info_niftis.session]["session"] + '_' + \
-                        bids_code[acq] + '_' + \
-                        bids_code[mri]
+                    file_name = rules.file_name(info_niftis, bids_code[mri], acq=bids_code[acq])
                     mri = bids_code[mri]            
                 elif bids_code[mri] == 'T1w' or bids_code[mri] == 'T2w':
-                    file_name = 'sub-' + bids_code[info_niftis.session]["ID"] + info_niftis.num_id + '_' + \
-                        bids_code[info_niftis.session]["session"] + '_' + \
-                        bids_code[mri]
+                    file_name = rules.file_name(info_niftis, bids_code[mri])
                     mri = 'anat'
                 elif bids_code[mri] == 'bold':
                     # TODO: Add BOLD: func (if necessary)
-                    file_name = 'sub-' + bids_code[info_niftis.session]["ID"] + info_niftis.num_id + '_' + \
-                        bids_code[info_niftis.session]["session"] + '_task-rest_run-' + \
-                        str(current_session["func"]) + '_' +\
-                        bids_code[mri]
+                    file_name = rules.file_name(info_niftis, bids_code[mri], task='rest', run=current_session["func"])
                     mri = 'func'
 
                 ## Create subject BIDS directory ##
-                subject_folder = config['data']['output_path'] + \
-                    'sub-' + bids_code[info_niftis.session]["ID"] + \
-                    info_niftis.num_id + '/' + \
-                    bids_code[info_niftis.session]["session"]+ '/' 
+                subject_folder = config['data']['output_path'] + 'sub-' + rules.subject(info_niftis) + '/' + \
+                    rules.session(info_niftis) + '/'
                 new = check_path(subject_folder)
                 if new:
                     bids_tree(subject_folder, mris=config['subjects']['mris'])
 
                 if mri in config['subjects']['mris']:
+                    ## Patch JSON sidecars (in staging, before they are moved) ##
+                    updates = sidecar_updates(file_name + '.json', config.get('sidecars'))
+                    if updates:
+                        for nf in niftis:
+                            if nf.endswith('.json'):
+                                patch_sidecar(nf, updates)
+
                     ## Organize nifti files ##   
-                    backup = organize_niftis(niftis, subject_folder, file_name, mri)
-                    if mri == 'anat':
-                        backup_anat = backup
-                    elif mri == 'dwi':
-                        backup_dwi = backup
-                    else:
-                        backup_func = backup
+                    # Other shard workers may place files in the same sub/ses (WrongNaming, re-exported sessions):
+                    # with a shared output, listing the folder, choosing the name or _bck-N index and moving are
+                    # done under one lock (the lock file is only created then, not in a single-process dataset)
+                    shared = summary is not None and summary.shared
+                    with stage('organize', series=df), error_context('organize', df), \
+                            locked(subject_folder.rstrip('/')) if shared else nullcontext():
+                        # an unquoted `dedup: off` is read by YAML as False
+                        dedup = config['data'].get('dedup') or 'off'
+                        backup = organize_niftis(niftis, subject_folder, file_name, mri,
+                                                 strategy=config['data'].get('move', 'auto'),
+                                                 verify=config['data'].get('verify', True), dedup=dedup,
+                                                 index=hash_index(config['data']['output_path']) if dedup != 'off' else None)
+                        os.rmdir(os.path.dirname(niftis[0]))
+                    backups[mri] = backup
+
+                    ## QC metrics (qc.py), next to the organized run ##
+                    qc_options = config.get('qc') or {}
+                    if qc_options.get('enabled', False) and mri in ('func', 'dwi'):
+                        # numpy is only imported when QC is on
+                        from qc import CHUNK, run_qc
+                        try:
+                            with stage('qc', series=df):
+                                run_qc(subject_folder + mri + '/' + file_name, mri,
+                                       chunk=int(qc_options.get('chunk') or CHUNK))
+                        except Exception as e:
+                            logging.warning(f" QC failed for {file_name}: {e}")
 
                     ## Update intra-session MRI ##
                     current_session[mri] += 1
+                    if manifest is not None:
+                        manifest.record(df, name=name, mri=mri, backup=backup)
                 else:
                     # Remove converted files
-                    for nf in niftis:
-                        os.remove(nf)  
+                    remove_niftis(niftis)
+                    if manifest is not None:
+                        manifest.record(df, name=name)
 
             else:
                 # Remove converted files
-                for nf in niftis:
-                    os.remove(nf)    
+                remove_niftis(niftis)
+                if manifest is not None:
+                    manifest.record(df, name=name)
+    discard_staging(config, f)
+    if info_niftis is None:
+        # 변환된 시리즈가 없는 세션 (plan이나 triage에서 모든 시리즈가 빠진 폴더)은 sessions.tsv에 기록할 것이 없음
+        return
     
     #### Update Subject Summary ####
-    if os.path.exists(config['data']['output_path'] + 'sub-' + bids_code[info_niftis.session]["ID"] + info_niftis.num_id + '/'):
+    subject_dir = config['data']['output_path'] + 'sub-' + rules.subject(info_niftis) + '/'
+    if os.path.exists(subject_dir):
         #   Current Session
         current_session['acq_time'] = info_niftis.time
-        current_session['session_id'] = bids_code[info_niftis.session]["session"]
-        current_session['BACKUP-anat'] = backup_anat
-        current_session['BACKUP-dwi'] = backup_dwi
-        current_session['BACKUP-func'] = backup_func
-        tsv_name = config['data']['output_path'] + 'sub-' + bids_code[info_niftis.session]["ID"] + info_niftis.num_id + '/' + \
-            'sub-' + bids_code[info_niftis.session]["ID"] + info_niftis.num_id + '_sessions.tsv'
-        try: #   Non-available Summary from previous folders
-            subject_summary = pd.read_csv(tsv_name, sep='\t')
-        except: # Available Summary from previous folders
-            subject_summary = pd.DataFrame(
-                columns=['session_id', 'acq_time', 'FOLDER', 'anat', 'dwi', 'func', 'BACKUP-anat', 'BACKUP-dwi', 'BACKUP-func']
-            )
-        #   Combine earlier sessions with current
-        current_session = pd.DataFrame(
-            [current_session], columns=['session_id', 'acq_time', 'FOLDER', 'anat', 'dwi', 'func', 'BACKUP-anat', 'BACKUP-dwi', 'BACKUP-func']
-        )
-        subject_summary = pd.concat([subject_summary, current_session], ignore_index=True)
-        subject_summary.to_csv(tsv_name, sep='\t', index=False)
-
-        if subject_summary['anat'][0] < 2:
+        current_session['session_id'] = rules.session(info_niftis)
+        current_session['BACKUP-anat'] = backups['anat']
+        current_session['BACKUP-dwi'] = backups['dwi']
+        current_session['BACKUP-func'] = backups['func']
+        tsv_name = subject_dir + 'sub-' + rules.subject(info_niftis) + '_sessions.tsv'
+        #   Combine earlier sessions with current (a folder processed again replaces its previous row)
+        with stage('summary', folder=f):
+            if summary is None:
+                subject_summary = SessionSummary()
+                rows = subject_summary.add(tsv_name, current_session)
+                subject_summary.flush()
+            else:
+                rows = summary.add(tsv_name, current_session)
+
+        if int(rows[0]['anat']) < 2:
             # throw error that says that the subject does not has either T1w or T2w
-            raise ValueError(f"Subject {bids_code[info_niftis.session]['ID']}{info_niftis.num_id} does not have 2 anatomical images \n")
+            with error_context('summary'):
+                raise ValueError(f"Subject {rules.subject(info_niftis)} does not have 2 anatomical images \n")
         
 if __name__ == '__main__':
     pass
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import fnmatch
+import json
+import os
+from pathlib import Path
+
+# subject 폴더 아래로 읽는 깊이: sub-*/ses-*/<modality>/<files>
+MAX_DEPTH = 3
+
+
+def cache_file(bids_dir):
+    """
+    bids_dir의 listing cache 경로: 데이터셋과 같은 폴더의 숨김 파일 .<데이터셋 이름>.bids_index.json.
+    """
+    root = Path(bids_dir).resolve()
+    return root.parent / ('.' + root.name + '.bids_index.json')
+
+
+class BIDSIndex:
+    """
+    BIDS 데이터셋을 os.scandir로 한 번만 읽어 subject → session → modality → 파일 목록을 제공합니다.
+
+    cache가 켜져 있으면 각 폴더의 listing을 그 폴더의 mtime과 함께 cache 파일 (cache_path, 기본값: cache_file(bids_dir))에
+    저장합니다. cache 파일은 데이터셋 밖 (bids_dir 옆)에 두므로 validator나 checksum에 포함되지 않습니다.
+    다음 실행에서는 mtime이 바뀐 폴더만 다시 읽고, 나머지는 stat 한 번으로 cache를 사용합니다.
+    숨김 파일과 폴더 ('.'로 시작)는 glob과 마찬가지로 포함하지 않습니다.
+    """
+
+    def __init__(self, bids_dir, cache=True, cache_path=None):
+        self.root = Path(bids_dir)
+        self.cache_file = Path(cache_path or cache_file(bids_dir)) if cache else None
+        self.listings = {}
+        self.rescanned = 0
+
+        previous = {}
+        if self.cache_file is not None and self.cache_file.exists():
+            try:
+                previous = json.loads(self.cache_file.read_text(encoding='utf-8'))
+            except ValueError:
+                previous = {}
+
+        if self.root.is_dir():
+            self._walk('', 0, previous)
+            if self.cache_file is not None and self.rescanned:
+                tmp_name = str(self.cache_file) + '.tmp'
+                try:
+                    with open(tmp_name, 'w', encoding='utf-8') as f:
+                        json.dump(self.listings, f)
+                    os.replace(tmp_name, self.cache_file)
+                except OSError:
+                    # 데이터셋 옆 폴더에 쓸 수 없으면 cache 없이 사용 (다음 실행에서 다시 읽음)
+                    pass
+
+    def _walk(self, rel, depth, previous):
+        """
+        rel 폴더의 listing을 (cache에서 또는 scandir로) 가져오고, MAX_DEPTH까지 하위 폴더를 읽습니다.
+        """
+        path = os.path.join(self.root, rel) if rel else str(self.root)
+        mtime = os.stat(path).st_mtime_ns
+        listing = previous.get(rel)
+        if listing is None or listing['mtime'] != mtime:
+            files, dirs = [], []
+            with os.scandir(path) as it:
+                for e in it:
+                    if e.name.startswith('.'):
+                        continue
+                    (dirs if e.is_dir() else files).append(e.name)
+            listing = {'mtime': mtime, 'files': sorted(files), 'dirs': sorted(dirs)}
+            self.rescanned += 1
+        self.listings[rel] = listing
+        if depth < MAX_DEPTH:
+            for d in listing['dirs']:
+                if depth == 0 and not d.startswith('sub-'):
+                    continue
+                self._walk(os.path.join(rel, d) if rel else d, depth + 1, previous)
+
+    def _listing(self, *parts):
+        return self.listings.get(os.path.join(*[p for p in parts if p]), None)
+
+    def path(self, subject=None, session=None, modality=None):
+        """
+        subject/session/modality 폴더의 경로를 반환합니다.
+        """
+        return self.root.joinpath(*[p for p in (subject, session, modality) if p])
+
+    def subjects(self, pattern='sub-*'):
+        """
+        pattern에 맞는 subject 폴더 이름 목록 (정렬됨)을 반환합니다.
+        """
+        return [d for d in self.listings['']['dirs'] if fnmatch.fnmatch(d, pattern)] if '' in self.listings else []
+
+    def sessions(self, subject):
+        """
+        subject의 session 폴더 (ses-*) 이름 목록을 반환합니다.
+        """
+        listing = self._listing(subject)
+        return [d for d in listing['dirs'] if d.startswith('ses-')] if listing else []
+
+    def subject_files(self, subject, pattern='*'):
+        """
+        subject 폴더 바로 아래의 파일 중 pattern에 맞는 파일 이름 목록을 반환합니다 (예: sessions.tsv).
+        """
+        listing = self._listing(subject)
+        return fnmatch.filter(listing['files'], pattern) if listing else []
+
+    def has_dir(self, subject, session=None, modality=None):
+        """
+        subject/session/modality 폴더가 존재하면 True를 반환합니다. session이 None이면 session 없는 구조입니다.
+        """
+        return self._listing(subject, session, modality) is not None
+
+    def files(self, subject, session=None, modality=None, pattern='*'):
+        """
+        subject/session/modality 폴더 안의 파일 중 pattern에 맞는 파일 이름 목록을 반환합니다.
+        """
+        listing = self._listing(subject, session, modality)
+        return fnmatch.filter(listing['files'], pattern) if listing else []
+
+    def entries(self, subject, session=None, modality=None, pattern='*'):
+        """
+        files()와 같지만 하위 폴더 이름도 포함합니다 (Path.glob과 같은 결과).
+        """
+        listing = self._listing(subject, session, modality)
+        return fnmatch.filter(listing['files'] + listing['dirs'], pattern) if listing else []
+
+
+if __name__ == '__main__':
+    import Check_anat
+    import Check_DWI
+    import Check_session
+    import Check_subjects
+    from settings import output_path
+
+    bids_path = output_path()
+
+    # 데이터셋을 한 번만 읽고 네 가지 검사를 모두 실행합니다
+    index = BIDSIndex(bids_path)
+    for check in (Check_subjects, Check_session, Check_anat, Check_DWI):
+        print(f"\n######## {check.__name__} ########")
+        check.main(bids_path, index=index)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+import sys
+
+from settings import BIDS_CODE_PATH, CONFIG_PATH, load_bids_code, load_config
+
+# 각 subcommand는 실행될 때 필요한 module만 import합니다 (nibabel, pydicom, yaml 등은 필요한 경로에서만 읽힘).
+# config.yaml과 bids_code.json은 settings.py에서 한 번만 읽어 모든 module이 공유합니다.
+
+
+def convert(args):
+    import main
+
+    logging.basicConfig(level=logging.INFO)
+    main.run(load_config(args.config), load_bids_code(args.bids_code), retry=args.retry)
+    return 0
+
+
+def validate(args):
+    import validate
+
+    unknown = sorted(set(args.rules or []) - set(validate.RULES))
+    if unknown:
+        sys.exit(f"Unknown rule(s): {', '.join(unknown)} (choose from {', '.join(sorted(validate.RULES))})")
+    bids_dir = args.bids_dir or load_config(args.config)["data"]["output_path"]
+    report = validate.validate(bids_dir, rules=args.rules, workers=args.workers)
+    validate.write_report(report, json_path=args.json, tsv_path=args.tsv)
+    return validate.print_report(report)
+
+
+def patch_sidecars(args):
+    import Add_TaskName
+
+    Add_TaskName.update_json_files(args.bids_dir or load_config(args.config)["data"]["output_path"],
+                                   workers=args.workers)
+    return 0
+
+
+def plan(args):
+    import plan
+
+    plan.run(load_config(args.config), load_bids_code(args.bids_code), args.output, workers=args.workers)
+    return 0
+
+
+def shard(args):
+    import shard
+
+    logging.basicConfig(level=logging.INFO)
+    shard.run(args.command, args.config, args.bids_code, processes=args.processes, name=args.name)
+    return 0
+
+
+def qc(args):
+    import qc
+
+    bids_dir = args.bids_dir or load_config(args.config)["data"]["output_path"]
+    for line in qc.qc_dataset(bids_dir, chunk=args.chunk, force=args.force):
+        print(line)
+    return 0
+
+
+def inventory(args):
+    import inventory
+
+    inventory.main(args.arguments)
+    return 0
+
+
+def errors(args):
+    import journal
+
+    failed = journal.ErrorJournal(journal.journal_path(load_config(args.config))).failed()
+    journal.print_failed(failed)
+    return 1 if failed else 0
+
+
+def parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--config", default=CONFIG_PATH, help="Configuration file")
+    common.add_argument("--bids-code", default=BIDS_CODE_PATH, help="BIDS coding keys")
+
+    root = argparse.ArgumentParser(description="DICOM to BIDS conversion, planning and validation")
+    commands = root.add_subparsers(dest="subcommand", metavar="command", required=True)
+
+    p = commands.add_parser("convert", parents=[common], help="Convert the input folders (main.py)")
+    p.add_argument("--retry", action="store_true", help="Convert only the folders that failed in earlier runs")
+    p.set_defaults(function=convert)
+
+    p = commands.add_parser("validate", parents=[common], help="Run the BIDS checks (validate.py)")
+    p.add_argument("bids_dir", nargs='?', help="BIDS folder (default: data.output_path)")
+    p.add_argument("--json", help="JSON report")
+    p.add_argument("--tsv", help="TSV report (findings)")
+    p.add_argument("--workers", type=int, default=8, help="Subjects checked at the same time")
+    # 규칙 이름은 validate를 import해야 알 수 있으므로 subcommand에서 검사합니다
+    p.add_argument("--rules", nargs='+', help="Rules to run (default: all)")
+    p.set_defaults(function=validate)
+
+    p = commands.add_parser("patch-sidecars", parents=[common], help="Add TaskName to the BOLD sidecars (Add_TaskName.py)")
+    p.add_argument("bids_dir", nargs='?', help="BIDS folder (default: data.output_path)")
+    p.add_argument("--workers", type=int, default=8, help="Sidecars patched at the same time")
+    p.set_defaults(function=patch_sidecars)
+
+    p = commands.add_parser("plan", parents=[common], help="Compute the BIDS layout without converting (plan.py)")
+    p.add_argument("--output", default="plan.json", help="Plan file (run it with data.plan in the configuration)")
+    p.add_argument("--workers", type=int, default=8, help="Threads reading the DICOM headers")
+    p.set_defaults(function=plan)
+
+    p = commands.add_parser("shard", parents=[common], help="Sharded conversion through a work queue (shard.py)")
+    p.add_argument("command", choices=['enqueue', 'work', 'status'])
+    p.add_argument("--processes", type=int, default=1, help="Worker processes started on this node")
+    p.add_argument("--name", default=None, help="Worker name (default: <host>-<pid>)")
+    p.set_defaults(function=shard)
+
+    p = commands.add_parser("qc", parents=[common], help="QC metrics of the BOLD and DWI runs (qc.py)")
+    p.add_argument("bids_dir", nargs='?', help="BIDS folder (default: data.output_path)")
+    p.add_argument("--chunk", type=int, default=8, help="Volumes read at a time")
+    p.add_argument("--force", action="store_true", help="Compute again even if the QC file is up to date")
+    p.set_defaults(function=qc)
+
+    # 모든 인자를 inventory.py에 넘김 (python cli.py inventory count --protocol '*BOLD*' --min-volumes 100)
+    p = commands.add_parser("inventory", add_help=False, help="Inventory of the input series (inventory.py)")
+    p.add_argument("arguments", nargs=argparse.REMAINDER)
+    p.set_defaults(function=inventory)
+
+    p = commands.add_parser("errors", parents=[common], help="Show the folders that still have to be converted (journal.py)")
+    p.set_defaults(function=errors)
+    return root
+
+
+def main(argv=None):
+    root = parser()
+    args, unknown = root.parse_known_args(argv)
+    if args.function is inventory:
+        # REMAINDER는 option으로 시작하는 인자 (--help 등)를 받지 않으므로 나머지도 넘김
+        args.arguments = unknown + args.arguments
+    elif unknown:
+        root.error(f"unrecognized arguments: {' '.join(unknown)}")
+    return args.function(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+import argparse
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from dedup import content_digest
+
+# data.compress: 'dcm2niix' (dcm2niix -z y, pigz 사용 여부는 dcm2niix가 결정),
+# 'parallel' (dcm2niix는 압축하지 않고, 변환 후 여러 thread로 gzip)
+METHODS = ('dcm2niix', 'parallel')
+# parallel gzip에서 한 thread가 압축하는 크기 (각 block은 독립된 gzip member)
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def compress_threads(threads=None):
+    return threads if threads else os.cpu_count() or 1
+
+
+def gzip_blocks(src, fdst, level=6, threads=None):
+    """
+    src를 BLOCK_SIZE씩 읽어 thread pool에서 각각 gzip member로 압축하고 순서대로 fdst에 씁니다.
+    zlib은 압축하는 동안 GIL을 놓으므로 thread 수만큼 병렬로 압축됩니다. 여러 member를 이어 붙인 파일은
+    올바른 gzip 파일이며 (RFC 1952) nibabel, FSL, AFNI 등에서 그대로 읽을 수 있습니다.
+    한 번에 메모리에 있는 block은 2 × threads개 이하입니다.
+    """
+    threads = compress_threads(threads)
+    with open(src, 'rb') as fsrc, ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = deque()
+        for block in iter(lambda: fsrc.read(BLOCK_SIZE), b''):
+            pending.append(executor.submit(gzip.compress, block, level, mtime=0))
+            if len(pending) >= 2 * threads:
+                fdst.write(pending.popleft().result())
+        while pending:
+            fdst.write(pending.popleft().result())
+
+
+def gzip_file(src, dst=None, level=6, threads=None, pigz=True, keep=False):
+    """
+    src를 dst (기본값: src + '.gz')로 압축하고 src를 삭제합니다 (keep이면 src를 남겨 둠).
+    pigz가 있으면 pigz를, 없으면 gzip_blocks를 사용합니다. 임시 파일에 쓴 뒤 os.replace합니다.
+
+    Returns:
+        str: dst
+    """
+    dst = dst or src + '.gz'
+    tmp_name = dst + '.part'
+    try:
+        with open(tmp_name, 'wb') as fdst:
+            executable = shutil.which('pigz') if pigz else None
+            if executable:
+                subprocess.run([executable, f'-{level}', '-p', str(compress_threads(threads)), '-c', src],
+                               stdout=fdst, check=True)
+            else:
+                gzip_blocks(src, fdst, level, threads)
+        os.replace(tmp_name, dst)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+    if not keep:
+        os.remove(src)
+    return dst
+
+
+def compress_niftis(niftis, level=6, threads=None):
+    """
+    변환된 파일 목록에서 .nii 파일을 .nii.gz로 압축하고, 바뀐 파일 목록을 반환합니다.
+    """
+    return [gzip_file(nf, level=level, threads=threads) if nf.endswith('.nii') else nf for nf in niftis]
+
+
+def recompress_file(path, level=6, threads=None, verify=True):
+    """
+    .nii 파일은 압축하고, .nii.gz 파일은 압축을 풀어 level로 다시 압축합니다.
+    새 파일은 임시 파일 (<이름>.recompress.gz)에 쓰고, verify이면 압축을 푼 내용의 sha256을 비교한 뒤에
+    원본을 교체합니다. 비교가 실패하면 원본은 그대로 남고 임시 파일들은 삭제됩니다.
+
+    Returns:
+        tuple: (새 파일 경로, 이전 크기, 새 크기, 압축을 푼 크기)
+    """
+    before = os.path.getsize(path)
+    base = path[:-len('.gz')] if path.endswith('.gz') else path
+    dst = base + '.gz'
+    raw_name = base + '.recompress'
+    tmp_name = raw_name + '.gz'
+    try:
+        if path.endswith('.nii'):
+            src = path
+        else:
+            with gzip.open(path, 'rb') as fsrc, open(raw_name, 'wb') as fdst:
+                shutil.copyfileobj(fsrc, fdst, BLOCK_SIZE)
+            src = raw_name
+        raw = os.path.getsize(src)
+        digest = content_digest(src) if verify else None
+        gzip_file(src, dst=tmp_name, level=level, threads=threads, keep=True)
+        if verify and content_digest(tmp_name) != digest:
+            raise IOError(f"Content changed while recompressing {path}")
+        os.replace(tmp_name, dst)
+        if path != dst:
+            os.remove(path)
+    finally:
+        for name in (raw_name, tmp_name):
+            if os.path.exists(name):
+                os.remove(name)
+    return dst, before, os.path.getsize(dst), raw
+
+
+def find_niftis(root_folder):
+    """
+    root_folder 아래의 NIfTI 파일 (.nii, .nii.gz)을 찾습니다 (숨김 폴더 제외).
+    """
+    niftis = []
+    for path, dirs, files in os.walk(root_folder):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        niftis.extend(os.path.join(path, name) for name in files
+                      if not name.startswith('.') and (name.endswith('.nii') or name.endswith('.nii.gz')))
+    return sorted(niftis)
+
+
+def recompress(root_folder, level=6, threads=None, verify=True):
+    """
+    BIDS 폴더의 모든 NIfTI 파일을 level로 (다시) 압축하고 전체 크기와 처리량을 출력합니다.
+    파일은 하나씩 처리하고, 각 파일은 여러 thread로 압축합니다.
+    """
+    total_before = total_after = total_raw = 0
+    start = time.perf_counter()
+    for path in find_niftis(root_folder):
+        try:
+            dst, before, after, raw = recompress_file(path, level, threads, verify)
+        except Exception as e:
+            print(f"Error in {path}: {e}")
+            continue
+        total_before, total_after, total_raw = total_before + before, total_after + after, total_raw + raw
+        print(f"{os.path.relpath(dst, root_folder)}: {before / 1024 ** 2:.1f} MB → {after / 1024 ** 2:.1f} MB")
+    elapsed = time.perf_counter() - start
+    print(f"Total: {total_before / 1024 ** 3:.2f} GB → {total_after / 1024 ** 3:.2f} GB "
+          f"({total_raw / 1024 ** 2 / elapsed if elapsed else 0:.1f} MB/s uncompressed)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="(Re)compresses the NIfTI files of a BIDS folder with a parallel gzip")
+    parser.add_argument("bids_dir", help="BIDS folder")
+    parser.add_argument("--level", type=int, default=6, choices=range(1, 10), help="gzip level (1 = fastest)")
+    parser.add_argument("--threads", type=int, default=0, help="Compression threads (0 = number of CPUs)")
+    parser.add_argument("--no-verify", action="store_true", help="Do not compare the uncompressed content")
+    args = parser.parse_args()
+    if not os.path.isdir(args.bids_dir):
+        sys.exit(f"{args.bids_dir} is not a folder")
+    recompress(args.bids_dir, args.level, args.threads, not args.no_verify)
@@ -1,6 +1,41 @@
 import json
-import re
-import nibabel as nib
+
+from naming import compile_rules
+
+# Diffusion series whose description contains one of these words are derived maps, not acquisitions
+DWI_DERIVED = ('FA', 'ADC', 'TENSOR', 'EXP')
+# Minimum number of volumes for a BOLD run to be kept
+MIN_BOLD_VOLUMES = 100
+
+def get_image_info(files):
+    """
+    Reads shape, voxel size and repetition time of a converted series without loading voxel data.
+
+    Inputs
+    --------
+    files (list): Contains the files outputted by the dcm2niix software
+
+    Outputs
+    --------
+    info (dict): 'shape' (tuple) and 'voxel_size' (tuple) from the NIfTI header, 
+                 'tr' (float, None) in seconds from the dcm2niix JSON sidecar or, failing that, the header
+    """
+    # nibabel is only needed once series are converted; importing it costs ~0.2 s at startup
+    import nibabel as nib
+
+    header = nib.load([f for f in files if '.nii' in f][0]).header
+    shape = header.get_data_shape()
+    zooms = header.get_zooms()
+    info = {'shape': shape, 'voxel_size': tuple(float(z) for z in zooms[:3]), 'tr': None}
+
+    sidecars = [f for f in files if '.json' in f]
+    if sidecars:
+        info['tr'] = json.load(open(sidecars[0], 'r')).get("RepetitionTime")
+    if info['tr'] is None and len(shape) > 3:
+        tr = float(zooms[3])
+        # dcm2niix stores pixdim[4] in seconds, older tools sometimes in milliseconds
+        info['tr'] = tr / 1000 if header.get_xyzt_units()[1] == 'msec' else tr
+    return info
 
 def inclusion_or_exclusion_criteria(files, info_files, bids_code):
     """
@@ -20,10 +55,9 @@ def inclusion_or_exclusion_criteria(files, info_files, bids_code):
     """
     
     # We search for the protocols present in the bids_code.json
-    mri = re.match(f'({bids_code["PROTOCOLS"]})', info_files.protocol) 
+    mri = compile_rules(bids_code).match_protocol(info_files.protocol)
     
     if not mri == None:
-        mri = mri.group()
 
         ##############################################################
         # CONSIDER ADDING ANY OTHER CRITERIA PRESENT IN YOUR DATASET #
@@ -31,14 +65,15 @@ def inclusion_or_exclusion_criteria(files, info_files, bids_code):
         
         if bids_code[mri] == 'dwi': # DIFFUSION ACQUISITIONS
             series = json.load(open([f for f in files if '.json' in f][0], 'r'))["SeriesDescription"]
-            if ('FA' in series) or ('ADC' in series) or ('TENSOR' in series) or ('EXP' in series):
+            if any(word in series for word in DWI_DERIVED):
                 proceed = False
             else:
                 proceed = True
         
         elif bids_code[mri] == 'bold':  # FUNCTIONAL ACQUISITIONS 
-            data = nib.load([f for f in files if '.nii' in f][0]).get_fdata()
-            if data.shape[-1] >= 100:
+            # Only the header is read: the number of volumes does not require the voxel data
+            shape = get_image_info(files)['shape']
+            if shape[-1] >= MIN_BOLD_VOLUMES:
                 proceed = True
             else:
                 proceed = False
@@ -48,4 +83,39 @@ def inclusion_or_exclusion_criteria(files, info_files, bids_code):
     else:
         proceed = False
     
-    return proceed, mri
\ No newline at end of file
+    return proceed, mri
+
+def header_criteria(series_info, bids_code):
+    """
+    Same criteria as inclusion_or_exclusion_criteria, evaluated on the DICOM header of a series
+    before it is converted. Series that cannot be judged from the header are kept, so that
+    inclusion_or_exclusion_criteria still decides after the conversion.
+
+    Inputs
+    --------
+    series_info (dict): Header fields of one DICOM file of the series - Obtained from triage.read_series_header
+                        'protocol', 'series_description', 'image_type' and 'volumes' (int, None)
+    bids_code (dict): Contains information about the coding keys to transform to bids
+
+    Outputs
+    --------
+    proceed (bool): Encoding whether the series has to be converted
+    reason (str): Why the series is skipped (empty if proceed)
+    """
+    if not series_info['protocol']:
+        return True, ''
+
+    mri = compile_rules(bids_code).match_protocol(series_info['protocol'])
+    if mri == None:
+        return False, f"protocol {series_info['protocol']} not in PROTOCOLS"
+
+    if bids_code[mri] == 'dwi':
+        if any(word in series_info['series_description'] for word in DWI_DERIVED) or \
+                any(word in series_info['image_type'] for word in DWI_DERIVED):
+            return False, f"derived diffusion map ({series_info['series_description']})"
+
+    elif bids_code[mri] == 'bold':
+        if series_info['volumes'] is not None and series_info['volumes'] < MIN_BOLD_VOLUMES:
+            return False, f"{series_info['volumes']} volumes < {MIN_BOLD_VOLUMES}"
+
+    return True, ''
@@ -0,0 +1,144 @@
+import os
+import re
+import shutil
+import signal
+import subprocess
+import threading
+from collections import deque
+
+# "Convert 176 DICOM as /out/dir/name (256x256x176x1)"
+CONVERT_LINE = re.compile(r'^Convert \d+ DICOM as (.+?) \([\dx]+\)\s*$')
+# dcm2niix가 한 변환에서 만들 수 있는 파일 확장자
+EXTENSIONS = ('.nii.gz', '.nii', '.json', '.bval', '.bvec')
+# dcm2niix exit code 2: 폴더에 변환할 DICOM이 없음 (오류가 아님)
+EXIT_NO_VALID_FILES = 2
+
+
+class ConversionResult:
+    """
+    dcm2niix 실행 한 번의 결과.
+
+    Attributes:
+        files (list): 생성된 파일 경로.
+        events (list): dcm2niix 출력에서 읽은 event ({'type': 'file' | 'warning' | 'error', 'text': ...}).
+        returncode (int): dcm2niix의 exit code.
+        attempts (int): timeout으로 다시 실행한 횟수를 포함한 실행 횟수.
+        tail (list): 마지막 출력 줄들 (오류 메시지용).
+    """
+    __slots__ = ('files', 'events', 'returncode', 'attempts', 'tail')
+
+    def __init__(self):
+        self.files, self.events, self.returncode, self.attempts, self.tail = [], [], None, 0, []
+
+    @property
+    def warnings(self):
+        return [e['text'] for e in self.events if e['type'] == 'warning']
+
+    @property
+    def errors(self):
+        return [e['text'] for e in self.events if e['type'] == 'error']
+
+
+def dcm2niix_command(df, output_dir, gzip=True, executable='dcm2niix', level=None):
+    """
+    shell을 거치지 않고 실행할 dcm2niix 인자 목록을 반환합니다 (경로에 공백이 있어도 안전).
+    level (1-9)이 주어지면 gzip 압축 level을 지정합니다.
+    """
+    return [executable, '-o', output_dir, '-f', '%n--%p--%t', '-z', 'y' if gzip else 'n'] + \
+        ([f'-{level}'] if gzip and level else []) + [df]
+
+
+def parse_line(line, events):
+    """
+    dcm2niix 출력 한 줄을 event로 바꿔 events에 추가합니다.
+    """
+    m = CONVERT_LINE.match(line)
+    if m:
+        events.append({'type': 'file', 'text': m.group(1)})
+    elif line.startswith('Warning'):
+        events.append({'type': 'warning', 'text': line})
+    elif line.startswith('Error'):
+        events.append({'type': 'error', 'text': line})
+
+
+def produced_files(result, output_dir):
+    """
+    'Convert ... as <name>' event들로부터 생성된 파일 목록을 만듭니다.
+    이런 줄이 없으면 (다른 버전의 dcm2niix 출력) output_dir을 한 번 읽습니다.
+    """
+    names = [e['text'] for e in result.events if e['type'] == 'file']
+    if not names:
+        return [e.path for e in os.scandir(output_dir) if e.is_file()]
+    return [name + ext for name in names for ext in EXTENSIONS if os.path.exists(name + ext)]
+
+
+def kill(proc):
+    """
+    dcm2niix와 (pigz 등) 그 자식 process들을 종료합니다.
+    """
+    if os.name == 'posix':
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        proc.kill()
+    proc.wait()
+
+
+def clear_folder(output_dir):
+    for e in os.scandir(output_dir):
+        if e.is_dir():
+            shutil.rmtree(e.path)
+        else:
+            os.remove(e.path)
+
+
+def run_dcm2niix(df, output_dir, gzip=True, timeout=None, retries=1, executable='dcm2niix', level=None):
+    """
+    DICOM 시리즈 폴더 df를 output_dir에 변환합니다.
+
+    출력은 한 줄씩 읽으면서 event로 바꾸고 마지막 몇 줄만 보관하므로 메모리 사용량은 출력 길이와 관계없습니다.
+    timeout (초)이 지나면 dcm2niix를 종료하고, output_dir을 비운 뒤 retries번까지 다시 실행합니다.
+
+    Returns:
+        ConversionResult
+
+    Raises:
+        TimeoutError: 모든 실행이 timeout된 경우.
+        RuntimeError: 파일이 하나도 만들어지지 않고 dcm2niix가 오류로 끝난 경우.
+    """
+    result = ConversionResult()
+    for attempt in range(1 + max(0, retries)):
+        result.attempts = attempt + 1
+        result.events = []
+        tail = deque(maxlen=20)
+        # POSIX에서는 새 process group으로 시작해서 timeout 때 자식 process까지 함께 종료합니다
+        proc = subprocess.Popen(dcm2niix_command(df, output_dir, gzip, executable, level),
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace',
+                                start_new_session=(os.name == 'posix'))
+
+        def read_output():
+            for line in proc.stdout:
+                line = line.rstrip('\n')
+                tail.append(line)
+                parse_line(line, result.events)
+
+        # 출력은 별도 thread에서 읽으므로 dcm2niix가 멈춰도 wait(timeout)으로 끝낼 수 있습니다
+        reader = threading.Thread(target=read_output, daemon=True)
+        reader.start()
+        try:
+            result.returncode = proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            kill(proc)
+            reader.join()
+            clear_folder(output_dir)
+            continue
+        reader.join()
+        result.tail = list(tail)
+        result.files = produced_files(result, output_dir)
+        if not result.files and result.returncode not in (0, EXIT_NO_VALID_FILES):
+            raise RuntimeError(f"dcm2niix failed on {df} (exit code {result.returncode}): " + ' | '.join(result.tail[-5:]))
+        return result
+
+    raise TimeoutError(f"dcm2niix did not finish within {timeout} s on {df} ({result.attempts} attempt(s))")
@@ -0,0 +1,151 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+from mover import CHUNK_SIZE
+
+# data.dedup: 'off' (항상 backup), 'skip' (이미 있는 것과 같은 시리즈는 옮기지 않음),
+# 'hardlink' (backup은 만들지만 내용이 같은 파일은 hardlink)
+MODES = ('off', 'skip', 'hardlink')
+
+
+def content_digest(path):
+    """
+    path 내용의 sha256을 CHUNK_SIZE 단위로 읽어 계산합니다.
+    .gz 파일은 압축을 풀면서 계산하므로 gzip header (압축 시각 등)만 다른 같은 영상은 같은 값을 갖습니다.
+    """
+    digest = hashlib.sha256()
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashIndex:
+    """
+    출력 폴더 파일들의 content digest 목록 (JSON-lines, <output_path>/.hash_index.jsonl).
+
+    각 줄은 출력 폴더 기준 경로, 크기, mtime (ns), digest입니다. 크기와 mtime이 그대로인 파일은 다시 읽지 않습니다.
+    이름이 겹치는 (backup이 만들어질) 파일만 digest를 계산하므로 index는 필요한 만큼만 커집니다.
+    """
+
+    def __init__(self, output_path, name='.hash_index.jsonl'):
+        self.root = output_path
+        self.path = os.path.join(output_path, name)
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry['path']] = entry
+
+    def digest(self, path):
+        """
+        출력 폴더 안의 파일 path의 content digest (바뀌지 않았으면 index의 값).
+        """
+        st = os.stat(path)
+        rel = os.path.relpath(path, self.root)
+        entry = self.entries.get(rel)
+        if entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return entry['digest']
+        entry = {'path': rel, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'digest': content_digest(path)}
+        with self.lock:
+            self.entries[rel] = entry
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+        return entry['digest']
+
+
+class DedupStats:
+    """
+    건너뛴 시리즈 수, hardlink한 파일 수, 쓰지 않은 바이트 수를 모읍니다.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.skipped, self.linked, self.saved = 0, 0, 0
+
+    def add(self, skipped=0, linked=0, saved=0):
+        with self.lock:
+            self.skipped += skipped
+            self.linked += linked
+            self.saved += saved
+
+    def summary(self):
+        with self.lock:
+            if not (self.skipped or self.linked):
+                return ''
+            return f"{self.skipped} identical series skipped, {self.linked} file(s) hardlinked, " \
+                   f"{self.saved / 1024 ** 2:.1f} MB saved"
+
+
+# organize_niftis에서 사용하는 전체 통계
+STATS = DedupStats()
+
+# 출력 폴더별 HashIndex (key: output_path)
+INDEXES = {}
+
+
+def hash_index(output_path):
+    """
+    output_path의 HashIndex를 반환합니다 (출력 폴더마다 한 번만 읽음).
+    """
+    if output_path not in INDEXES:
+        INDEXES[output_path] = HashIndex(output_path)
+    return INDEXES[output_path]
+
+
+def versions(target, root_name, extensions, existing, backup_names):
+    """
+    root_name으로 이미 정리된 시리즈들 (현재 파일과 backup 폴더의 bck-N들)을 {확장자: 경로}의 목록으로 반환합니다.
+    """
+    found = [{ext: target + root_name + '.' + ext for ext in extensions if root_name + '.' + ext in existing}]
+    prefix = root_name + '_bck-'
+    backups = {}
+    for name in backup_names:
+        if name.startswith(prefix):
+            number, _, ext = name[len(prefix):].partition('.')
+            if number.isdigit() and ext in extensions:
+                backups.setdefault(int(number), {})[ext] = target + 'backup/' + name
+    found.extend(backups[number] for number in sorted(backups))
+    return found
+
+
+def duplicate_of(staged, candidates, index):
+    """
+    staged ({확장자: staging 파일})와 모든 파일의 내용이 같은 candidates (versions의 결과) 항목을 반환합니다. 없으면 None.
+    """
+    digests = {}
+    for version in candidates:
+        if set(version) != set(staged):
+            continue
+        for ext, path in staged.items():
+            if ext not in digests:
+                digests[ext] = content_digest(path)
+            if index.digest(version[ext]) != digests[ext]:
+                break
+        else:
+            return version
+    return None
+
+
+def identical_file(path, candidates, index):
+    """
+    staging 파일 path와 내용이 같은 candidates의 파일 경로를 반환합니다. 없으면 None.
+    """
+    digest = None
+    for candidate in candidates:
+        if os.path.getsize(candidate) != os.path.getsize(path) and not path.endswith('.gz'):
+            continue
+        if digest is None:
+            digest = content_digest(path)
+        if index.digest(candidate) == digest:
+            return candidate
+    return None
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+import argparse
+import fnmatch
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from archives import hidden, is_archive, release, split_series
+from bids_constructor import get_folders, list_series, natural_sort_key
+from criteria import header_criteria
+from manifest import series_fingerprint
+from triage import TRIAGE_TAGS, first_dicom, header_info, list_dicoms
+
+# inventory에 기록하는 DICOM attribute (pixel data는 읽지 않음)
+INVENTORY_TAGS = TRIAGE_TAGS + ['PatientName', 'InstitutionName', 'AcquisitionDate', 'SeriesDate', 'StudyDate']
+# series table의 column 순서 (path가 primary key)
+COLUMNS = ['path', 'folder', 'name', 'protocol', 'description', 'image_type', 'instances', 'volumes', 'bytes',
+           'mtime_ns', 'dir_mtime_ns', 'acquisition_date', 'patient', 'site', 'readable', 'scanned']
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    path TEXT PRIMARY KEY, folder TEXT NOT NULL, name TEXT, protocol TEXT, description TEXT, image_type TEXT,
+    instances INTEGER, volumes INTEGER, bytes INTEGER, mtime_ns INTEGER, dir_mtime_ns INTEGER,
+    acquisition_date TEXT, patient TEXT, site TEXT, readable INTEGER, scanned REAL
+);
+CREATE INDEX IF NOT EXISTS series_folder ON series (folder);
+CREATE INDEX IF NOT EXISTS series_protocol ON series (protocol);
+"""
+# find()의 filter → SQL 조건 (문자열 filter는 대소문자를 구분하지 않는 glob)
+FILTERS = {
+    'folder': "lower(folder) GLOB lower(?)", 'protocol': "lower(protocol) GLOB lower(?)",
+    'description': "lower(description) GLOB lower(?)", 'site': "lower(site) GLOB lower(?)",
+    'patient': "lower(patient) GLOB lower(?)", 'min_volumes': "volumes >= ?", 'max_volumes': "volumes <= ?",
+    'min_instances': "instances >= ?", 'since': "acquisition_date >= ?", 'until': "acquisition_date <= ?",
+}
+
+
+def dicom_date(value):
+    """
+    DICOM DA (YYYYMMDD)를 'YYYY-MM-DD'로 바꿉니다. 형식이 다르면 None.
+    """
+    value = str(value or '').strip()
+    return f"{value[:4]}-{value[4:6]}-{value[6:8]}" if len(value) == 8 and value.isdigit() else None
+
+
+def read_inventory_header(df):
+    """
+    시리즈 폴더 df의 첫 번째 DICOM 파일 header에서 inventory 항목을 읽습니다. 읽을 수 없으면 None.
+    """
+    import pydicom
+
+    files = list_dicoms(df)
+    if not files:
+        return None
+    try:
+        ds = pydicom.dcmread(first_dicom(df, files), stop_before_pixels=True, specific_tags=INVENTORY_TAGS)
+    except Exception:
+        return None
+    info = header_info(ds, files)
+    return {
+        'protocol': info['protocol'], 'description': info['series_description'],
+        'image_type': '\\'.join(info['image_type']), 'volumes': info['volumes'],
+        'acquisition_date': dicom_date(ds.get('AcquisitionDate')) or dicom_date(ds.get('SeriesDate'))
+                            or dicom_date(ds.get('StudyDate')),
+        'patient': str(ds.get('PatientName', '')).strip(), 'site': str(ds.get('InstitutionName', '')).strip(),
+    }
+
+
+def scan_folder(folder, known, quick=False):
+    """
+    세션 폴더 folder의 시리즈들을 확인합니다 (thread pool에서 실행, database는 사용하지 않음).
+    known은 database에 있는 {시리즈 경로: row}입니다. fingerprint (파일 수, 크기, 최근 mtime)가 같은 시리즈는
+    header를 다시 읽지 않으며, quick이면 시리즈 폴더의 mtime이 같을 때 fingerprint도 계산하지 않습니다.
+
+    Returns:
+        tuple: (새로 쓸 row 목록, 폴더에 있는 시리즈 경로 목록, header를 읽은 시리즈 수)
+    """
+    rows, present, read = [], [], 0
+    if is_archive(folder) and os.path.isfile(folder):
+        # 세션 archive: 압축을 풀지 않고 목록과 header를 읽으며, 시리즈 폴더의 mtime 대신 archive의 mtime을 사용
+        archive_mtime = os.stat(folder).st_mtime_ns
+        series = [(df, os.path.basename(split_series(df)[1]), archive_mtime) for df in list_series(folder)]
+    else:
+        with os.scandir(folder) as it:
+            series = [(e.path, e.name, e.stat().st_mtime_ns)
+                      for e in sorted((e for e in it if e.is_dir() and not hidden(e.name)),
+                                      key=lambda e: natural_sort_key(e.name))]
+    for path, name, dir_mtime in series:
+        present.append(path)
+        previous = known.get(path)
+        if quick and previous is not None and previous['dir_mtime_ns'] == dir_mtime:
+            continue
+        count, size, mtime = series_fingerprint(path)
+        if previous is not None and [previous['instances'], previous['bytes'], previous['mtime_ns']] == \
+                [count, size, mtime]:
+            if previous['dir_mtime_ns'] != dir_mtime:
+                rows.append(dict(previous, dir_mtime_ns=dir_mtime))
+            continue
+        header = read_inventory_header(path)
+        read += 1
+        row = dict.fromkeys(COLUMNS)
+        row.update(header or {})
+        row.update(path=path, folder=folder, name=name, instances=count, bytes=size, mtime_ns=mtime,
+                   dir_mtime_ns=dir_mtime, readable=int(header is not None), scanned=time.time())
+        rows.append(row)
+    release(folder)
+    return rows, present, read
+
+
+class Inventory:
+    """
+    입력 archive의 DICOM 시리즈 목록 (SQLite, 시리즈마다 한 row).
+
+    scan()은 input_path의 세션 폴더들을 병렬로 읽어 새 시리즈와 바뀐 시리즈의 header만 읽고,
+    사라진 시리즈는 삭제합니다. find(), count(), query()로 변환하지 않고도 archive를 조회할 수 있으며,
+    work()는 변환할 {세션 폴더: 시리즈 목록}을 plan.load_plan과 같은 형식으로 반환합니다.
+    database는 한 process에서 사용합니다 (SQLite는 NAS의 파일 lock을 신뢰할 수 없으므로 로컬 디스크 권장).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def known(self):
+        return {row['path']: dict(row) for row in self.db.execute("SELECT * FROM series")}
+
+    def scan(self, config, workers=8, quick=False):
+        """
+        config의 input_path (subjects.folders pattern)를 읽어 inventory를 갱신합니다.
+
+        Returns:
+            dict: 'folders', 'series', 'updated' (header를 다시 읽은 시리즈), 'removed', 'seconds'
+        """
+        start = time.perf_counter()
+        folders, number = get_folders(config=config)
+        known = self.known()
+        by_folder = {}
+        for path, row in known.items():
+            by_folder.setdefault(row['folder'], {})[path] = row
+        updated = removed = total = 0
+        placeholders = ', '.join('?' * len(COLUMNS))
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            results = executor.map(lambda f: scan_folder(f, by_folder.get(f, {}), quick), folders)
+            # 결과는 폴더 순서대로 받아 이 thread에서만 database에 씀
+            for folder, (rows, present, read) in zip(folders, results):
+                gone = set(by_folder.get(folder, {})) - set(present)
+                with self.db:
+                    self.db.executemany(f"INSERT OR REPLACE INTO series ({', '.join(COLUMNS)}) VALUES ({placeholders})",
+                                        [[row[column] for column in COLUMNS] for row in rows])
+                    self.db.executemany("DELETE FROM series WHERE path = ?", [(path,) for path in gone])
+                updated += read
+                removed += len(gone)
+                total += len(present)
+        # 사라진 세션 폴더 (subjects.folders pattern에서 빠졌을 뿐인 폴더는 남겨 둠)
+        vanished = [f for f in set(by_folder) - set(folders) if not os.path.exists(f)]
+        with self.db:
+            for folder in vanished:
+                removed += self.db.execute("DELETE FROM series WHERE folder = ?", (folder,)).rowcount
+        return {'folders': number, 'series': total, 'updated': updated, 'removed': removed,
+                'seconds': time.perf_counter() - start}
+
+    def query(self, where='1', params=(), columns='*', order='folder, path'):
+        """
+        SQL 조건 where (params는 '?' 값)에 맞는 시리즈를 dict 목록으로 반환합니다.
+        """
+        sql = f"SELECT {columns} FROM series WHERE {where}" + (f" ORDER BY {order}" if order else '')
+        return [dict(row) for row in self.db.execute(sql, params)]
+
+    def conditions(self, filters):
+        unknown = set(filters) - set(FILTERS)
+        if unknown:
+            raise ValueError("Invalid filter. Expected one of: %s" % list(FILTERS))
+        items = [(name, value) for name, value in filters.items() if value is not None]
+        return ' AND '.join(FILTERS[name] for name, _ in items) or '1', [value for _, value in items]
+
+    def find(self, **filters):
+        """
+        filter (FILTERS의 이름, 예: protocol='*BOLD*', min_volumes=100, site='*Seoul*')에 맞는 시리즈 목록.
+        """
+        where, params = self.conditions(filters)
+        return self.query(where, params)
+
+    def count(self, group=None, **filters):
+        """
+        filter에 맞는 시리즈 수. group (예: 'site', 'protocol')이 있으면 {값: 시리즈 수}.
+        """
+        where, params = self.conditions(filters)
+        if group is None:
+            return self.db.execute(f"SELECT count(*) FROM series WHERE {where}", params).fetchone()[0]
+        if group not in COLUMNS:
+            raise ValueError("Invalid group. Expected one of: %s" % COLUMNS)
+        return {row[0]: row[1] for row in self.db.execute(
+            f"SELECT {group}, count(*) FROM series WHERE {where} GROUP BY {group} ORDER BY count(*) DESC", params)}
+
+    def folders(self, pattern='*'):
+        """
+        inventory의 세션 폴더 목록 (폴더 이름이 pattern에 맞는 것, 자연 정렬).
+        """
+        folders = [row[0] for row in self.db.execute("SELECT DISTINCT folder FROM series")]
+        folders = [f for f in folders if fnmatch.fnmatch(os.path.basename(f), pattern)]
+        return sorted(folders, key=lambda f: natural_sort_key(os.path.basename(f)))
+
+    def series(self, folder):
+        rows = self.query("folder = ?", (folder,), order=None)
+        return sorted(rows, key=lambda row: natural_sort_key(row['name']))
+
+    def work(self, config, bids_code, triage=None):
+        """
+        변환할 {세션 폴더: 시리즈 폴더 목록} (plan.load_plan과 같은 형식, main.py와 shard.py의 planned).
+        triage (기본값: data.triage)이면 기록된 header로 criteria.header_criteria를 적용하므로 DICOM을 다시 읽지 않습니다.
+        """
+        triage = config['data'].get('triage', False) if triage is None else triage
+        work = {}
+        for f in self.folders(f"*{config['subjects']['folders']}*"):
+            keep = []
+            for row in self.series(f):
+                if triage and row['readable']:
+                    series_info = {'protocol': row['protocol'], 'series_description': row['description'],
+                                   'image_type': row['image_type'].split('\\') if row['image_type'] else [],
+                                   'instances': row['instances'], 'volumes': row['volumes']}
+                    if not header_criteria(series_info, bids_code)[0]:
+                        continue
+                keep.append(row['path'])
+            work[f] = keep
+        return work
+
+
+def inventory_path(config):
+    return (config.get('inventory') or {}).get('path') or 'inventory.sqlite'
+
+
+def scan(config, workers=8, quick=False):
+    """
+    config의 inventory를 갱신하고 Inventory를 반환합니다.
+    """
+    inventory = Inventory(inventory_path(config))
+    stats = inventory.scan(config, workers=workers, quick=quick)
+    print(f"{stats['folders']} folder(s), {stats['series']} series: {stats['updated']} read, "
+          f"{stats['removed']} removed in {stats['seconds']:.1f} s")
+    return inventory
+
+
+def print_rows(rows, columns=('path', 'protocol', 'description', 'instances', 'volumes', 'acquisition_date', 'site')):
+    print('\t'.join(columns))
+    for row in rows:
+        print('\t'.join('' if row[column] is None else str(row[column]) for column in columns))
+
+
+def main(argv=None):
+    from settings import load_config
+
+    parser = argparse.ArgumentParser(description="Inventory of the DICOM series of input_path (SQLite)")
+    parser.add_argument("command", choices=['scan', 'find', 'count'],
+                        help="scan: update the inventory, find: list series, count: count series")
+    parser.add_argument("--config", default="config.yaml", help="Configuration file")
+    parser.add_argument("--workers", type=int, default=8, help="Session folders read at the same time (scan)")
+    parser.add_argument("--quick", action="store_true",
+                        help="Skip series whose folder modification time did not change (scan)")
+    parser.add_argument("--group", choices=COLUMNS, help="Count per value of this column (count)")
+    for name in FILTERS:
+        parser.add_argument("--" + name.replace('_', '-'), type=int if 'volumes' in name or 'instances' in name else str,
+                            help="Filter" + (" (glob)" if 'GLOB' in FILTERS[name] else ""))
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    if args.command == 'scan':
+        scan(config, args.workers, args.quick).close()
+        return
+    inventory = Inventory(inventory_path(config))
+    filters = {name: getattr(args, name) for name in FILTERS}
+    if args.command == 'find':
+        print_rows(inventory.find(**filters))
+    elif args.group:
+        for value, count in inventory.count(args.group, **filters).items():
+            print(f"{value}\t{count}")
+    else:
+        print(inventory.count(**filters))
+    inventory.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+from sessions import locked
+
+# 출력 폴더 안의 error journal 이름
+JOURNAL_NAME = 'errors.jsonl'
+
+
+@contextmanager
+def error_context(stage, series=None):
+    """
+    with 블록에서 발생한 예외에 단계 이름 (convert, classify, organize 등)과 시리즈 폴더를 기록합니다.
+    가장 안쪽의 error_context만 기록되므로 예외가 발생한 위치의 단계가 journal에 남습니다.
+    """
+    try:
+        yield
+    except Exception as e:
+        if not hasattr(e, 'stage'):
+            e.stage, e.series = stage, series
+        raise
+
+
+class ErrorJournal:
+    """
+    실패한 세션 폴더와 시리즈의 append-only 기록 (JSON-lines, 기본값: <output_path>/errors.jsonl).
+
+    각 실패는 한 줄 (time, run, status 'error', unit 'series' 또는 'folder', folder, series, stage, error (예외 type),
+    message, location, files (staging에 남아 있던 파일))이며, 나중에 성공한 폴더는 status 'ok' 줄로 해결됩니다.
+    한 줄은 한 번의 write로 기록되고, 여러 process (shard.py의 worker들, 다른 node 포함)가 같은 journal에 쓸 수 있도록
+    파일 lock (sessions.locked)을 잡습니다.
+    """
+
+    def __init__(self, path, run=None):
+        self.path = path
+        self.run = run or f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        self.lock = threading.Lock()
+
+    def append(self, record):
+        line = (json.dumps(dict(time=time.strftime('%Y-%m-%dT%H:%M:%S'), run=self.run, **record),
+                           ensure_ascii=False) + '\n').encode('utf-8')
+        with self.lock, locked(self.path):
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+    def error(self, folder, error, files=()):
+        """
+        세션 폴더 folder의 실패를 기록합니다. error_context로 기록된 단계와 시리즈가 있으면 함께 기록합니다.
+        """
+        series = getattr(error, 'series', None)
+        frames = traceback.extract_tb(error.__traceback__)
+        self.append({
+            'status': 'error', 'unit': 'series' if series else 'folder', 'folder': folder, 'series': series,
+            'stage': getattr(error, 'stage', 'session'), 'error': type(error).__name__,
+            'message': str(error).strip(),
+            'location': f"{os.path.basename(frames[-1].filename)}:{frames[-1].lineno}" if frames else None,
+            'files': list(files),
+        })
+
+    def resolved(self, folder):
+        """
+        이전에 실패한 세션 폴더 folder가 변환되었음을 기록합니다.
+        """
+        self.append({'status': 'ok', 'unit': 'folder', 'folder': folder})
+
+    def records(self):
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # 중단된 write의 일부
+                    continue
+        return records
+
+    def failed(self):
+        """
+        아직 해결되지 않은 실패: {세션 폴더: 마지막 성공 이후의 error 기록 목록} (처음 실패한 순서).
+        """
+        failed = {}
+        for record in self.records():
+            if record['status'] == 'ok':
+                failed.pop(record['folder'], None)
+            else:
+                failed.setdefault(record['folder'], []).append(record)
+        return failed
+
+
+def journal_path(config):
+    return config['data']['output_path'] + JOURNAL_NAME
+
+
+def print_failed(failed):
+    """
+    해결되지 않은 실패를 폴더별로 출력합니다.
+    """
+    for folder, records in failed.items():
+        print(f"Folder: {folder}")
+        for record in records:
+            where = f"{record['stage']} {record['series']}" if record['series'] else record['stage']
+            print(f"\t[{record['run']}] {where}: {record['error']}: {record['message']}")
+            for name in record['files']:
+                print(f"\t \t{name}")
+    print(f"{len(failed)} folder(s) to retry")
+
+
+if __name__ == '__main__':
+    from settings import load_config
+
+    parser = argparse.ArgumentParser(description="Shows the folders of the error journal that still have to be converted "
+                                                 "(run them again with `python main.py --retry`)")
+    parser.add_argument("--config", default="config.yaml", help="Configuration file")
+    args = parser.parse_args()
+    print_failed(ErrorJournal(journal_path(load_config(args.config))).failed())
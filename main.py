@@ -1,53 +1,138 @@
-import json
-import yaml
+import argparse
 import logging
 from tqdm import tqdm
-import os
+import shutil
+from contextlib import ExitStack
 
-from bids_constructor import check_path, get_folders, convert_dicom_session
+from archives import release
+from bids_constructor import check_path, get_folders, convert_dicom_session, discard_staging, staging_root
+from mover import STATS
+from dedup import STATS as DEDUP
+from manifest import Manifest
+from sessions import SessionSummary
+from plan import load_plan
+from pipeline import Pipeline
+from journal import ErrorJournal, journal_path
+import profiling
+from settings import load_bids_code, load_config
 
-if __name__ == '__main__':
+
+def run(config, bids_code, retry=False):
+    """
+    Converts every input folder (or every folder of data.plan) into the BIDS output folder.
+    config and bids_code are the parsed config.yaml and bids_code.json (see settings.py).
+    With retry, only the folders that failed in earlier runs (see journal.py) are converted again.
+    """
     ####### Preliminaires ######
-    logging.basicConfig(level=logging.INFO)
-    with open("config.yaml", 'r') as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
-    bids_code = json.load(open("bids_code.json", 'r'))
-    
+    workers = max(1, int(config["data"].get("workers", 1)))
 
     ####### Main Paths ######
     check_path(config["data"]["output_path"])
+    # Series already converted by a previous run are skipped (see manifest.py)
+    manifest = Manifest(config["data"]["output_path"]) if config["data"].get("resume", False) else None
+    # sessions.tsv rows are kept in memory and written every `checkpoint` folders and at the end of the run
+    summary = SessionSummary()
+    checkpoint = int(config["data"].get("checkpoint", 10))
+    # Stage timings (profile.trace) and whole-run cProfile/pyinstrument (profile.cprofile / profile.pyinstrument)
+    tracer = profiling.configure(config)
+    run_profile = ExitStack()
+    run_profile.enter_context(profiling.profiler(config))
+
+    # Failed folders and series are appended to <output_path>/errors.jsonl; a later success resolves them
+    journal = ErrorJournal(journal_path(config))
+    failed = journal.failed()
 
     ####### Get folders ######
-    logging.info(f" Getting folders from {config['data']['input_path']}")
-    folders, number = get_folders(config=config)
-    logging.info(f" Processing {number} folder(s) ...")
-        
+    # A plan written by plan.py fixes the folders and series to convert (see data.plan)
+    planned = load_plan(config["data"]["plan"]) if config["data"].get("plan") else None
+    if retry:
+        logging.info(f" Getting failed folders from {journal.path}")
+        folders, number = list(failed), len(failed)
+    elif planned is not None:
+        logging.info(f" Getting folders from plan {config['data']['plan']}")
+        folders, number = list(planned), len(planned)
+    elif (config.get("inventory") or {}).get("use", False):
+        # The inventory is updated (only new or changed series are read) and triage uses the recorded headers
+        from inventory import scan
+
+        logging.info(f" Getting folders from the inventory of {config['data']['input_path']}")
+        inventory = scan(config)
+        planned = inventory.work(config, bids_code)
+        inventory.close()
+        folders, number = list(planned), len(planned)
+    else:
+        logging.info(f" Getting folders from {config['data']['input_path']}")
+        folders, number = get_folders(config=config)
+    logging.info(f" Processing {number} folder(s) with {workers} worker(s) ...")
+
     ####### Loop over folders ######
+    # With workers > 1 or data.pipeline, enumeration/triage, dcm2niix and classification run in their own threads
+    # (see pipeline.py); files are organized here, folder by folder and series by series, so the output is
+    # identical to a serial run.
+    pipeline = None
+    if workers > 1 or config["data"].get("pipeline", False):
+        pipeline = Pipeline(folders, config, bids_code, manifest=manifest, planned=planned, workers=workers,
+                            depth=int(config["data"].get("queue_depth", 8)))
+        sessions = pipeline.sessions()
+    else:
+        sessions = ((f, False, None, None) for f in folders)
+    try:
+        for i, (f, unchanged, converted, error) in tqdm(enumerate(sessions), total=number):
+            if unchanged:
+                release(f)
+                continue
+            try:
+                if error is not None:
+                    raise error
+                ## Try Running converting without error ##
+                with profiling.stage('session', folder=f):
+                    convert_dicom_session(f, config, bids_code, converted=converted, manifest=manifest, summary=summary,
+                                          planned=planned)
+                if f in failed:
+                    journal.resolved(f)
+            except Exception as ee:
+                print(f"Error in folder {f} \n")
+                print(ee)
+                if converted is not None:
+                    converted.drain()
+                ## Remove Problematic Files ##
+                errors = discard_staging(config, f)
+                if config["data"]["log"]:
+                    ## Report Error ##
+                    journal.error(f, ee, files=errors)
+            if checkpoint and (i + 1) % checkpoint == 0:
+                with profiling.stage('flush'):
+                    summary.flush()
+    finally:
+        with profiling.stage('flush'):
+            summary.flush()
+        run_profile.close()
+        if pipeline is not None:
+            pipeline.close()
+    if (config.get("qc") or {}).get("enabled", False):
+        from qc import aggregate
+
+        for line in aggregate(config["data"]["output_path"]):
+            logging.info(f" QC {line}")
+    if pipeline is not None:
+        logging.info(" Pipeline stages:\n" + pipeline.summary())
+    shutil.rmtree(staging_root(config), ignore_errors=True)
+    for line in STATS.summary():
+        logging.info(f" Moved {line}")
+    if DEDUP.summary():
+        logging.info(f" Deduplicated: {DEDUP.summary()}")
+    if tracer.summary():
+        logging.info(" Time per stage:\n" + tracer.summary())
+    tracer.close()
     if config["data"]["log"]:
-        with open("Logs.txt", 'w') as log_f:
-            log_f.write("LIST OF FOLDERS WHO COULD NOT BE CONVERTED PROBABLY DUE TO NAME CODING ERROR \n")
-            log_f.write("============================================================================ \n")
-    for i, f in tqdm(enumerate(folders), total=number):
-        try:
-            ## Try Running converting without error ##
-            convert_dicom_session(f, config, bids_code)
-        except Exception as ee:
-            print(f"Error in folder {f} \n")
-            print(ee)
-            errors, _ = get_folders(path=config["data"]["output_path"], exclude='txt', search_type='file')
-            if config["data"]["log"]:
-                ## Report Error ##
-                with open("Logs.txt", 'a') as log_f:
-                    log_f.write(f"Folder: {f} \n")
-                    for e in errors:
-                        log_f.write(f"\t \t{e} \n")
-                        ## Remove Problematic Files ##
-                        if os.path.exists(e):
-                            os.remove(e)
-            else:
-                pass
-    
-    ## Move Logs ##
-    if config["data"]["log"]:
-        import shutil
-        shutil.copyfile("./Logs.txt", config["data"]["output_path"]+"Logs.txt")
\ No newline at end of file
+        remaining = len(journal.failed())
+        if remaining:
+            logging.info(f" {remaining} folder(s) failed, see {journal.path} (convert them again with --retry)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Converts the input folders of config.yaml into BIDS")
+    parser.add_argument("--retry", action="store_true", help="Convert only the folders that failed in earlier runs")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    run(load_config(), load_bids_code(), retry=args.retry)
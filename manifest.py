@@ -0,0 +1,77 @@
+import json
+import os
+
+from archives import archive_fingerprint, is_archive_series
+
+
+def series_fingerprint(df):
+    """
+    DICOM 시리즈 폴더 df의 fingerprint를 scandir 한 번으로 계산합니다.
+    archive 시리즈는 압축을 풀지 않고 archive에 기록된 member의 크기와 mtime으로 계산합니다.
+
+    Returns:
+        list: [파일 수, 전체 크기 (bytes), 가장 최근 mtime (ns)]
+    """
+    if is_archive_series(df):
+        return archive_fingerprint(df)
+    count, size, mtime = 0, 0, 0
+    for e in os.scandir(df):
+        if e.is_file():
+            st = e.stat()
+            count += 1
+            size += st.st_size
+            mtime = max(mtime, st.st_mtime_ns)
+    return [count, size, mtime]
+
+
+class Manifest:
+    """
+    출력 폴더의 변환 manifest (JSON-lines, 시리즈마다 한 줄).
+
+    각 줄은 원본 시리즈 경로, fingerprint, 그리고 변환 결과 (dcm2niix 파일 이름, 정리된 MRI 종류와
+    backup 번호, 제외된 경우 None)를 기록합니다. 같은 시리즈가 여러 번 기록되면 마지막 기록이 유효합니다.
+    다시 실행할 때 fingerprint가 같은 시리즈는 변환하지 않고 기록된 결과를 그대로 사용합니다.
+
+    shard.py의 worker들은 각자 자기 이름의 manifest (.manifest-<worker>.jsonl)에 기록하고,
+    읽을 때는 출력 폴더의 모든 .manifest*.jsonl을 오래된 파일부터 읽습니다.
+    """
+
+    def __init__(self, output_path, name='.manifest.jsonl'):
+        self.path = os.path.join(output_path, name)
+        self.records = {}
+        self.pending = {}
+        manifests = [e.path for e in os.scandir(output_path)
+                     if e.is_file() and e.name.startswith('.manifest') and e.name.endswith('.jsonl')] \
+            if os.path.isdir(output_path) else []
+        for path in sorted(manifests, key=os.path.getmtime):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 중단된 실행에서 마지막 줄이 잘렸을 수 있음
+                        continue
+                    self.records[record['source']] = record
+
+    def check(self, df):
+        """
+        시리즈 df가 이전 실행 이후 바뀌지 않았으면 기록된 결과를, 새롭거나 바뀌었으면 None을 반환합니다.
+        """
+        fingerprint = series_fingerprint(df)
+        record = self.records.get(df)
+        if record is not None and record['fingerprint'] == fingerprint:
+            return record
+        self.pending[df] = fingerprint
+        return None
+
+    def record(self, df, name=None, mri=None, backup=0):
+        """
+        시리즈 df의 변환 결과를 manifest에 추가합니다.
+        name은 dcm2niix가 만든 파일 이름 (%n--%p--%t), mri가 None이면 제외된 시리즈입니다.
+        """
+        fingerprint = self.pending.pop(df, None) or series_fingerprint(df)
+        record = {'source': df, 'fingerprint': fingerprint, 'name': name, 'mri': mri, 'backup': backup}
+        self.records[df] = record
+        # 한 줄을 한 번의 write로 추가하므로 실행이 중단되어도 앞의 기록은 남습니다
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import re
+import threading
+import time
+
+# 복사할 때 한 번에 읽고 쓰는 크기
+CHUNK_SIZE = 4 * 1024 * 1024
+# Linux FICLONE ioctl (btrfs, XFS 등에서 reflink 복사)
+FICLONE = 0x40049409
+STRATEGIES = ('auto', 'rename', 'hardlink', 'reflink', 'copy')
+
+
+class MoveStats:
+    """
+    이동한 파일 수, 바이트 수, 걸린 시간을 방법 (rename, hardlink, reflink, copy)별로 모읍니다.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods = {}
+
+    def add(self, method, nbytes, seconds):
+        with self.lock:
+            files, total, elapsed = self.methods.get(method, (0, 0, 0.0))
+            self.methods[method] = (files + 1, total + nbytes, elapsed + seconds)
+
+    def summary(self):
+        """
+        방법별 '<method>: N file(s), X MB, Y MB/s' 문자열 목록을 반환합니다.
+        """
+        with self.lock:
+            return [f"{method}: {files} file(s), {total / 1024 ** 2:.1f} MB, "
+                    f"{total / 1024 ** 2 / elapsed if elapsed else 0:.1f} MB/s"
+                    for method, (files, total, elapsed) in sorted(self.methods.items())]
+
+
+# organize_niftis에서 사용하는 전체 통계
+STATS = MoveStats()
+
+
+def same_filesystem(src, dst):
+    """
+    src 파일과 dst가 만들어질 폴더가 같은 파일 시스템에 있으면 True를 반환합니다.
+    """
+    return os.stat(src).st_dev == os.stat(os.path.dirname(os.path.abspath(dst))).st_dev
+
+
+def file_digest(path):
+    """
+    path의 sha256을 CHUNK_SIZE 단위로 읽어 계산합니다.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def reflink_file(src, tmp_name):
+    """
+    src를 tmp_name으로 reflink 복사합니다. 지원되지 않으면 OSError를 발생시킵니다.
+    """
+    import fcntl
+
+    with open(src, 'rb') as fsrc, open(tmp_name, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def copy_file(src, tmp_name):
+    """
+    src를 tmp_name으로 CHUNK_SIZE 단위로 복사하고, 복사하면서 계산한 sha256을 반환합니다.
+    """
+    digest = hashlib.sha256()
+    with open(src, 'rb') as fsrc, open(tmp_name, 'wb') as fdst:
+        for chunk in iter(lambda: fsrc.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            fdst.write(chunk)
+        fdst.flush()
+        os.fsync(fdst.fileno())
+    return digest.hexdigest()
+
+
+def move_file(src, dst, strategy='auto', verify=True, stats=STATS):
+    """
+    src를 dst로 옮깁니다.
+
+    Parameters:
+        strategy (str): 'rename' (같은 파일 시스템), 'hardlink' (link 후 src 삭제), 'reflink' (copy-on-write 복사),
+                        'copy' (chunk 단위 복사) 또는 'auto'. 'auto'는 같은 파일 시스템이면 rename,
+                        아니면 reflink를 시도하고 실패하면 copy를 사용합니다.
+        verify (bool): 복사한 경우 dst를 다시 읽어 sha256을 비교한 뒤에 src를 삭제합니다.
+
+    Returns:
+        str: 실제로 사용한 방법.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError("Invalid strategy. Expected one of: %s" % list(STRATEGIES))
+    start = time.perf_counter()
+    nbytes = os.path.getsize(src)
+    if strategy == 'auto':
+        strategy = 'rename' if same_filesystem(src, dst) else 'reflink'
+
+    if strategy == 'rename':
+        os.replace(src, dst)
+    elif strategy == 'hardlink':
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.link(src, dst)
+        os.remove(src)
+    else:
+        # 임시 이름으로 복사한 뒤 os.replace하므로 dst에는 완전한 파일만 나타납니다
+        tmp_name = dst + '.part'
+        try:
+            digest = None
+            if strategy == 'reflink':
+                try:
+                    reflink_file(src, tmp_name)
+                except OSError:
+                    # 파일 시스템이 reflink를 지원하지 않음 (또는 서로 다른 파일 시스템)
+                    strategy = 'copy'
+            if strategy == 'copy':
+                digest = copy_file(src, tmp_name)
+            if verify and file_digest(tmp_name) != (digest or file_digest(src)):
+                raise IOError(f"Checksum mismatch while moving {src} to {dst}")
+            os.replace(tmp_name, dst)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+        os.remove(src)
+
+    if stats is not None:
+        stats.add(strategy, nbytes, time.perf_counter() - start)
+    return strategy
+
+
+def next_backup_index(names, root_name, extension):
+    """
+    폴더의 파일 이름 목록 names에서 root_name_bck-N.extension 중 비어 있는 가장 작은 N을 찾습니다.
+    os.path.exists를 N마다 호출하지 않고 한 번 읽은 목록만 사용합니다.
+    """
+    pattern = re.compile(re.escape(root_name) + r'_bck-(\d+)\.' + re.escape(extension) + '$')
+    used = {int(m.group(1)) for m in map(pattern.match, names) if m}
+    index = 0
+    while index in used:
+        index += 1
+    return index
@@ -0,0 +1,122 @@
+import re
+
+# dcm2niix 파일 이름 (%n--%p--%t) 해석에 사용하는 pattern (한 번만 compile)
+EXTENSION = re.compile(r"[.][a-zA-Z]")
+DIGITS = re.compile(r"\d+")
+ID_SPLIT = re.compile(r"\d{2,}")
+SESSION_CODE = re.compile(r"[A-Z0-9]+")
+
+# BIDS 파일 이름의 entity 순서
+ENTITIES = ('sub', 'ses', 'acq', 'task', 'run')
+
+
+class SeriesInfo:
+    """
+    dcm2niix 파일 이름에서 읽은 시리즈 정보.
+
+    Attributes:
+        num_id (str): subject 번호 (WrongNaming 적용, 최소 2자리).
+        session (str): 세션 code (bids_code의 key, 예: 'A', 'C2', 'AMC').
+        protocol (str): protocol 이름.
+        time (str): 촬영 연월 ('YYYY-MM').
+    """
+    __slots__ = ('num_id', 'session', 'protocol', 'time')
+
+    def __init__(self, num_id, session, protocol, time):
+        self.num_id, self.session, self.protocol, self.time = num_id, session, protocol, time
+
+
+def bids_name(suffix, **entities):
+    """
+    entity들로 BIDS 파일 이름 (확장자 없음)을 만듭니다. 순서는 ENTITIES를 따르고 None인 entity는 생략합니다.
+    값에 이미 'key-'가 붙어 있으면 (예: bids_code의 'ses-acute', 'acq-AP') 그대로 사용합니다.
+
+    예) bids_name('bold', sub='PAT81', ses='ses-acute', task='rest', run=0)
+        → 'sub-PAT81_ses-acute_task-rest_run-0_bold'
+    """
+    parts = []
+    for key in ENTITIES:
+        value = entities.get(key)
+        if value is None:
+            continue
+        value = str(value)
+        parts.append(value if value.startswith(key + '-') else key + '-' + value)
+    parts.append(suffix)
+    return '_'.join(parts)
+
+
+class NamingRules:
+    """
+    bids_code.json을 한 번 compile한 naming 규칙.
+
+    PROTOCOLS pattern을 미리 compile하고, dcm2niix 파일 이름을 SeriesInfo로 해석하며,
+    SeriesInfo로부터 subject/session label과 BIDS 파일 이름을 만듭니다.
+    """
+
+    def __init__(self, bids_code):
+        self.bids_code = bids_code
+        self.protocols = re.compile(f'({bids_code["PROTOCOLS"]})')
+        self.wrong_names = bids_code.get("WrongNaming", {})
+
+    def match_protocol(self, protocol):
+        """
+        protocol이 PROTOCOLS 중 하나로 시작하면 그 PROTOCOLS 항목을, 아니면 None을 반환합니다.
+        """
+        m = self.protocols.match(protocol)
+        return m.group() if m else None
+
+    def parse(self, nifti_file):
+        """
+        dcm2niix 파일 경로 (…/%n--%p--%t.<ext>)를 해석합니다.
+
+        Returns:
+            tuple: (폴더 경로 ('/'로 끝남), 확장자 없는 파일 이름, SeriesInfo)
+
+        Raises:
+            ValueError: 파일 이름이 %n--%p--%t 형식이 아니거나 subject 번호/세션 code가 없는 경우.
+        """
+        file_name = nifti_file.split('/')[-1]
+        path = nifti_file[:len(nifti_file) - len(file_name)]
+        name = EXTENSION.split(file_name, 1)[0]
+        i, p, t = name.split('--')
+        digits = DIGITS.search(i)
+        session = SESSION_CODE.search(ID_SPLIT.split(i)[-1].upper())
+        if digits is None or session is None:
+            raise ValueError(f"Cannot read subject number and session from {name}")
+        num_id = digits.group().lstrip('0')
+        num_id = self.wrong_names.get(num_id, num_id)
+        if len(num_id) == 1:
+            num_id = '0' + num_id
+        return path, name, SeriesInfo(num_id, session.group(), p, t[:4] + '-' + t[4:6])
+
+    def subject(self, info):
+        """
+        SeriesInfo의 subject label (예: 'PAT81').
+        """
+        return self.bids_code[info.session]["ID"] + info.num_id
+
+    def session(self, info):
+        """
+        SeriesInfo의 session 폴더 이름 (예: 'ses-acute').
+        """
+        return self.bids_code[info.session]["session"]
+
+    def file_name(self, info, suffix, acq=None, task=None, run=None):
+        """
+        SeriesInfo의 BIDS 파일 이름 (확장자 없음)을 만듭니다.
+        """
+        return bids_name(suffix, sub=self.subject(info), ses=self.session(info), acq=acq, task=task, run=run)
+
+
+# bids_code dict별로 한 번만 compile (key: id(bids_code))
+COMPILED = {}
+
+
+def compile_rules(bids_code):
+    """
+    bids_code의 NamingRules를 반환합니다. 같은 bids_code에 대해서는 compile된 규칙을 재사용합니다.
+    """
+    rules = COMPILED.get(id(bids_code))
+    if rules is None or rules.bids_code is not bids_code:
+        rules = COMPILED[id(bids_code)] = NamingRules(bids_code)
+    return rules
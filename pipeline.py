@@ -0,0 +1,256 @@
+import heapq
+import queue
+import threading
+import time
+
+from bids_constructor import session_series, session_unchanged, staging_folder, convert_series, classify_series
+
+# 단계 사이 queue의 끝 표시
+DONE = object()
+
+
+class StageMetrics:
+    """
+    한 단계의 처리 항목 수, 처리 시간 (busy), 입력을 기다린 시간 (idle), 다음 단계가 가득 차서 기다린 시간 (blocked),
+    그리고 입력 queue 깊이의 표본 (mean, max)을 모읍니다.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.items, self.busy, self.idle, self.blocked = 0, 0.0, 0.0, 0.0
+        self.samples, self.depth_sum, self.depth_max = 0, 0, 0
+
+    def add(self, busy=0.0, idle=0.0, blocked=0.0, items=1):
+        with self.lock:
+            self.items += items
+            self.busy += busy
+            self.idle += idle
+            self.blocked += blocked
+
+    def sample(self, depth):
+        with self.lock:
+            self.samples += 1
+            self.depth_sum += depth
+            self.depth_max = max(self.depth_max, depth)
+
+    def summary(self):
+        with self.lock:
+            mean = self.depth_sum / self.samples if self.samples else 0
+            return f"{self.name:<10}{self.items:>7}{self.busy:>10.1f}{self.idle:>10.1f}{self.blocked:>10.1f}" \
+                   f"{mean:>8.1f}{self.depth_max:>6}"
+
+
+class SessionItems:
+    """
+    Pipeline.sessions()가 돌려주는 한 세션 폴더의 시리즈 iterator.
+    (시리즈 폴더, 파일 목록 또는 manifest 기록[, classify_series 결과]) 항목을 시리즈 순서대로 돌려주며,
+    변환이 실패한 시리즈에서는 그 예외를 발생시킵니다.
+    """
+
+    def __init__(self, pipeline, count):
+        self.pipeline = pipeline
+        self.remaining = count
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.remaining == 0:
+            raise StopIteration
+        self.remaining -= 1
+        item = self.pipeline.next_item()
+        self.pipeline.release()
+        if isinstance(item[1], Exception):
+            raise item[1]
+        return item
+
+    def drain(self):
+        """
+        아직 받지 않은 시리즈가 모두 변환될 때까지 기다립니다 (staging을 정리하기 전에 호출).
+        """
+        while self.remaining:
+            self.remaining -= 1
+            self.pipeline.next_item()
+            self.pipeline.release()
+
+
+class Pipeline:
+    """
+    세션 폴더들을 단계별 thread로 처리하는 streaming pipeline.
+
+        enumerate (1 thread: 시리즈 목록, manifest 확인, triage)
+          → convert (workers thread: dcm2niix, 압축)
+          → classify (1 thread: 파일 이름 해석, criteria)
+          → place/summarize (sessions()를 소비하는 thread: organize_niftis, sessions.tsv)
+
+    단계 사이의 queue는 depth개로 제한되고, 변환되었지만 아직 정리되지 않은 시리즈는 window개 이하이므로
+    (backpressure) staging에 쌓이는 파일의 양이 제한됩니다. 각 단계는 다른 단계와 동시에 실행되지만
+    결과는 폴더 순서, 시리즈 순서대로 전달되므로 출력은 serial 실행과 같습니다.
+    """
+
+    def __init__(self, folders, config, bids_code, manifest=None, planned=None, workers=1, depth=8, window=None,
+                 interval=0.5):
+        self.folders, self.config, self.bids_code = folders, config, bids_code
+        self.manifest, self.planned, self.workers = manifest, planned, max(1, workers)
+        self.convert_queue = queue.Queue(depth)
+        self.classify_queue = queue.Queue(depth)
+        self.place_queue = queue.Queue(depth)
+        self.window = threading.BoundedSemaphore(window or depth + self.workers)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.metrics = {name: StageMetrics(name) for name in ('enumerate', 'convert', 'classify', 'place')}
+        self.pending = []
+        self.next_seq = 0
+        self.stop = threading.Event()
+        self.interval = interval
+        self.threads = [threading.Thread(target=self.enumerate, daemon=True),
+                        threading.Thread(target=self.classify, daemon=True),
+                        threading.Thread(target=self.sampler, daemon=True)] + \
+                       [threading.Thread(target=self.convert, daemon=True) for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, q, item, metrics):
+        start = time.perf_counter()
+        q.put(item)
+        metrics.add(blocked=time.perf_counter() - start, items=0)
+
+    def get(self, q, metrics):
+        start = time.perf_counter()
+        item = q.get()
+        metrics.add(idle=time.perf_counter() - start, items=0)
+        return item
+
+    def enumerate(self):
+        """
+        각 세션 폴더의 시리즈 목록을 만듭니다. 항목: (순번, 종류, 내용).
+        종류 'folder'의 내용은 (폴더, 시리즈 수, 모두 그대로인지), 'series'는 (폴더, 시리즈 폴더, manifest 기록 또는 None).
+        """
+        metrics = self.metrics['enumerate']
+        seq = 0
+        try:
+            for f in self.folders:
+                start = time.perf_counter()
+                try:
+                    series = session_series(f, self.config, self.bids_code, self.manifest, self.planned)
+                    unchanged = session_unchanged(f, series, self.config, self.bids_code)
+                except Exception as e:
+                    series, unchanged, error = [], False, e
+                else:
+                    error = None
+                metrics.add(busy=time.perf_counter() - start)
+                self.put(self.convert_queue, (seq, 'folder', (f, len(series), unchanged, error)), metrics)
+                seq += 1
+                for df, record in series:
+                    # 정리되지 않은 시리즈가 window개이면 여기에서 기다림 (backpressure)
+                    start = time.perf_counter()
+                    self.window.acquire()
+                    with self.lock:
+                        self.in_flight += 1
+                    metrics.add(blocked=time.perf_counter() - start, items=0)
+                    self.put(self.convert_queue, (seq, 'series', (f, df, record)), metrics)
+                    seq += 1
+        finally:
+            # 중간에 실패해도 DONE을 보내야 정리 단계가 기다리지 않고 오류로 끝남 (next_entry)
+            for _ in range(self.workers):
+                self.convert_queue.put(DONE)
+
+    def convert(self):
+        metrics = self.metrics['convert']
+        while True:
+            item = self.get(self.convert_queue, metrics)
+            if item is DONE:
+                self.classify_queue.put(DONE)
+                return
+            seq, kind, content = item
+            if kind == 'series' and content[2] is None:
+                f, df, _ = content
+                start = time.perf_counter()
+                try:
+                    niftis = convert_series(df, staging_folder(self.config, f), self.config)
+                except Exception as e:
+                    niftis = e
+                metrics.add(busy=time.perf_counter() - start)
+                item = (seq, kind, (f, df, niftis))
+            self.put(self.classify_queue, item, metrics)
+
+    def classify(self):
+        metrics = self.metrics['classify']
+        finished = 0
+        while finished < self.workers:
+            item = self.get(self.classify_queue, metrics)
+            if item is DONE:
+                finished += 1
+                continue
+            seq, kind, content = item
+            if kind == 'series' and isinstance(content[2], list) and content[2]:
+                f, df, niftis = content
+                start = time.perf_counter()
+                try:
+                    classified = classify_series(df, niftis, self.bids_code)
+                except Exception as e:
+                    classified = e
+                metrics.add(busy=time.perf_counter() - start)
+                item = (seq, kind, (f, df, niftis, classified))
+            self.put(self.place_queue, item, metrics)
+        self.place_queue.put(DONE)
+
+    def release(self):
+        """
+        시리즈 하나가 정리 단계로 넘어갔음을 알립니다 (enumerate가 다음 시리즈를 보낼 수 있음).
+        """
+        with self.lock:
+            self.in_flight -= 1
+        self.window.release()
+
+    def sampler(self):
+        while not self.stop.wait(self.interval):
+            self.metrics['enumerate'].sample(self.in_flight)
+            self.metrics['convert'].sample(self.convert_queue.qsize())
+            self.metrics['classify'].sample(self.classify_queue.qsize())
+            self.metrics['place'].sample(self.place_queue.qsize())
+
+    def next_entry(self):
+        """
+        다음 순번의 항목을 반환합니다. 순서가 바뀌어 도착한 항목은 heap에 보관합니다.
+        """
+        metrics = self.metrics['place']
+        while not self.pending or self.pending[0][0] != self.next_seq:
+            item = self.get(self.place_queue, metrics)
+            if item is DONE:
+                raise RuntimeError("Pipeline ended before all series were placed")
+            heapq.heappush(self.pending, item)
+        self.next_seq += 1
+        return heapq.heappop(self.pending)
+
+    def next_item(self):
+        seq, kind, content = self.next_entry()
+        return content[1:]
+
+    def sessions(self):
+        """
+        (세션 폴더, 모든 시리즈가 이전 실행 그대로인지, SessionItems, 오류)를 폴더 순서대로 돌려줍니다.
+        오류는 시리즈 목록을 만들지 못한 경우의 예외, 아니면 None입니다.
+        SessionItems를 끝까지 소비하지 않으면 다음 폴더로 넘어가기 전에 나머지를 기다립니다.
+        """
+        for _ in self.folders:
+            seq, kind, (f, count, unchanged, error) = self.next_entry()
+            items = SessionItems(self, count)
+            start = time.perf_counter()
+            yield f, unchanged, items, error
+            items.drain()
+            self.metrics['place'].add(busy=time.perf_counter() - start)
+        self.close()
+
+    def close(self):
+        self.stop.set()
+
+    def summary(self):
+        """
+        단계별 metrics 표 (문자열). depth는 각 단계 입력 queue의 표본 평균과 최대값이며,
+        enumerate의 depth는 변환 중이거나 정리를 기다리는 시리즈 수 (window 사용량)입니다.
+        """
+        lines = [f"{'stage':<10}{'items':>7}{'busy (s)':>10}{'idle (s)':>10}{'blocked':>10}{'depth':>8}{'max':>6}"]
+        lines.extend(metrics.summary() for metrics in self.metrics.values())
+        return '\n'.join(lines)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from bids_constructor import get_folders, list_series
+from criteria import header_criteria
+from manifest import series_fingerprint
+from naming import DIGITS, compile_rules
+from triage import TRIAGE_TAGS, first_dicom, header_info, list_dicoms
+
+# plan에 필요한 DICOM attribute (dcm2niix의 %n, %t, 영상 크기, phase encoding). pixel data는 읽지 않습니다.
+PLAN_TAGS = TRIAGE_TAGS + ['PatientName', 'StudyDate', 'StudyTime', 'Rows', 'Columns', 'BitsAllocated',
+                           'NumberOfFrames', 'InPlanePhaseEncodingDirection', 0x00290010, 0x00291010]
+# InPlanePhaseEncodingDirection → dcm2niix PhaseEncodingDirection의 축
+PHASE_AXES = {'COL': 'j', 'ROW': 'i'}
+
+
+def phase_encoding(ds):
+    """
+    dcm2niix가 JSON sidecar에 쓸 PhaseEncodingDirection (예: 'j-')을 header에서 추정합니다.
+    극성은 Siemens CSA header의 PhaseEncodingDirectionPositive에서 읽으며, 알 수 없으면 None을 반환합니다.
+    """
+    axis = PHASE_AXES.get(str(ds.get('InPlanePhaseEncodingDirection', '')).strip().upper())
+    if axis is None:
+        return None
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            from nibabel.nicom import csareader
+            positive = csareader.get_scalar(csareader.get_csa_header(ds, 'image'), 'PhaseEncodingDirectionPositive')
+    except Exception:
+        positive = None
+    if positive is None:
+        return None
+    return axis if int(positive) == 1 else axis + '-'
+
+
+def read_plan_header(df):
+    """
+    DICOM 시리즈 폴더 df의 첫 번째 파일 header로 plan에 필요한 정보를 반환합니다.
+
+    Returns:
+        dict: triage.header_info의 항목과 'name' (dcm2niix가 만들 %n--%p--%t 이름), 'phase_encoding',
+              'dicom_bytes' (DICOM 파일 크기의 합), 'estimated_bytes' (압축하지 않은 NIfTI 크기 추정).
+              DICOM 파일을 읽을 수 없으면 None.
+    """
+    files = list_dicoms(df)
+    if not files:
+        return None
+    import pydicom
+
+    try:
+        ds = pydicom.dcmread(first_dicom(df, files), stop_before_pixels=True, specific_tags=PLAN_TAGS)
+    except Exception:
+        return None
+
+    info = header_info(ds, files)
+    patient = str(ds.get('PatientName', '')).strip().replace(' ', '_')
+    study_time = str(ds.get('StudyDate', '')) + str(ds.get('StudyTime', '')).split('.')[0]
+    info['name'] = f"{patient}--{info['protocol']}--{study_time}"
+    info['phase_encoding'] = phase_encoding(ds)
+    info['dicom_bytes'] = series_fingerprint(df)[1]
+    # 모든 파일이 첫 번째 파일과 같은 크기의 영상이라고 가정합니다
+    frame_bytes = int(ds.get('Rows') or 0) * int(ds.get('Columns') or 0) * int(ds.get('BitsAllocated') or 16) // 8
+    info['estimated_bytes'] = frame_bytes * int(ds.get('NumberOfFrames') or 1) * len(files)
+    return info
+
+
+def plan_series(df, header, rules, config, bids_code):
+    """
+    시리즈 하나를 변환기가 어떻게 처리할지 (convert_dicom_session과 같은 순서의 판단) 계산합니다.
+    target과 backup은 plan_folder에서 채워집니다.
+    """
+    entry = {'series': df, 'action': 'convert', 'reason': '', 'name': None, 'mri': None, 'target': None,
+             'wrong_naming': False, 'backup': False, 'dicom_bytes': 0, 'estimated_bytes': 0}
+    if header is None:
+        # 변환 후의 inclusion_or_exclusion_criteria가 판단 (triage와 같음)
+        entry['reason'] = 'unreadable DICOM header'
+        return entry, None
+    entry.update(name=header['name'], dicom_bytes=header['dicom_bytes'], estimated_bytes=header['estimated_bytes'])
+
+    proceed, reason = header_criteria(header, bids_code)
+    if not proceed:
+        entry.update(action='skip', reason=reason)
+        return entry, None
+
+    try:
+        _, _, info = rules.parse(header['name'])
+    except Exception as e:
+        if 'localizer' in header['name'].lower() or 'scout' in header['name'].lower():
+            entry.update(action='skip', reason='localizer')
+        else:
+            entry.update(action='error', reason=f"cannot parse {header['name']}: {e}")
+        return entry, None
+    digits = DIGITS.search(header['name'].split('--')[0])
+    entry['wrong_naming'] = bool(digits) and digits.group().lstrip('0') in rules.wrong_names
+
+    mri = rules.match_protocol(info.protocol)
+    if mri is None:
+        entry.update(action='skip', reason=f"protocol {info.protocol} not in PROTOCOLS")
+        return entry, None
+    suffix = bids_code[mri]
+    if suffix == 'dwi':
+        if header['phase_encoding'] is None:
+            entry['reason'] = 'PhaseEncodingDirection read after conversion'
+        entry['mri'], acq = 'dwi', bids_code.get(header['phase_encoding'])
+        entry['target'] = rules.file_name(info, suffix, acq=acq or 'acq-unknown')
+    elif suffix in ('T1w', 'T2w'):
+        entry['mri'] = 'anat'
+        entry['target'] = rules.file_name(info, suffix)
+    elif suffix == 'bold':
+        if header['volumes'] is None:
+            entry['reason'] = 'number of volumes checked after conversion'
+        entry['mri'] = 'func'
+    if entry['mri'] not in config['subjects']['mris']:
+        entry.update(action='skip', reason=f"{entry['mri']} not in subjects.mris")
+    return entry, info
+
+
+def plan_folder(f, headers, rules, config, bids_code, planned_targets):
+    """
+    세션 폴더 f의 plan (dict)을 만듭니다. headers는 시리즈 순서대로 (시리즈 폴더, read_plan_header 결과).
+    planned_targets는 앞선 폴더들이 만들 파일 이름의 set이며 backup 추정에 사용됩니다.
+    """
+    folder = {'folder': f, 'status': 'ok', 'subject': None, 'session': None, 'acq_time': None,
+              'series': [], 'warnings': []}
+    counts = {'anat': 0, 'dwi': 0, 'func': 0}
+    for df, header in headers:
+        entry, info = plan_series(df, header, rules, config, bids_code)
+        if entry['action'] == 'error':
+            folder['status'] = 'error'
+        if info is not None:
+            folder.update(subject='sub-' + rules.subject(info), session=rules.session(info), acq_time=info.time)
+        if entry['action'] == 'convert' and entry['mri'] is not None:
+            if entry['mri'] == 'func':
+                entry['target'] = rules.file_name(info, 'bold', task='rest', run=counts['func'])
+            entry['target'] = f"{folder['subject']}/{folder['session']}/{entry['mri']}/{entry['target']}"
+            # organize_niftis는 같은 이름의 파일이 이미 있으면 backup 폴더로 옮깁니다
+            existing = config['data']['output_path'] + entry['target']
+            entry['backup'] = entry['target'] in planned_targets or \
+                os.path.exists(existing + '.nii.gz') or os.path.exists(existing + '.nii')
+            planned_targets.add(entry['target'])
+            counts[entry['mri']] += 1
+        folder['series'].append(entry)
+
+    if folder['status'] == 'ok' and folder['subject'] is not None and counts['anat'] < 2:
+        folder['warnings'].append(f"{counts['anat']} anatomical image(s) planned in this session")
+    folder.update(counts)
+    return folder
+
+
+def build_plan(config, bids_code, workers=8):
+    """
+    config의 입력 폴더 전체에 대해 변환하지 않고 BIDS 구조를 계산합니다.
+    각 시리즈의 첫 번째 DICOM 파일 header만 thread pool로 읽습니다.
+
+    Returns:
+        dict: 'created', 'input_path', 'output_path', 'folders' (plan_folder 결과 목록), 'totals'.
+    """
+    rules = compile_rules(bids_code)
+    folders, _ = get_folders(config=config)
+    series = [(f, list_series(f)) for f in folders]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        headers = [(f, list(zip(dfs, executor.map(read_plan_header, dfs)))) for f, dfs in series]
+
+    planned_targets = set()
+    plan = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'input_path': config['data']['input_path'],
+            'output_path': config['data']['output_path'],
+            'folders': [plan_folder(f, h, rules, config, bids_code, planned_targets) for f, h in headers]}
+    plan['totals'] = plan_totals(plan)
+    return plan
+
+
+def plan_totals(plan):
+    entries = [entry for folder in plan['folders'] for entry in folder['series']]
+    converted = [entry for entry in entries if entry['action'] == 'convert']
+    return {
+        'folders': len(plan['folders']),
+        'error_folders': sum(folder['status'] == 'error' for folder in plan['folders']),
+        'series': len(entries),
+        'convert': len(converted),
+        'skip': sum(entry['action'] == 'skip' for entry in entries),
+        'wrong_naming': sum(entry['wrong_naming'] for entry in converted),
+        'backups': sum(entry['backup'] for entry in converted),
+        'dicom_bytes': sum(entry['dicom_bytes'] for entry in converted),
+        'estimated_bytes': sum(entry['estimated_bytes'] for entry in converted),
+    }
+
+
+def write_plan(plan, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, indent=4)
+
+
+def load_plan(path):
+    """
+    write_plan으로 저장한 plan을 읽어 {세션 폴더: 변환할 시리즈 폴더 목록}을 반환합니다.
+    status가 'error'인 폴더는 변환해도 실패하므로 포함하지 않습니다.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        plan = json.load(f)
+    return {folder['folder']: [entry['series'] for entry in folder['series'] if entry['action'] == 'convert']
+            for folder in plan['folders'] if folder['status'] == 'ok'}
+
+
+def print_plan(plan):
+    for folder in plan['folders']:
+        if folder['status'] == 'error':
+            reasons = [entry['reason'] for entry in folder['series'] if entry['action'] == 'error']
+            print(f"ERROR   {folder['folder']}: {reasons[0]}")
+        for warning in folder['warnings']:
+            print(f"WARNING {folder['folder']}: {warning}")
+        for entry in folder['series']:
+            if entry['wrong_naming'] and entry['action'] == 'convert':
+                print(f"RENAMED {entry['series']} → {entry['target']}")
+    totals = plan['totals']
+    print(f"{totals['folders']} folder(s) ({totals['error_folders']} with errors), {totals['series']} series: "
+          f"{totals['convert']} to convert, {totals['skip']} skipped, {totals['backups']} backup(s), "
+          f"{totals['wrong_naming']} renamed by WrongNaming")
+    print(f"DICOM: {totals['dicom_bytes'] / 1024 ** 3:.2f} GB, "
+          f"estimated NIfTI (uncompressed): {totals['estimated_bytes'] / 1024 ** 3:.2f} GB")
+
+
+def run(config, bids_code, output='plan.json', workers=8):
+    """
+    plan을 만들어 output에 기록하고 요약을 출력합니다.
+    """
+    start = time.perf_counter()
+    plan = build_plan(config, bids_code, workers=workers)
+    write_plan(plan, output)
+    print_plan(plan)
+    print(f"Plan written to {output} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == '__main__':
+    from settings import load_bids_code, load_config
+
+    parser = argparse.ArgumentParser(description="Computes the BIDS layout of the input folders without converting them")
+    parser.add_argument("--config", default="config.yaml", help="Configuration file")
+    parser.add_argument("--bids-code", default="bids_code.json", help="BIDS coding keys")
+    parser.add_argument("--output", default="plan.json", help="Plan file (run it with data.plan in the configuration)")
+    parser.add_argument("--workers", type=int, default=8, help="Threads reading the DICOM headers")
+    args = parser.parse_args()
+
+    run(load_config(args.config), load_bids_code(args.bids_code), args.output, workers=args.workers)
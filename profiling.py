@@ -0,0 +1,178 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def io_counters():
+    """
+    이 process가 읽고 쓴 바이트 수 (/proc/self/io의 rchar, wchar)를 반환합니다. 지원되지 않으면 (0, 0).
+    """
+    try:
+        with open('/proc/self/io', 'r') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def peak_rss_mb():
+    """
+    이 process와 (끝난) 자식 process들 (dcm2niix)의 최대 RSS (MB)를 반환합니다.
+    """
+    if resource is None:
+        return 0.0, 0.0
+    # Linux에서 ru_maxrss 단위는 KB
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024)
+
+
+def children_cpu():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Tracer:
+    """
+    pipeline 단계 (triage, convert, criteria, organize, summary 등)의 측정값을 기록합니다.
+
+    각 단계마다 wall time, 이 thread의 CPU time, 자식 process (dcm2niix)의 CPU time,
+    process가 읽고 쓴 바이트 수, 최대 RSS를 JSON-lines 파일에 한 줄씩 씁니다.
+    CPU time 외의 값은 process 전체 기준이므로 여러 worker가 동시에 실행되면 근사값입니다.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.file = open(path, 'a', encoding='utf-8') if path else None
+
+    @contextmanager
+    def stage(self, name, **context):
+        """
+        with 블록을 name 단계로 측정합니다. context (folder, series 등)는 trace에 그대로 기록됩니다.
+        """
+        read0, write0 = io_counters()
+        child0 = children_cpu()
+        cpu0 = time.thread_time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.thread_time() - cpu0
+            child = children_cpu() - child0
+            read1, write1 = io_counters()
+            rss, child_rss = peak_rss_mb()
+            event = dict(stage=name, **context, start=time.time() - wall, wall=wall, cpu=cpu, child_cpu=child,
+                         read_bytes=read1 - read0, write_bytes=write1 - write0,
+                         peak_rss_mb=rss, child_peak_rss_mb=child_rss)
+            self.record(event)
+
+    def record(self, event):
+        with self.lock:
+            count, wall, cpu, child, read, write = self.totals.get(event['stage'], (0, 0.0, 0.0, 0.0, 0, 0))
+            self.totals[event['stage']] = (count + 1, wall + event['wall'], cpu + event['cpu'],
+                                           child + event['child_cpu'], read + event['read_bytes'],
+                                           write + event['write_bytes'])
+            if self.file is not None:
+                self.file.write(json.dumps(event) + '\n')
+                self.file.flush()
+
+    def summary(self):
+        """
+        단계별 합계 표 (문자열)를 반환합니다.
+        """
+        lines = [f"{'stage':<12}{'count':>8}{'wall (s)':>12}{'mean (s)':>12}{'cpu (s)':>10}"
+                 f"{'child cpu':>11}{'read MB':>10}{'write MB':>10}"]
+        with self.lock:
+            for name, (count, wall, cpu, child, read, write) in self.totals.items():
+                lines.append(f"{name:<12}{count:>8}{wall:>12.2f}{wall / count:>12.3f}{cpu:>10.2f}"
+                             f"{child:>11.2f}{read / 1024 ** 2:>10.1f}{write / 1024 ** 2:>10.1f}")
+        rss, child_rss = peak_rss_mb()
+        lines.append(f"peak RSS: {rss:.0f} MB (children: {child_rss:.0f} MB)")
+        return '\n'.join(lines)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class NullTracer:
+    """
+    측정하지 않는 tracer (기본값).
+    """
+
+    @contextmanager
+    def stage(self, name, **context):
+        yield
+
+    def record(self, event):
+        pass
+
+    def summary(self):
+        return ''
+
+    def close(self):
+        pass
+
+
+# bids_constructor와 criteria의 단계들이 사용하는 tracer (configure로 설정)
+TRACER = NullTracer()
+
+
+def stage(name, **context):
+    """
+    현재 tracer로 name 단계를 측정하는 context manager를 반환합니다.
+    """
+    return TRACER.stage(name, **context)
+
+
+def configure(config):
+    """
+    config의 'profile.trace'가 있으면 그 경로에 trace를 쓰는 Tracer를 설정하고 반환합니다.
+    """
+    global TRACER
+    path = (config.get('profile') or {}).get('trace')
+    TRACER = Tracer(path) if path else NullTracer()
+    return TRACER
+
+
+@contextmanager
+def profiler(config):
+    """
+    config의 'profile.cprofile' (cProfile 통계 파일) 또는 'profile.pyinstrument' (HTML report)가 있으면
+    with 블록 전체를 profiling 합니다.
+    """
+    options = config.get('profile') or {}
+    if options.get('pyinstrument'):
+        from pyinstrument import Profiler
+
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            with open(options['pyinstrument'], 'w', encoding='utf-8') as f:
+                f.write(profile.output_html())
+    elif options.get('cprofile'):
+        import cProfile
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(options['cprofile'])
+    else:
+        yield
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import gzip
+import json
+import os
+import time
+
+import nibabel as nib
+import numpy as np
+
+from bids_index import BIDSIndex
+
+# 한 번에 읽는 volume 수 (메모리: chunk × volume의 voxel 수 × 8 bytes)
+CHUNK = 8
+# mask: 기준 영상 (BOLD의 첫 volume, DWI의 평균 b0)에서 98 percentile의 이 비율보다 밝은 voxel
+MASK_FRACTION = 0.2
+# 이 값 이하의 b-value는 b0로 봅니다
+B0_THRESHOLD = 50
+# DVARS가 median + OUTLIER_MADS × MAD (정규분포 기준으로 보정)보다 큰 volume은 outlier
+OUTLIER_MADS = 3.0
+# DWI: 같은 shell의 다른 volume들의 median보다 이 비율 이상 어두운 slice는 signal dropout
+DROPOUT = 0.3
+# dataset의 QC 요약 (출력 폴더의 qc.tsv) column 순서
+COLUMNS = ['file', 'modality', 'volumes', 'tsnr_median', 'tsnr_mean', 'dvars_median', 'outliers',
+           'b0_volumes', 'b0_snr', 'b0_tsnr', 'dropout_volumes', 'dropout_slices']
+# QC 결과 파일: <BIDS 파일 이름>_qc.json (BIDS validator가 무시하도록 .bidsignore에 추가)
+SUFFIX = '_qc.json'
+BIDSIGNORE = ['*' + SUFFIX, 'qc.tsv']
+
+
+def volume_chunks(path, chunk=CHUNK):
+    """
+    4D NIfTI path의 volume들을 chunk개씩 (chunk, voxel 수) float64 배열로 읽습니다 (scl_slope/inter 적용).
+    .nii는 memory-map하고, .nii.gz는 압축을 풀면서 순서대로 읽으므로 한 번에 메모리에 있는 것은 chunk개의 volume뿐입니다.
+
+    Returns:
+        tuple: (영상 shape, chunk iterator)
+    """
+    # image.header의 vox_offset은 0으로 바뀌므로 파일의 배치는 ArrayProxy에서 읽음 (voxel 값은 읽지 않음)
+    proxy = nib.load(path).dataobj
+    shape, dtype, offset = proxy.shape, proxy.dtype, int(proxy.offset)
+    slope, inter = proxy.slope, proxy.inter
+    voxels = int(np.prod(shape[:3]))
+    volumes = int(np.prod(shape[3:])) if len(shape) > 3 else 1
+
+    def scaled(block):
+        data = block.astype(np.float64)
+        if slope != 1:
+            data *= slope
+        if inter:
+            data += inter
+        return data
+
+    def chunks():
+        if path.endswith('.gz'):
+            with gzip.open(path, 'rb') as f:
+                f.seek(offset)
+                for start in range(0, volumes, chunk):
+                    count = min(chunk, volumes - start)
+                    buffer = f.read(count * voxels * dtype.itemsize)
+                    yield scaled(np.frombuffer(buffer, dtype=dtype).reshape(count, voxels))
+        else:
+            # NIfTI는 x가 가장 빠른 순서로 저장되므로 volume 하나는 연속된 voxels개의 값
+            data = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(volumes, voxels))
+            for start in range(0, volumes, chunk):
+                yield scaled(data[start:start + chunk])
+
+    return shape, chunks()
+
+
+class RunningStats:
+    """
+    voxel별 평균과 분산을 chunk 단위로 합칩니다 (Chan et al.의 병렬 Welford).
+    """
+
+    def __init__(self, size):
+        self.count = 0
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+
+    def add(self, block):
+        count = block.shape[0]
+        mean = block.mean(axis=0)
+        m2 = ((block - mean) ** 2).sum(axis=0)
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def std(self):
+        return np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.zeros_like(self.mean)
+
+
+def brain_mask(reference):
+    return reference > MASK_FRACTION * np.percentile(reference, 98)
+
+
+def robust_outliers(values):
+    """
+    values 중 median + OUTLIER_MADS × (1.4826 × MAD)보다 큰 항목의 index 목록.
+    """
+    if len(values) == 0:
+        return []
+    median = np.median(values)
+    mad = 1.4826 * np.median(np.abs(values - median))
+    return [int(i) for i in np.flatnonzero(values > median + OUTLIER_MADS * mad)] if mad > 0 else []
+
+
+def finite(value):
+    value = float(value)
+    return round(value, 4) if np.isfinite(value) else None
+
+
+def bold_metrics(path, chunk=CHUNK):
+    """
+    BOLD run의 tSNR (mask 안의 voxel별 평균/표준편차의 median, mean)과 DVARS (연속된 volume 차이의 RMS,
+    평균 신호에 대한 %)를 한 번 읽어 계산합니다. mask는 첫 volume에서 만듭니다.
+    """
+    shape, chunks = volume_chunks(path, chunk)
+    mask, stats, previous, dvars = None, None, None, []
+    for block in chunks:
+        if mask is None:
+            mask = brain_mask(block[0])
+            stats = RunningStats(int(mask.sum()))
+        block = block[:, mask]
+        stats.add(block)
+        if block.shape[1]:
+            # 이전 chunk의 마지막 volume과 이어서 차이를 계산
+            joined = block if previous is None else np.vstack([previous, block])
+            dvars.extend(np.sqrt((np.diff(joined, axis=0) ** 2).mean(axis=1)))
+            previous = block[-1:]
+
+    metrics = {'modality': 'func', 'volumes': stats.count if stats else 0}
+    if not stats or not stats.mean.size:
+        return metrics
+    std = stats.std()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tsnr = np.where(std > 0, stats.mean / std, np.nan)
+    global_mean = stats.mean.mean()
+    dvars = 100 * np.asarray(dvars) / global_mean if global_mean else np.asarray(dvars)
+    outliers = robust_outliers(dvars)
+    metrics.update({
+        'tsnr_median': finite(np.nanmedian(tsnr)) if np.isfinite(tsnr).any() else None,
+        'tsnr_mean': finite(np.nanmean(tsnr)) if np.isfinite(tsnr).any() else None,
+        'dvars_median': finite(np.median(dvars)) if len(dvars) else None,
+        'outliers': len(outliers),
+        # DVARS[i]는 volume i와 i + 1의 차이
+        'outlier_volumes': [i + 1 for i in outliers],
+        'dvars': [finite(value) for value in dvars],
+    })
+    return metrics
+
+
+def read_bvals(path):
+    with open(path, 'r') as f:
+        return np.array([float(value) for value in f.read().split()])
+
+
+def dwi_metrics(path, bvals, chunk=CHUNK):
+    """
+    DWI run의 b0 SNR (평균 b0의 mask 안 평균 / mask 밖 배경의 표준편차), b0 tSNR (b0가 2개 이상일 때),
+    signal dropout (같은 shell의 median보다 DROPOUT 이상 어두운 slice)을 한 번 읽어 계산합니다.
+    slice별 평균 (volume 수 × slice 수)만 보관합니다. b-value 수가 volume 수와 다르면 첫 volume만 b0로 봅니다.
+    """
+    shape, chunks = volume_chunks(path, chunk)
+    volumes = int(np.prod(shape[3:])) if len(shape) > 3 else 1
+    metrics = {'modality': 'dwi', 'volumes': volumes}
+    if len(bvals) != volumes:
+        metrics['warning'] = f"{len(bvals)} b-values for {volumes} volumes"
+        bvals = np.zeros(volumes)
+        bvals[1:] = np.inf
+    b0 = bvals <= B0_THRESHOLD
+    metrics['b0_volumes'] = int(b0.sum())
+
+    stats = RunningStats(int(np.prod(shape[:3])))
+    slices = []
+    start = 0
+    for block in chunks:
+        count = block.shape[0]
+        rows = b0[start:start + count]
+        if rows.any():
+            stats.add(block[rows])
+        # x가 가장 빠른 순서이므로 (volume, z, y·x)로 보면 slice별 평균
+        slices.append(block.reshape(count, shape[2], -1).mean(axis=2))
+        start += count
+    slices = np.vstack(slices)
+
+    if stats.count:
+        mask = brain_mask(stats.mean)
+        background = stats.mean[~mask]
+        noise = background.std() if background.size > 1 else 0
+        metrics['b0_snr'] = finite(stats.mean[mask].mean() / noise) if noise > 0 and mask.any() else None
+        if stats.count > 1 and mask.any():
+            std = stats.std()[mask]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                tsnr = np.where(std > 0, stats.mean[mask] / std, np.nan)
+            metrics['b0_tsnr'] = finite(np.nanmedian(tsnr)) if np.isfinite(tsnr).any() else None
+
+    # shell (b-value를 100 단위로 반올림)마다 slice 평균을 그 shell의 median과 비교
+    dropouts = np.zeros(slices.shape, dtype=bool)
+    shells = np.round(bvals / 100) * 100
+    for shell in np.unique(shells[~b0]):
+        rows = np.flatnonzero((shells == shell) & ~b0)
+        if len(rows) < 3:
+            continue
+        reference = np.median(slices[rows], axis=0)
+        valid = np.flatnonzero(reference > 0)
+        dropouts[np.ix_(rows, valid)] = slices[np.ix_(rows, valid)] < (1 - DROPOUT) * reference[valid]
+    metrics.update({
+        'dropout_volumes': int(dropouts.any(axis=1).sum()),
+        'dropout_slices': int(dropouts.sum()),
+        # [volume, slice] 목록
+        'dropouts': [[int(v), int(z)] for v, z in zip(*np.nonzero(dropouts))],
+    })
+    return metrics
+
+
+def nifti_of(stem):
+    for extension in ('.nii.gz', '.nii'):
+        if os.path.exists(stem + extension):
+            return stem + extension
+    return None
+
+
+def run_qc(stem, modality, chunk=CHUNK, force=False):
+    """
+    BIDS 파일 stem (확장자 없는 경로)의 NIfTI에 대한 QC metrics를 stem + '_qc.json'에 기록합니다.
+    QC 파일이 같은 NIfTI (크기, mtime)에 대해 이미 있으면 다시 계산하지 않습니다.
+
+    Returns:
+        dict: metrics (NIfTI가 없으면 None)
+    """
+    path = nifti_of(stem)
+    if path is None:
+        return None
+    st = os.stat(path)
+    source = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    qc_name = stem + SUFFIX
+    if not force and os.path.exists(qc_name):
+        try:
+            with open(qc_name, 'r', encoding='utf-8') as f:
+                previous = json.load(f)
+            if previous.get('source') == source:
+                return previous
+        except ValueError:
+            pass
+
+    start = time.perf_counter()
+    if modality == 'dwi':
+        bval_name = stem + '.bval'
+        bvals = read_bvals(bval_name) if os.path.exists(bval_name) else np.zeros(0)
+        metrics = dwi_metrics(path, bvals, chunk)
+    else:
+        metrics = bold_metrics(path, chunk)
+    metrics.update({'file': os.path.basename(path), 'source': source,
+                    'seconds': round(time.perf_counter() - start, 3)})
+    tmp_name = qc_name + '.tmp'
+    with open(tmp_name, 'w', encoding='utf-8') as f:
+        json.dump(metrics, f, indent=2)
+    os.replace(tmp_name, qc_name)
+    return metrics
+
+
+def add_bidsignore(bids_dir):
+    """
+    QC 파일들을 bids_dir/.bidsignore에 추가합니다 (이미 있는 줄은 그대로).
+    """
+    name = os.path.join(bids_dir, '.bidsignore')
+    lines = open(name, 'r').read().splitlines() if os.path.exists(name) else []
+    missing = [line for line in BIDSIGNORE if line not in lines]
+    if missing:
+        with open(name, 'a') as f:
+            f.write(''.join(line + '\n' for line in missing))
+
+
+def runs(index, suffix):
+    """
+    index의 모든 func/dwi 폴더에서 suffix (예: '.nii.gz', '_qc.json')로 끝나는 파일을 (modality, 경로)로 반환합니다.
+    backup 폴더는 포함하지 않습니다.
+    """
+    found = []
+    for sub in index.subjects():
+        for ses in index.sessions(sub) or [None]:
+            for modality in ('func', 'dwi'):
+                for name in index.files(sub, ses, modality, '*' + suffix):
+                    found.append((modality, str(index.path(sub, ses, modality) / name)))
+    return found
+
+
+def aggregate(bids_dir, index=None):
+    """
+    bids_dir의 QC 파일들을 bids_dir/qc.tsv (run마다 한 줄)로 모으고, modality별 요약 (문자열 목록)을 반환합니다.
+    """
+    index = index or BIDSIndex(bids_dir)
+    rows = []
+    for modality, qc_name in runs(index, SUFFIX):
+        with open(qc_name, 'r', encoding='utf-8') as f:
+            metrics = json.load(f)
+        row = {column: metrics.get(column, '') for column in COLUMNS}
+        row['file'] = os.path.relpath(os.path.join(os.path.dirname(qc_name), metrics['file']), bids_dir)
+        rows.append(row)
+    rows.sort(key=lambda row: row['file'])
+    tsv_name = os.path.join(bids_dir, 'qc.tsv')
+    with open(tsv_name + '.tmp', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS, delimiter='\t', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows({key: 'n/a' if value is None else value for key, value in row.items()} for row in rows)
+    os.replace(tsv_name + '.tmp', tsv_name)
+    add_bidsignore(bids_dir)
+
+    lines = []
+    for modality, column, outliers in (('func', 'tsnr_median', 'outliers'), ('dwi', 'b0_snr', 'dropout_volumes')):
+        selected = [row for row in rows if row['modality'] == modality]
+        values = [row[column] for row in selected if isinstance(row[column], (int, float))]
+        flagged = sum(1 for row in selected if isinstance(row[outliers], int) and row[outliers] > 0)
+        if selected:
+            median = f"{np.median(values):.1f}" if values else 'n/a'
+            lines.append(f"{modality}: {len(selected)} run(s), median {column} {median}, {flagged} run(s) with {outliers}")
+    return lines
+
+
+def qc_dataset(bids_dir, chunk=CHUNK, force=False):
+    """
+    bids_dir의 모든 BOLD/DWI run의 QC를 (없거나 NIfTI가 바뀐 경우) 계산하고 qc.tsv를 만듭니다.
+    """
+    index = BIDSIndex(bids_dir)
+    for modality, path in runs(index, '.nii.gz') + runs(index, '.nii'):
+        stem = path[:-len('.nii.gz')] if path.endswith('.gz') else path[:-len('.nii')]
+        try:
+            run_qc(stem, modality, chunk, force)
+        except Exception as e:
+            print(f"Error in {path}: {e}")
+    # QC 파일이 추가되었으므로 index를 다시 읽음
+    return aggregate(bids_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="QC metrics (tSNR, DVARS outliers, b0 SNR, DWI signal dropout) of "
+                                                 "the BOLD and DWI runs of a BIDS folder, with bounded memory")
+    parser.add_argument("bids_dir", nargs='?', help="BIDS folder (default: data.output_path of config.yaml)")
+    parser.add_argument("--chunk", type=int, default=CHUNK, help="Volumes read at a time")
+    parser.add_argument("--force", action="store_true", help="Compute again even if the QC file is up to date")
+    args = parser.parse_args()
+    if args.bids_dir is None:
+        from settings import output_path
+
+        args.bids_dir = output_path()
+    for line in qc_dataset(args.bids_dir, args.chunk, args.force):
+        print(line)
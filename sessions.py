@@ -0,0 +1,92 @@
+import csv
+import os
+from contextlib import contextmanager, nullcontext
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# sub-XX_sessions.tsv의 column 순서
+COLUMNS = ['session_id', 'acq_time', 'FOLDER', 'anat', 'dwi', 'func', 'BACKUP-anat', 'BACKUP-dwi', 'BACKUP-func']
+
+
+@contextmanager
+def locked(tsv_name):
+    """
+    tsv_name에 대한 배타 lock (같은 폴더의 숨김 파일 .<tsv 이름>.lock에 POSIX lock).
+    여러 process (shard.py의 worker들, 다른 node 포함)가 같은 subject의 sessions.tsv를 갱신할 때 사용합니다.
+    fcntl이 없으면 (Windows) lock 없이 실행합니다.
+    """
+    if fcntl is None:
+        yield
+        return
+    lock_name = os.path.join(os.path.dirname(tsv_name), '.' + os.path.basename(tsv_name) + '.lock')
+    with open(lock_name, 'a') as f:
+        fcntl.lockf(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(f, fcntl.LOCK_UN)
+
+
+def read_rows(tsv_name):
+    if not os.path.exists(tsv_name):
+        return []
+    with open(tsv_name, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f, delimiter='\t'))
+
+
+class SessionSummary:
+    """
+    실행 중에 subject별 sessions.tsv의 row들을 메모리에 모아 두었다가 한 번에 기록합니다.
+
+    각 tsv 파일은 처음 필요할 때 한 번만 읽습니다. flush()에서는 파일마다 디스크의 현재 내용을 다시 읽어
+    이 process가 추가한 row만 합친 뒤 임시 파일에 쓰고 os.replace로 교체합니다. 따라서 다른 process가
+    그 사이에 추가한 row도 유지되고, 중간에 중단되어도 tsv 파일이 잘린 채로 남지 않습니다.
+    같은 FOLDER의 row가 다시 추가되면 이전 row를 대체합니다.
+    shared가 True이면 (여러 process가 같은 출력 폴더에 기록하는 경우) 파일마다 lock을 잡고 합칩니다.
+    """
+
+    def __init__(self, shared=False):
+        self.shared = shared
+        self.tables = {}
+        self.added = {}
+
+    def load(self, tsv_name):
+        """
+        tsv_name의 row 목록을 반환합니다. 파일이 없으면 빈 목록으로 시작합니다.
+        """
+        if tsv_name not in self.tables:
+            self.tables[tsv_name] = read_rows(tsv_name)
+        return self.tables[tsv_name]
+
+    def add(self, tsv_name, session):
+        """
+        session (COLUMNS를 key로 갖는 dict)을 tsv_name의 row로 추가하고, 해당 subject의 row 목록을 반환합니다.
+        """
+        row = {column: session[column] for column in COLUMNS}
+        rows = [r for r in self.load(tsv_name) if r['FOLDER'] != row['FOLDER']]
+        rows.append(row)
+        self.tables[tsv_name] = rows
+        self.added.setdefault(tsv_name, {}).pop(row['FOLDER'], None)
+        self.added[tsv_name][row['FOLDER']] = row
+        return rows
+
+    def flush(self):
+        """
+        바뀐 sessions.tsv 파일들을 디스크의 현재 내용과 합쳐 기록합니다.
+        """
+        for tsv_name in sorted(self.added):
+            added = self.added[tsv_name]
+            with locked(tsv_name) if self.shared else nullcontext():
+                rows = [r for r in read_rows(tsv_name) if r['FOLDER'] not in added] + list(added.values())
+                tmp_name = tsv_name + '.tmp'
+                with open(tmp_name, 'w', newline='', encoding='utf-8') as f:
+                    writer = csv.DictWriter(f, fieldnames=COLUMNS, delimiter='\t', lineterminator='\n',
+                                            extrasaction='ignore')
+                    writer.writeheader()
+                    writer.writerows(rows)
+                os.replace(tmp_name, tsv_name)
+            self.tables[tsv_name] = rows
+        self.added.clear()
@@ -0,0 +1,34 @@
+import json
+from functools import lru_cache
+
+CONFIG_PATH = 'config.yaml'
+BIDS_CODE_PATH = 'bids_code.json'
+
+
+@lru_cache(maxsize=None)
+def load_config(path=CONFIG_PATH):
+    """
+    config.yaml을 읽어 dict로 반환합니다. 같은 경로는 한 process에서 한 번만 읽으며,
+    모든 호출이 같은 dict를 공유하므로 바꾸지 말고 읽기만 해야 합니다.
+    """
+    import yaml
+
+    with open(path, 'r') as f:
+        return yaml.load(f, Loader=yaml.FullLoader)
+
+
+@lru_cache(maxsize=None)
+def load_bids_code(path=BIDS_CODE_PATH):
+    """
+    bids_code.json을 읽어 dict로 반환합니다 (load_config와 같이 한 번만 읽고 공유).
+    같은 dict이므로 naming.compile_rules의 compile 결과도 공유됩니다.
+    """
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def output_path(path=CONFIG_PATH):
+    """
+    config의 data.output_path (Check_*.py, Add_TaskName.py의 기본 BIDS 폴더).
+    """
+    return load_config(path)["data"]["output_path"]
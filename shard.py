@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+
+from bids_constructor import check_path, get_folders, convert_dicom_session, discard_staging, staging_root
+from dedup import STATS as DEDUP
+from journal import ErrorJournal, journal_path
+from manifest import Manifest
+from plan import load_plan
+from sessions import SessionSummary
+from settings import load_bids_code, load_config
+from workqueue import WorkQueue, worker_name
+
+
+def open_queue(config):
+    """
+    config의 'shard.queue' (기본값: <output_path>/.queue/) 폴더의 WorkQueue를 반환합니다.
+    모든 worker가 같은 경로로 접근할 수 있어야 합니다 (NAS).
+    """
+    options = config.get('shard') or {}
+    path = options.get('queue') or config['data']['output_path'] + '.queue/'
+    return WorkQueue(path, lease=int(options.get('lease', 600)))
+
+
+def planned_folders(config):
+    """
+    data.plan이 있으면 (plan의 {세션 폴더: 시리즈 목록}, 폴더 목록), 없으면 (None, get_folders의 폴더 목록).
+    """
+    if config['data'].get('plan'):
+        planned = load_plan(config['data']['plan'])
+        return planned, list(planned)
+    return None, get_folders(config=config)[0]
+
+
+def enqueue(config):
+    """
+    coordinator: 입력 세션 폴더들을 queue에 추가합니다.
+    """
+    queue = open_queue(config)
+    planned, folders = planned_folders(config)
+    added = queue.enqueue(folders)
+    print(f"{added} new folder(s) queued in {queue.path} ({len(folders)} found)")
+
+
+def work(config, bids_code, owner):
+    """
+    worker: queue에서 세션 폴더를 하나씩 잡아 변환합니다.
+    모든 task가 끝나면 종료하고, 다른 worker가 처리 중인 task만 남았으면 lease가 만료되는지 기다립니다.
+    sessions.tsv는 폴더마다 lock을 잡고 디스크의 내용과 합쳐 기록합니다 (sessions.py).
+
+    Returns:
+        int: 이 worker가 처리한 폴더 수.
+    """
+    queue = open_queue(config)
+    poll = float((config.get('shard') or {}).get('poll', 10))
+    planned = load_plan(config['data']['plan']) if config['data'].get('plan') else None
+    check_path(config['data']['output_path'])
+    # worker마다 자기 manifest에 기록 (읽을 때는 모든 worker의 manifest를 읽음)
+    manifest = Manifest(config['data']['output_path'], name=f'.manifest-{owner}.jsonl') \
+        if config['data'].get('resume', False) else None
+    summary = SessionSummary(shared=True)
+    # 모든 worker가 같은 journal에 기록 (journal.py)
+    journal = ErrorJournal(journal_path(config), run=owner)
+    failed = journal.failed()
+    processed = 0
+    while True:
+        lease, busy = queue.claim(owner)
+        if lease is None:
+            if not busy:
+                break
+            time.sleep(poll)
+            continue
+
+        f = lease.task['folder']
+        logging.info(f" [{owner}] {f}")
+        stop = queue.heartbeat(lease)
+        start = time.perf_counter()
+        result = {}
+        try:
+            convert_dicom_session(f, config, bids_code, manifest=manifest, summary=summary, planned=planned)
+            status = 'ok'
+            if f in failed:
+                journal.resolved(f)
+        except Exception as ee:
+            print(f"Error in folder {f} \n")
+            print(ee)
+            status = 'error'
+            result = {'error': str(ee), 'files': discard_staging(config, f)}
+            if config['data']['log']:
+                journal.error(f, ee, files=result['files'])
+        finally:
+            summary.flush()
+            stop.set()
+        if lease.lost:
+            logging.warning(f" [{owner}] lease on {f} expired while converting; it may be converted again")
+        queue.complete(lease, owner, status, seconds=time.perf_counter() - start, **result)
+        processed += 1
+    try:
+        # 다른 worker가 아직 사용 중이면 남겨 둠
+        os.rmdir(staging_root(config))
+    except OSError:
+        pass
+    return processed
+
+
+def run_worker(config_path, bids_code_path, owner):
+    logging.basicConfig(level=logging.INFO)
+    config, bids_code = load(config_path, bids_code_path)
+    count = work(config, bids_code, owner)
+    logging.info(f" [{owner}] {count} folder(s) converted")
+    if DEDUP.summary():
+        logging.info(f" [{owner}] Deduplicated: {DEDUP.summary()}")
+
+
+def status(config):
+    """
+    queue의 상태와 실패한 폴더를 출력합니다 (실패의 자세한 기록은 error journal, journal.py).
+    """
+    counts, errors = open_queue(config).status()
+    print(', '.join(f"{name}: {count}" for name, count in counts.items()))
+    for result in errors:
+        print(f"Folder: {result['folder']} ({result['owner']}) \n\t{result['error']}")
+        for e in result.get('files', []):
+            print(f"\t \t{e}")
+
+
+def load(config_path, bids_code_path):
+    return load_config(config_path), load_bids_code(bids_code_path)
+
+
+def run(command, config_path, bids_code_path, processes=1, name=None):
+    """
+    command (enqueue, work, status)를 실행합니다. work는 이 node에서 processes개의 worker process를 시작합니다.
+    """
+    config, bids_code = load(config_path, bids_code_path)
+    if command == 'enqueue':
+        enqueue(config)
+    elif command == 'status':
+        status(config)
+    else:
+        name = name or worker_name()
+        if processes <= 1:
+            run_worker(config_path, bids_code_path, name)
+        else:
+            workers = [multiprocessing.Process(target=run_worker, args=(config_path, bids_code_path, f"{name}-{i}"))
+                       for i in range(processes)]
+            for p in workers:
+                p.start()
+            for p in workers:
+                p.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sharded conversion: session folders are shared between workers "
+                                                 "(on one or several nodes) through a work queue on the NAS")
+    parser.add_argument("command", choices=['enqueue', 'work', 'status'],
+                        help="enqueue: queue the input folders (coordinator), work: convert queued folders, "
+                             "status: show the queue")
+    parser.add_argument("--config", default="config.yaml", help="Configuration file")
+    parser.add_argument("--bids-code", default="bids_code.json", help="BIDS coding keys")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes started on this node")
+    parser.add_argument("--name", default=None, help="Worker name (default: <host>-<pid>)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run(args.command, args.config, args.bids_code, processes=args.processes, name=args.name)
@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+
+def bids_entities(file_name):
+    """
+    BIDS 파일 이름에서 entity들과 suffix를 읽습니다.
+    예) "sub-PAT81_ses-acute_task-rest_run-0_bold.json"
+        → {'sub': 'PAT81', 'ses': 'acute', 'task': 'rest', 'run': '0', 'suffix': 'bold'}
+        "sub-PAT81_ses-acute_T1w_bck-0.json" → {'sub': 'PAT81', 'ses': 'acute', 'bck': '0', 'suffix': 'T1w'}
+    """
+    stem = os.path.basename(file_name).split('.')[0]
+    parts = stem.split('_')
+    entities = dict(part.split('-', 1) for part in parts if '-' in part)
+    # backup 파일 ("..._bold_bck-0")도 같은 suffix를 갖도록 '-'가 없는 마지막 부분을 suffix로 사용
+    entities['suffix'] = ([part for part in parts if '-' not in part] or [''])[-1]
+    return entities
+
+
+def sidecar_updates(file_name, rules):
+    """
+    BIDS 파일 이름 file_name의 suffix에 해당하는 rules의 key/value를 반환합니다.
+    문자열 value는 파일 이름의 entity로 format됩니다 (예: "{task}" → "rest").
+    entity가 없어 format할 수 없는 key는 건너뜁니다.
+
+    Parameters:
+        file_name (str): BIDS 파일 이름 (경로 가능).
+        rules (dict): suffix → {key: value} (예: {'bold': {'TaskName': '{task}'}}).
+    """
+    entities = bids_entities(file_name)
+    updates = {}
+    for key, value in (rules or {}).get(entities['suffix'], {}).items():
+        if isinstance(value, str):
+            try:
+                value = value.format(**entities)
+            except KeyError:
+                continue
+        updates[key] = value
+    return updates
+
+
+def patch_sidecar(json_file, updates):
+    """
+    JSON sidecar json_file에 updates를 적용합니다. 모든 key가 이미 같은 값이면 파일을 쓰지 않습니다.
+    같은 폴더의 임시 파일에 쓴 뒤 (원래 파일의 권한으로) os.replace로 교체하므로 중단되어도 sidecar가 잘리지 않습니다.
+
+    Returns:
+        str: 'updated', 'unchanged' 또는 'skipped' (JSON 내용이 object가 아님)
+    """
+    with open(json_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        return 'skipped'
+    if all(key in data and data[key] == value for key, value in updates.items()):
+        return 'unchanged'
+
+    data.update(updates)
+    fd, tmp_name = tempfile.mkstemp(prefix='.' + os.path.basename(json_file), dir=os.path.dirname(json_file))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4)
+        # mkstemp은 0600으로 만들므로 원래 sidecar의 권한을 유지
+        shutil.copymode(json_file, tmp_name)
+        os.replace(tmp_name, json_file)
+    except BaseException:
+        os.remove(tmp_name)
+        raise
+    return 'updated'
+
+
+def find_sidecars(root_folder, modality=None, backups=False):
+    """
+    root_folder 아래의 BIDS JSON sidecar들을 찾습니다 (숨김 폴더 제외).
+    modality가 주어지면 그 이름의 폴더 (예: 'func') 안의 파일만, backups가 False이면 backup 폴더는 제외합니다.
+    """
+    sidecars = []
+    for path, dirs, files in os.walk(root_folder):
+        dirs[:] = [d for d in dirs if not d.startswith('.') and (backups or d != 'backup')]
+        folder = os.path.basename(path)
+        if folder == 'backup':
+            folder = os.path.basename(os.path.dirname(path))
+        if modality is not None and folder != modality:
+            continue
+        sidecars.extend(os.path.join(path, name) for name in files if name.startswith('sub-') and name.endswith('.json'))
+    return sorted(sidecars)
+
+
+def patch_sidecars(json_files, rules, workers=8):
+    """
+    json_files 각각에 rules (suffix → {key: value})를 thread pool로 적용합니다.
+
+    Returns:
+        list: (json 파일, 결과) 목록. 결과는 patch_sidecar의 반환값, 적용할 rule이 없으면 'unchanged',
+              오류가 나면 예외 메시지입니다.
+    """
+    def patch(json_file):
+        try:
+            updates = sidecar_updates(json_file, rules)
+            return json_file, patch_sidecar(json_file, updates) if updates else 'unchanged'
+        except Exception as e:
+            return json_file, f"error: {e}"
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(patch, json_files))
@@ -0,0 +1,85 @@
+import os
+
+from archives import archive_header, archive_members, is_archive_series
+from criteria import header_criteria
+
+# DICOM 파일에서 읽는 attribute (pixel data는 읽지 않음)
+TRIAGE_TAGS = ['ProtocolName', 'SeriesDescription', 'ImageType', 'NumberOfTemporalPositions']
+
+
+def list_dicoms(df):
+    """
+    DICOM 시리즈 폴더 df의 파일 목록 (숨김 파일 제외, 정렬됨)을 반환합니다.
+    archive 시리즈 (archives.py)는 archive 안의 파일 이름 목록입니다.
+    """
+    if is_archive_series(df):
+        return archive_members(df)
+    return sorted(e.path for e in os.scandir(df) if e.is_file() and not e.name.startswith('.'))
+
+
+def first_dicom(df, files):
+    """
+    시리즈 df에서 header를 읽을 파일 (pydicom.dcmread에 넘김). archive 시리즈는 압축을 풀지 않고 archive에서 읽은
+    첫 번째 파일의 앞부분입니다.
+    """
+    return archive_header(df) if is_archive_series(df) else files[0]
+
+
+def header_info(ds, files):
+    """
+    header만 읽은 dataset ds와 시리즈의 파일 목록 files로부터 triage 정보를 만듭니다.
+    """
+    image_type = [str(v).upper() for v in ds.get('ImageType', [])]
+    # Siemens MOSAIC: 파일 하나가 volume 하나, 그 외에는 NumberOfTemporalPositions가 있을 때만 volume 수를 알 수 있음
+    if ds.get('NumberOfTemporalPositions'):
+        volumes = int(ds.NumberOfTemporalPositions)
+    elif 'MOSAIC' in image_type:
+        volumes = len(files)
+    else:
+        volumes = None
+
+    return {
+        # dcm2niix의 %p와 같이 공백은 '_'로 바뀝니다
+        'protocol': str(ds.get('ProtocolName', '')).strip().replace(' ', '_'),
+        'series_description': str(ds.get('SeriesDescription', '')),
+        'image_type': image_type,
+        'instances': len(files),
+        'volumes': volumes,
+    }
+
+
+def read_series_header(df):
+    """
+    DICOM 시리즈 폴더 df에서 첫 번째 파일의 header만 읽어 triage에 필요한 정보를 반환합니다.
+
+    Parameters:
+        df (str): DICOM 시리즈 폴더 또는 archive 시리즈 경로.
+
+    Returns:
+        dict: 'protocol', 'series_description', 'image_type', 'instances', 'volumes' (알 수 없으면 None).
+              DICOM 파일을 읽을 수 없으면 None.
+    """
+    files = list_dicoms(df)
+    if not files:
+        return None
+    import pydicom
+
+    try:
+        ds = pydicom.dcmread(first_dicom(df, files), stop_before_pixels=True, specific_tags=TRIAGE_TAGS)
+    except Exception:
+        return None
+    return header_info(ds, files)
+
+
+def triage_series(df, bids_code):
+    """
+    변환 전에 DICOM header만으로 시리즈 df를 변환할지 결정합니다.
+    header를 읽을 수 없는 시리즈는 변환하고, 변환 후의 inclusion_or_exclusion_criteria가 판단합니다.
+
+    Returns:
+        tuple: (변환 여부, 제외 이유)
+    """
+    series_info = read_series_header(df)
+    if series_info is None:
+        return True, ''
+    return header_criteria(series_info, bids_code)
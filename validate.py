@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import Check_anat
+import Check_DWI
+import Check_session
+import Check_subjects
+from bids_index import BIDSIndex
+
+# 등록된 검사 규칙: 이름 → function(index, subject) → finding 목록
+RULES = {}
+
+# report (TSV)의 column 순서
+FINDING_COLUMNS = ['rule', 'subject', 'session', 'status', 'message']
+
+
+def rule(name):
+    """
+    function(index, subject)을 name이라는 검사 규칙으로 등록하는 decorator.
+    function은 finding(dict: session, status ('pass' 또는 'fail'), message) 목록을 반환합니다.
+    """
+    def register(function):
+        RULES[name] = function
+        return function
+    return register
+
+
+def finding(session, passed, message=''):
+    return {'session': session, 'status': 'pass' if passed else 'fail', 'message': message}
+
+
+@rule('anat_complete')
+def anat_complete(index, sub):
+    """T1w와 T2w가 각 세션의 anat 폴더에 있는지 확인합니다 (Check_anat)."""
+    return [finding(ses, not missing, f"Missing: {', '.join(missing)}" if missing else '')
+            for ses, missing in Check_anat.check_subject(index, sub)]
+
+
+@rule('dwi_files')
+def dwi_files(index, sub):
+    """각 세션의 dwi 폴더에 bvec, bval, nii.gz가 있는지 확인합니다 (Check_DWI)."""
+    findings = []
+    for ses, errors in Check_DWI.check_subject(index, sub):
+        findings.extend(finding(ses, False, error) for error in errors)
+        if not errors:
+            findings.append(finding(ses, True))
+    return findings
+
+
+@rule('dwi_gradients')
+def dwi_gradients(index, sub):
+    """각 DWI run의 gradient table (항목 수, unit norm, b0, dataset의 shell 구성)을 확인합니다 (Check_DWI)."""
+    findings = []
+    for ses, name, errors in Check_DWI.dataset_gradients(index).get(sub, []):
+        findings.extend(finding(ses, False, f"{name}: {error}") for error in errors)
+        if not errors:
+            findings.append(finding(ses, True, name))
+    return findings
+
+
+@rule('session_order')
+def session_order(index, sub):
+    """follow-up 세션이 acute (그리고 followup1) 세션 없이 존재하지 않는지 확인합니다 (Check_session)."""
+    problems = Check_session.check_subject(index, sub)
+    return [finding('', False, problem) for problem in problems] or [finding('', True)]
+
+
+@rule('folder_consistency')
+def folder_consistency(index, sub):
+    """sessions.tsv의 FOLDER가 subject 번호와 세션 label에 맞는지 확인합니다 (Check_subjects, sub-PAT*만)."""
+    if not sub.startswith('sub-PAT'):
+        return []
+    success, errors = Check_subjects.check_subject(index, sub)
+
+    def session_of(msg):
+        # 메시지는 "sub-XX - ses-YY: ..." 형식 (세션과 관계없는 오류는 "sub-XX: ...")
+        return msg.split(' - ')[1].split(':')[0] if ' - ' in msg else ''
+
+    return [finding(session_of(msg), True, msg) for msg in success] + \
+        [finding(session_of(msg), False, msg) for msg in errors]
+
+
+def evaluate_subject(index, sub, rules):
+    """
+    subject sub에 대해 rules를 순서대로 실행합니다.
+
+    Returns:
+        tuple: (finding 목록, 규칙별 실행 시간 (초))
+    """
+    findings, timings = [], {}
+    for name in rules:
+        start = time.perf_counter()
+        try:
+            results = RULES[name](index, sub)
+        except Exception as e:
+            results = [finding('', False, f"{type(e).__name__}: {e}")]
+        timings[name] = time.perf_counter() - start
+        findings.extend(dict(rule=name, subject=sub, **result) for result in results)
+    return findings, timings
+
+
+def validate(bids_dir, rules=None, workers=8, index=None):
+    """
+    bids_dir의 모든 subject에 대해 등록된 규칙들을 병렬로 (subject 단위) 실행하고 report를 반환합니다.
+
+    Parameters:
+        bids_dir (str): BIDS 데이터셋 최상위 디렉토리 경로.
+        rules (list): 실행할 규칙 이름 목록. None이면 등록된 모든 규칙.
+        workers (int): 동시에 검사하는 subject 수.
+        index (BIDSIndex): 이미 만든 index (없으면 새로 만듦).
+
+    Returns:
+        dict: 'bids_dir', 'subjects', 'seconds', 'rules' (규칙별 pass/fail 수와 시간), 'findings'
+    """
+    start = time.perf_counter()
+    rules = list(rules or RULES)
+    if index is None:
+        index = BIDSIndex(bids_dir)
+    subjects = index.subjects()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # map은 입력 순서대로 결과를 돌려주므로 report는 실행마다 같은 순서입니다
+        results = list(executor.map(lambda sub: evaluate_subject(index, sub, rules), subjects))
+
+    summary = {name: {'passed': 0, 'failed': 0, 'seconds': 0.0} for name in rules}
+    findings = []
+    for subject_findings, timings in results:
+        findings.extend(subject_findings)
+        for name, seconds in timings.items():
+            summary[name]['seconds'] += seconds
+        for item in subject_findings:
+            summary[item['rule']]['passed' if item['status'] == 'pass' else 'failed'] += 1
+
+    return {
+        'bids_dir': str(bids_dir),
+        'subjects': len(subjects),
+        'seconds': time.perf_counter() - start,
+        'rules': summary,
+        'findings': findings,
+    }
+
+
+def write_report(report, json_path=None, tsv_path=None):
+    """
+    report를 JSON (전체) 및/또는 TSV (finding 목록)로 기록합니다.
+    """
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if tsv_path:
+        with open(tsv_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=FINDING_COLUMNS, delimiter='\t', lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(report['findings'])
+
+
+def print_report(report):
+    """
+    규칙별 pass/fail 수와 시간을 출력하고, 실패한 규칙이 있으면 1 (아니면 0)을 반환합니다 (exit code).
+    """
+    print(f"{report['subjects']} subject(s) in {report['seconds']:.2f} s")
+    print(f"{'rule':<22}{'passed':>8}{'failed':>8}{'seconds':>10}")
+    for name, result in report['rules'].items():
+        print(f"{name:<22}{result['passed']:>8}{result['failed']:>8}{result['seconds']:>10.4f}")
+    return 1 if any(result['failed'] for result in report['rules'].values()) else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="등록된 모든 검사 (anat, DWI, session 순서, FOLDER 일치)를 subject 단위로 병렬 실행하고 "
+                    "JSON/TSV report를 만듭니다."
+    )
+    parser.add_argument("bids_dir", nargs='?', help="BIDS 데이터셋 최상위 디렉토리 경로 (기본값: config.yaml의 output_path)")
+    parser.add_argument("--json", help="JSON report 경로")
+    parser.add_argument("--tsv", help="TSV report 경로 (finding 목록)")
+    parser.add_argument("--workers", type=int, default=8, help="동시에 검사하는 subject 수")
+    parser.add_argument("--rules", nargs='+', choices=sorted(RULES), help="실행할 규칙 (기본값: 모두)")
+    args = parser.parse_args()
+
+    bids_path = args.bids_dir
+    if bids_path is None:
+        from settings import output_path
+
+        bids_path = output_path()
+
+    report = validate(bids_path, rules=args.rules, workers=args.workers)
+    write_report(report, json_path=args.json, tsv_path=args.tsv)
+    sys.exit(print_report(report))
@@ -0,0 +1,224 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+
+def write_json(path, data):
+    """
+    data를 임시 파일에 쓴 뒤 os.replace로 path에 기록합니다 (읽는 쪽은 완전한 파일만 봅니다).
+    """
+    tmp_name = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_name, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_name, path)
+
+
+def read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def worker_name():
+    """
+    이 process의 기본 worker 이름 (<host>-<pid>).
+    """
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Lease:
+    """
+    worker가 잡고 있는 task 하나의 lease.
+
+    Attributes:
+        key (str): task 이름.
+        task (dict): task 내용 ('folder', 'order').
+        token (str): lease 파일에 기록된 이 lease만의 값 (다른 worker가 가져갔는지 확인용).
+        lost (bool): heartbeat 중에 lease가 만료되어 다른 worker가 가져간 경우 True.
+    """
+    __slots__ = ('key', 'task', 'token', 'lost')
+
+    def __init__(self, key, task, token):
+        self.key, self.task, self.token, self.lost = key, task, token, False
+
+
+class WorkQueue:
+    """
+    공유 폴더 (NAS)에 있는 파일 기반 work queue.
+
+    tasks/<key>.json은 처리할 세션 폴더, leases/<key>는 처리 중인 worker의 lease, done/<key>.json은 결과입니다.
+    lease는 O_EXCL로 만들므로 한 task는 한 worker만 잡을 수 있고, worker는 처리하는 동안 heartbeat로
+    lease 파일의 mtime을 갱신합니다. lease 시간 (초)보다 오래 갱신되지 않은 lease는 (worker가 죽은 것으로 보고)
+    다른 worker가 rename으로 가져갑니다. SQLite와 달리 NFS에서도 동작하는 rename, O_EXCL, link만 사용합니다.
+    node 사이의 시계 차이가 lease 시간보다 충분히 작아야 합니다.
+    """
+
+    def __init__(self, path, lease=600):
+        self.path = path
+        self.lease = lease
+        self.tasks = os.path.join(path, 'tasks')
+        self.leases = os.path.join(path, 'leases')
+        self.done = os.path.join(path, 'done')
+        self.order = None
+        for folder in (self.tasks, self.leases, self.done):
+            os.makedirs(folder, exist_ok=True)
+
+    def enqueue(self, folders):
+        """
+        세션 폴더들을 순서대로 추가합니다. 이미 있는 task (같은 폴더 이름)는 그대로 둡니다.
+
+        Returns:
+            int: 새로 추가된 task 수.
+        """
+        added = 0
+        existing = set(os.listdir(self.tasks))
+        for order, folder in enumerate(folders):
+            key = os.path.basename(folder.rstrip('/'))
+            if key + '.json' not in existing:
+                write_json(os.path.join(self.tasks, key + '.json'), {'folder': folder, 'order': order})
+                added += 1
+        return added
+
+    def keys(self):
+        """
+        모든 task 이름을 enqueue한 순서대로 반환합니다. task 파일은 바뀌지 않으므로 새 task가 있을 때만 다시 읽습니다.
+        """
+        names = [name for name in os.listdir(self.tasks) if name.endswith('.json')]
+        if self.order is None or len(self.order) != len(names):
+            orders = {name[:-len('.json')]: (read_json(os.path.join(self.tasks, name)) or {}).get('order', 0)
+                      for name in names}
+            self.order = sorted(orders, key=lambda key: (orders[key], key))
+        return self.order
+
+    def expired(self, lease_path):
+        try:
+            return time.time() - os.stat(lease_path).st_mtime > self.lease
+        except FileNotFoundError:
+            return False
+
+    def reclaim(self, key):
+        """
+        만료된 lease를 치웁니다. 다른 worker가 그 사이에 lease를 새로 잡았으면 되돌려 놓습니다.
+        """
+        lease_path = os.path.join(self.leases, key)
+        stale = f"{lease_path}.{uuid.uuid4().hex}.expired"
+        try:
+            os.rename(lease_path, stale)
+        except FileNotFoundError:
+            return
+        if not self.expired(stale):
+            # 확인한 뒤에 갱신된 lease를 옮겼음: 새 lease가 없을 때만 되돌림
+            try:
+                os.link(stale, lease_path)
+            except FileExistsError:
+                pass
+        os.remove(stale)
+
+    def try_lease(self, key, owner):
+        lease_path = os.path.join(self.leases, key)
+        if self.expired(lease_path):
+            self.reclaim(key)
+        token = uuid.uuid4().hex
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'owner': owner, 'token': token, 'claimed': time.time()}, f)
+        return token
+
+    def claim(self, owner):
+        """
+        완료되지 않았고 lease가 없는 (또는 만료된) 첫 번째 task의 lease를 잡습니다.
+
+        Returns:
+            tuple: (Lease 또는 None, 다른 worker가 처리 중인 task 수)
+        """
+        done = set(os.listdir(self.done))
+        busy = 0
+        for key in self.keys():
+            if key + '.json' in done:
+                continue
+            token = self.try_lease(key, owner)
+            if token is None:
+                busy += 1
+                continue
+            if os.path.exists(os.path.join(self.done, key + '.json')):
+                # lease를 잡는 사이에 다른 worker가 완료함
+                self.release(Lease(key, None, token))
+                continue
+            return Lease(key, read_json(os.path.join(self.tasks, key + '.json')), token), busy
+        return None, busy
+
+    def holds(self, lease):
+        """
+        lease 파일이 아직 이 lease의 것이면 True.
+        """
+        data = read_json(os.path.join(self.leases, lease.key))
+        return data is not None and data.get('token') == lease.token
+
+    def renew(self, lease):
+        """
+        lease의 mtime을 갱신합니다. lease를 잃었으면 lease.lost를 True로 설정하고 False를 반환합니다.
+        """
+        if not self.holds(lease):
+            lease.lost = True
+            return False
+        os.utime(os.path.join(self.leases, lease.key))
+        return True
+
+    def heartbeat(self, lease):
+        """
+        lease 시간의 1/3마다 lease를 갱신하는 thread를 시작하고, 멈출 때 set할 threading.Event를 반환합니다.
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease / 3):
+                if not self.renew(lease):
+                    return
+
+        threading.Thread(target=beat, daemon=True).start()
+        return stop
+
+    def release(self, lease):
+        """
+        lease를 놓습니다 (이 lease의 것일 때만 lease 파일을 삭제).
+        """
+        if self.holds(lease):
+            try:
+                os.remove(os.path.join(self.leases, lease.key))
+            except FileNotFoundError:
+                pass
+
+    def complete(self, lease, owner, status, **result):
+        """
+        task의 결과 (status: 'ok' 또는 'error')를 done/에 기록하고 lease를 놓습니다.
+        """
+        write_json(os.path.join(self.done, lease.key + '.json'),
+                   dict(folder=lease.task['folder'], owner=owner, status=status, finished=time.time(), **result))
+        self.release(lease)
+
+    def status(self):
+        """
+        task 상태별 수 ('pending', 'running', 'expired', 'ok', 'error')와 오류 결과 목록을 반환합니다.
+        """
+        counts = {'pending': 0, 'running': 0, 'expired': 0, 'ok': 0, 'error': 0}
+        errors = []
+        for key in self.keys():
+            result = read_json(os.path.join(self.done, key + '.json'))
+            lease_path = os.path.join(self.leases, key)
+            if result is not None:
+                counts[result['status']] += 1
+                if result['status'] == 'error':
+                    errors.append(result)
+            elif os.path.exists(lease_path):
+                counts['expired' if self.expired(lease_path) else 'running'] += 1
+            else:
+                counts['pending'] += 1
+        return counts, errors